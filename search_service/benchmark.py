@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Reproducible benchmark for the search service.
+
+Runs the app in-process through FastAPI's TestClient against a throwaway
+working directory (its own SQLite database and index snapshot), so it never
+touches ./documents.db. For every corpus format and size it measures:
+
+- /upload throughput (rows/sec, wall clock and as reported by the server)
+- /search latency percentiles (p50/p95/p99) at several concurrency levels
+- service startup time from the saved snapshot and from a cold rebuild
+- peak RSS of the benchmark and of each startup probe
+
+Corpora are synthetic and generated from a fixed seed, so two runs with the
+same arguments upload byte-identical data. Results are written as JSON; pass
+``--compare`` with an earlier results file to print the relative change.
+
+Usage:
+    python benchmark.py --sizes 10000,100000 --formats csv,json,text
+    python benchmark.py --sizes 1000000 --concurrency 1,8,32 --output big.json
+    python benchmark.py --compare bench_results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FORMATS = {"csv": "corpus.csv", "json": "corpus.json", "text": "corpus.txt"}
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vo", "sul", "bri", "den", "qua", "ni", "pe", "zor", "al", "es", "un"]
+CATEGORIES = ["news", "science", "sports", "finance", "travel", "food", "health", "tech"]
+# Records generated per NumPy draw while writing a corpus
+GENERATE_CHUNK = 10_000
+
+def peak_rss_bytes(children: bool = False) -> Optional[int]:
+    """Peak resident set size of this process (or its finished children)"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+def build_vocabulary(size: int, seed: int) -> List[str]:
+    """Deterministic pseudo-words, unique and free of separators"""
+    rng = np.random.default_rng(seed)
+    words, seen = [], set()
+    while len(words) < size:
+        word = "".join(SYLLABLES[i] for i in rng.integers(0, len(SYLLABLES), rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+class CorpusGenerator:
+    """Zipf-distributed synthetic records, written in any supported upload format"""
+
+    def __init__(self, vocabulary_size: int = 20_000, words_per_record: int = 24, seed: int = 42):
+        self.vocabulary = np.array(build_vocabulary(vocabulary_size, seed), dtype=object)
+        self.words_per_record = words_per_record
+        self.seed = seed
+        weights = 1.0 / np.arange(1, vocabulary_size + 1)
+        self.probabilities = weights / weights.sum()
+
+    def records(self, count: int):
+        rng = np.random.default_rng(self.seed + count)
+        for start in range(0, count, GENERATE_CHUNK):
+            n = min(GENERATE_CHUNK, count - start)
+            words = self.vocabulary[rng.choice(self.vocabulary.size, size=(n, self.words_per_record), p=self.probabilities)]
+            categories = rng.integers(0, len(CATEGORIES), n)
+            for i in range(n):
+                yield {
+                    "id": start + i + 1,
+                    "title": " ".join(words[i, :4]),
+                    "content": " ".join(words[i, 4:]),
+                    "category": CATEGORIES[categories[i]],
+                }
+
+    def write(self, path: str, fmt: str, count: int) -> int:
+        """Write ``count`` records to ``path``; returns the file size in bytes"""
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            if fmt == "csv":
+                f.write("id,title,content,category\n")
+                for r in self.records(count):
+                    f.write(f"{r['id']},{r['title']},{r['content']},{r['category']}\n")
+            elif fmt == "json":
+                f.write("[\n")
+                for r in self.records(count):
+                    f.write(("" if r["id"] == 1 else ",\n") + json.dumps(r))
+                f.write("\n]\n")
+            elif fmt == "text":
+                for r in self.records(count):
+                    f.write(f"{r['title'].capitalize()}. {r['content']}.\n\n")
+            else:
+                raise ValueError(f"Unknown corpus format: {fmt}")
+        return os.path.getsize(path)
+
+    def queries(self, count: int) -> List[str]:
+        """Mix of one- and two-term queries over mid-frequency words"""
+        rng = np.random.default_rng(self.seed + 1)
+        pool = self.vocabulary[10:min(500, self.vocabulary.size)]
+        queries = []
+        for i in range(count):
+            terms = rng.choice(pool, size=1 if i % 3 else 2, replace=False)
+            queries.append(" ".join(terms))
+        return queries
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def bench_upload(client, path: str, fmt: str, name: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        response = client.post("/upload", data={"dataset_name": name}, files={"file": (FORMATS[fmt], f)})
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    result = response.json()
+    return {
+        "dataset_id": result["dataset_id"],
+        "format_detected": result["format_detected"]["type"],
+        "rows": result["total_records"],
+        "seconds": round(elapsed, 4),
+        "rows_per_second": round(result["total_records"] / elapsed, 1),
+        "server_ingest_seconds": result.get("ingest_seconds"),
+        "server_rows_per_second": result.get("rows_per_second"),
+    }
+
+def bench_search(client, dataset_id: int, queries: List[str], concurrency: int, top_k: int) -> Dict[str, Any]:
+    def one(query: str) -> float:
+        started = time.perf_counter()
+        response = client.post("/search", json={"query": query, "dataset_id": dataset_id, "top_k": top_k})
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        return elapsed
+
+    # Warm up the index and document store so the first requests don't skew p99
+    for query in queries[:min(10, len(queries))]:
+        one(query)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, queries))
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / wall, 1),
+        **percentiles(latencies),
+    }
+
+def probe_startup() -> None:
+    """Child process entry point: time app startup in the current directory"""
+    started = time.perf_counter()
+    import main
+    from fastapi.testclient import TestClient
+    imported = time.perf_counter()
+    client = TestClient(main.app)
+    client.__enter__()
+    ready = time.perf_counter()
+    client.__exit__(None, None, None)
+    print(json.dumps({
+        "import_seconds": round(imported - started, 4),
+        "startup_seconds": round(ready - imported, 4),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }))
+
+def bench_startup(workdir: str, snapshot: bool) -> Dict[str, Any]:
+    env = dict(os.environ)
+    if not snapshot:
+        # Point at a fresh path so every index is rebuilt from the database
+        env["INDEX_SNAPSHOT_PATH"] = os.path.join(workdir, f"cold_{time.time_ns()}.bin")
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--startup-probe"],
+        cwd=workdir, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    # The app prints progress lines; the probe result is the last one
+    result = json.loads(output.strip().splitlines()[-1])
+    result["snapshot"] = snapshot
+    return result
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="zerostack-bench-")
+    os.chdir(workdir)
+    if not args.with_cache:
+        # Repeated queries would otherwise measure the result cache (or a concurrent
+        # identical search), not the search path
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+        os.environ["SEARCH_COALESCING"] = "0"
+    sys.path.insert(0, HERE)
+    import main
+    from fastapi.testclient import TestClient
+
+    generator = CorpusGenerator(seed=args.seed)
+    queries = generator.queries(args.queries)
+    runs = []
+    with TestClient(main.app) as client:
+        for size in args.sizes:
+            for fmt in args.formats:
+                path = os.path.join(workdir, f"{size}_{FORMATS[fmt]}")
+                started = time.perf_counter()
+                file_size = generator.write(path, fmt, size)
+                print(f"[{fmt} x {size}] generated {file_size / 1e6:.1f} MB in {time.perf_counter() - started:.1f}s")
+                upload = bench_upload(client, path, fmt, f"bench-{fmt}-{size}")
+                os.remove(path)
+                print(f"[{fmt} x {size}] upload {upload['rows']} rows at {upload['rows_per_second']:.0f} rows/s")
+                searches = []
+                for concurrency in args.concurrency:
+                    result = bench_search(client, upload["dataset_id"], queries, concurrency, args.top_k)
+                    searches.append(result)
+                    print(
+                        f"[{fmt} x {size}] search c={concurrency}: p50 {result['p50_ms']}ms "
+                        f"p95 {result['p95_ms']}ms p99 {result['p99_ms']}ms ({result['throughput_rps']} req/s)"
+                    )
+                runs.append({
+                    "format": fmt,
+                    "records": size,
+                    "file_bytes": file_size,
+                    "upload": upload,
+                    "search": searches,
+                })
+    # Leaving the client runs shutdown, which writes the snapshot the warm probe maps
+    startup = [bench_startup(workdir, snapshot=True), bench_startup(workdir, snapshot=False)]
+    for result in startup:
+        kind = "snapshot" if result["snapshot"] else "cold"
+        print(f"startup ({kind}): {result['startup_seconds']}s, peak RSS {(result['peak_rss_bytes'] or 0) / 1e6:.0f} MB")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "sizes": args.sizes,
+            "formats": args.formats,
+            "concurrency": args.concurrency,
+            "queries": args.queries,
+            "top_k": args.top_k,
+            "seed": args.seed,
+            "result_cache": args.with_cache,
+        },
+        "runs": runs,
+        "startup": startup,
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    """Key metrics by a stable name, for comparing two result files"""
+    flat = {}
+    for r in results.get("runs", []):
+        prefix = f"{r['format']}/{r['records']}"
+        flat[f"{prefix}/upload_rows_per_second"] = r["upload"]["rows_per_second"]
+        for s in r["search"]:
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+                flat[f"{prefix}/search_c{s['concurrency']}_{key}"] = s[key]
+    for s in results.get("startup", []):
+        flat[f"startup_{'snapshot' if s['snapshot'] else 'cold'}_seconds"] = s["startup_seconds"]
+    return flat
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> None:
+    before, after = flatten(baseline), flatten(current)
+    print(f"\nChange vs {baseline.get('git_revision') or 'baseline'}:")
+    for key in sorted(before.keys() & after.keys()):
+        if before[key]:
+            print(f"  {key:<48} {before[key]:>12} -> {after[key]:>12} ({(after[key] / before[key] - 1) * 100:+.1f}%)")
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark upload, search and startup of the search service")
+    parser.add_argument("--sizes", type=lambda v: parse_list(v, int), default=[10_000, 100_000],
+                        help="comma-separated corpus sizes in records (default: 10000,100000)")
+    parser.add_argument("--formats", type=parse_list, default=list(FORMATS),
+                        help="comma-separated corpus formats: csv,json,text")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[1, 4, 16],
+                        help="comma-separated search concurrency levels")
+    parser.add_argument("--queries", type=int, default=300, help="search requests per concurrency level")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--with-cache", action="store_true", help="keep the search result cache and search coalescing enabled")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--startup-probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_probe:
+        probe_startup()
+        return
+    unknown = set(args.formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    results = run(args)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    if baseline is not None:
+        compare(baseline, results)
+
+if __name__ == "__main__":
+    main()
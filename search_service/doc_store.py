@@ -0,0 +1,167 @@
+"""
+Memory-compact document store used to hydrate search results.
+
+Records live in slot-backed columns (one list of contents, one array of
+interned tag-set ids) instead of a dict per document. The built-in Document
+table is pinned in memory once loaded; user dataset records are kept in a
+size-capped LRU tier. Both are populated on demand, so hydrating results is
+usually an in-memory lookup and startup does not scan either table.
+"""
+
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Loader for documents missing from memory: ids -> [{"id", "content", "tags"}]
+RecordLoader = Callable[[Sequence[int]], Iterable[dict]]
+
+
+class _Slots:
+    """Column storage for records addressed by slot number"""
+
+    def __init__(self):
+        self.slot_of: "OrderedDict[int, int]" = OrderedDict()
+        self.contents: List[Optional[str]] = []
+        self.tag_set_ids = array("I")
+        self.free: List[int] = []
+
+    def put(self, doc_id: int, content: str, tag_set_id: int) -> None:
+        slot = self.slot_of.get(doc_id)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.contents)
+                self.contents.append(None)
+                self.tag_set_ids.append(0)
+            self.slot_of[doc_id] = slot
+        self.contents[slot] = content
+        self.tag_set_ids[slot] = tag_set_id
+
+    def remove(self, doc_id: int) -> None:
+        slot = self.slot_of.pop(doc_id, None)
+        if slot is not None:
+            self.contents[slot] = None
+            self.free.append(slot)
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+
+class DocumentStore:
+    """Document lookup by id for the built-in table and lazily cached dataset records"""
+
+    def __init__(self, max_records: int = 100_000):
+        self.max_records = max_records
+        self._documents = _Slots()
+        self._records = _Slots()
+        self._tag_sets: List[Tuple[str, ...]] = []
+        self._tag_set_ids: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+        # Bumped by discard_records, so records loaded before a delete are not cached after it
+        self._discards = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _intern_tags(self, tags: Iterable[str]) -> int:
+        key = tuple(sys.intern(tag) for tag in tags)
+        tag_set_id = self._tag_set_ids.get(key)
+        if tag_set_id is None:
+            tag_set_id = self._tag_set_ids[key] = len(self._tag_sets)
+            self._tag_sets.append(key)
+        return tag_set_id
+
+    def _materialize(self, slots: _Slots, doc_id: int) -> Optional[dict]:
+        slot = slots.slot_of.get(doc_id)
+        if slot is None:
+            return None
+        return {
+            "id": doc_id,
+            "content": slots.contents[slot],
+            "tags": list(self._tag_sets[slots.tag_set_ids[slot]]),
+        }
+
+    # Built-in Document table (same interface as the old LockFreeHashMap)
+
+    def insert(self, key: int, value: dict) -> None:
+        with self._lock:
+            self._documents.put(key, value["content"], self._intern_tags(value["tags"]))
+
+    def get(self, key: int) -> Optional[dict]:
+        with self._lock:
+            return self._materialize(self._documents, key)
+
+    def get_documents(self, doc_ids: Sequence[int], loader: RecordLoader) -> List[dict]:
+        """Return built-in documents in order, loading and pinning misses in one call"""
+        return self._get_many(self._documents, doc_ids, loader, None)
+
+    # User dataset records, capped by max_records
+
+    def get_records(self, doc_ids: Sequence[int], loader: RecordLoader) -> List[dict]:
+        """Return dataset records in order, loading misses in one call"""
+        return self._get_many(self._records, doc_ids, loader, self.max_records)
+
+    def get_record(self, doc_id: int, loader: RecordLoader) -> Optional[dict]:
+        records = self.get_records([doc_id], loader)
+        return records[0] if records else None
+
+    def _get_many(
+        self, slots: _Slots, doc_ids: Sequence[int], loader: RecordLoader, cap: Optional[int]
+    ) -> List[dict]:
+        found: Dict[int, dict] = {}
+        with self._lock:
+            for doc_id in doc_ids:
+                record = self._materialize(slots, doc_id)
+                if record is not None:
+                    slots.slot_of.move_to_end(doc_id)
+                    found[doc_id] = record
+            missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+            self.hits += len(found)
+            self.misses += len(missing)
+            discards = self._discards
+        if missing:
+            loaded = list(loader(missing))
+            self._put_many(slots, loaded, cap, discards)
+            for record in loaded:
+                found[record["id"]] = record
+        return [found[doc_id] for doc_id in doc_ids if doc_id in found]
+
+    def _put_many(self, slots: _Slots, records: List[dict], cap: Optional[int], discards: int) -> None:
+        """Cache records, evicting the least recently used beyond the cap
+
+        Dataset records are skipped if any were discarded since they were
+        loaded (``discards``): they may be ones that were deleted meanwhile.
+        """
+        if cap is not None and cap <= 0:
+            return
+        with self._lock:
+            if slots is self._records and discards != self._discards:
+                return
+            for record in records:
+                slots.put(record["id"], record["content"], self._intern_tags(record["tags"]))
+                slots.slot_of.move_to_end(record["id"])
+            while cap is not None and len(slots) > cap:
+                oldest = next(iter(slots.slot_of))
+                slots.remove(oldest)
+                self.evictions += 1
+
+    def discard_records(self, doc_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._discards += 1
+            for doc_id in doc_ids:
+                self._records.remove(doc_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "records": len(self._records),
+                "max_records": self.max_records,
+                "tag_sets": len(self._tag_sets),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
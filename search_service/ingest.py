@@ -0,0 +1,553 @@
+"""
+Streaming format detection and parsing for dataset uploads.
+
+Uploads are read as a text stream: the format is sniffed from a bounded
+prefix, then records are produced by incremental generators so the payload
+is never held in memory as a whole.
+
+Large CSV, JSON Lines and text uploads can also be parsed in parallel: the
+stream is cut into chunks at boundaries no record spans (a newline outside
+quoted CSV fields, a blank line between paragraphs), the chunks are parsed
+in a process pool and the results are merged back in input order. A CSV
+stream with no row boundary in sight is parsed serially from there on.
+"""
+
+import csv
+import io
+import json
+import re
+from collections import deque
+from concurrent.futures import Executor
+from functools import partial
+from itertools import chain, dropwhile, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+# Characters read up front for format detection
+SNIFF_CHARS = 64 * 1024
+# Most characters read past SNIFF_CHARS to complete the first line of the sample
+MAX_FIRST_LINE_CHARS = 16 * 1024 * 1024
+# Characters per read when streaming JSON arrays
+READ_CHUNK_CHARS = 64 * 1024
+# Characters per chunk handed to a worker process in parallel parsing
+PARALLEL_CHUNK_CHARS = 2 * 1024 * 1024
+# Chunks read without finding a CSV row boundary (an unterminated quote, say)
+# before parallel parsing gives up and parses the rest serially
+MAX_UNSPLIT_CHUNKS = 4
+# Chunks in flight per worker, bounding memory while keeping every worker busy
+PARALLEL_CHUNKS_PER_WORKER = 2
+# Formats whose records can be split at safe boundaries (JSON arrays cannot)
+PARALLEL_FORMATS = ("csv", "jsonl", "unstructured")
+
+# A parsed record in the form it is stored: (content, fields, whether the
+# content is just the text of the fields and need not be stored)
+Row = Tuple[str, Optional[Dict[Any, Any]], bool]
+
+# Allow large text fields in CSV uploads (the csv module default is 128 KiB)
+csv.field_size_limit(16 * 1024 * 1024)
+
+def open_text_stream(binary_file) -> TextIO:
+    """Wrap a binary file object in an incremental UTF-8 decoder"""
+    return io.TextIOWrapper(binary_file, encoding="utf-8", newline="")
+
+def read_sample(stream: TextIO) -> str:
+    """Read the bounded prefix used for format detection, extended to the end of its first line"""
+    sample = stream.read(SNIFF_CHARS)
+    if len(sample) >= SNIFF_CHARS and '\n' not in sample:
+        # A first record longer than the sample (a long JSON Lines object) is still sniffed whole
+        sample += stream.readline(MAX_FIRST_LINE_CHARS)
+    return sample
+
+class ParsedPrefix(NamedTuple):
+    """Records decoded while sniffing, and how many sample characters they cover"""
+    records: List[Any]
+    consumed: int
+
+def _sniff_jsonl(sample: str, truncated: bool) -> Optional[ParsedPrefix]:
+    """Decode the sample as JSON Lines, or None if any complete line is not an object"""
+    records = []
+    consumed = 0
+    for line in io.StringIO(sample, newline=''):
+        if truncated and not line.endswith(('\n', '\r')):
+            break  # Cut off mid-record; the stream parser picks it up from here
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return None
+            if not isinstance(record, dict):
+                return None
+            records.append(record)
+        consumed += len(line)
+    return ParsedPrefix(records, consumed) if len(records) > 1 else None
+
+def _truncated_json_type(text: str) -> Optional[str]:
+    """"json" or "jsonl" if a truncated sample (leading space removed) starts to parse as one, else None
+
+    Only the start can be checked: an array's first element, or a whole
+    object, must decode. A one-line object followed by a line break can only
+    be the first record of JSON Lines.
+    """
+    decoder = json.JSONDecoder()
+    try:
+        if text.startswith('['):
+            rest = text[1:].lstrip()
+            if rest.startswith(']'):
+                return "json"
+            _, end = decoder.raw_decode(rest)
+            # "[2024-01-01 ...]" decodes 2024; an element must be followed by ',' or ']'
+            return "json" if rest[end:].lstrip()[:1] in (',', ']') else None
+        _, end = decoder.raw_decode(text)
+    except ValueError:
+        return None
+    if '\n' not in text[:end] and text[end:].lstrip(' \t\r').startswith('\n'):
+        return "jsonl"
+    return "json"
+
+def _looks_delimited(line: str) -> bool:
+    """A non-empty line of one or more non-empty fields split by ',', tab or ';'"""
+    return bool(line) and any(all(line.split(delim)) for delim in (',', '\t', ';'))
+
+def sniff(sample: str) -> Tuple[Dict[str, Any], Optional[ParsedPrefix]]:
+    """Detect the format of uploaded data from a prefix of it
+
+    Whatever had to be decoded to decide (JSON Lines records, a complete
+    small JSON document) is returned too, so parsing resumes after it
+    instead of decoding the prefix a second time.
+    """
+    stripped = sample.strip()
+    if not stripped:
+        return {"type": "unstructured", "confidence": 0.0}, None
+    truncated = len(sample) >= SNIFF_CHARS
+
+    # Try to detect JSON Lines: every sampled line is a standalone JSON object
+    if stripped.startswith('{'):
+        prefix = _sniff_jsonl(sample, truncated)
+        if prefix is not None:
+            return {"type": "jsonl", "confidence": 1.0}, prefix
+
+    # Try to detect JSON; a truncated sample can only be checked for how it starts
+    if stripped.startswith('[') or stripped.startswith('{'):
+        if truncated:
+            json_type = _truncated_json_type(sample.lstrip())
+            if json_type is not None:
+                return {"type": json_type, "confidence": 0.9}, None
+        else:
+            try:
+                value = json.loads(stripped)
+                records = value if isinstance(value, list) else [value]
+                return {"type": "json", "confidence": 1.0}, ParsedPrefix(records, len(sample))
+            except ValueError:
+                pass
+
+    # Try to detect CSV-like format from the first lines only (10 scored, 5 for the delimiter)
+    head = stripped.split('\n', 11)
+    if len(head) > 11:
+        lines = head[:11]
+    elif truncated and len(head) > 1:
+        # The last line of a truncated sample may be cut off mid-record
+        lines = head[:-1]
+    else:
+        lines = head
+    csv_matches = sum(1 for line in lines[:10] if _looks_delimited(line.strip()))
+    csv_confidence = csv_matches / min(len(lines), 10)
+
+    if csv_confidence > 0.6:
+        return {"type": "csv", "confidence": csv_confidence, "delimiter": detect_delimiter(lines)}, None
+    return {"type": "unstructured", "confidence": 1.0 - csv_confidence}, None
+
+def detect_data_format(sample: str) -> Dict[str, Any]:
+    """Detect the format of uploaded data from a prefix of it"""
+    return sniff(sample)[0]
+
+def detect_delimiter(lines: Iterable[str]) -> str:
+    """Detect the most likely delimiter in CSV-like data"""
+    delimiters = [',', '\t', ';', '|']
+    delimiter_counts = {delim: 0 for delim in delimiters}
+
+    for line in islice(lines, 5):  # Check first 5 lines
+        for delim in delimiters:
+            delimiter_counts[delim] += line.count(delim)
+
+    return max(delimiter_counts, key=delimiter_counts.get)
+
+def iter_csv_records(lines: Iterable[str], delimiter: str = ',') -> Iterator[Dict[str, str]]:
+    """Parse CSV-like lines into records, one row at a time"""
+    lines = dropwhile(lambda line: not line.strip(), lines)
+    for row in csv.DictReader(lines, delimiter=delimiter):
+        yield dict(row)
+
+def iter_json_records(chunks: Iterable[str]) -> Iterator[Any]:
+    """Incrementally parse a JSON array (or a single JSON value) into records"""
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            return False
+        # Drop the already-consumed prefix so the buffer only holds pending text
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip(chars: str) -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return
+
+    skip(" \t\r\n")
+    if pos >= len(buffer):
+        return
+    if buffer[pos] != '[':
+        # A single top-level value has to be decoded whole
+        while fill():
+            pass
+        text = buffer[pos:].strip()
+        value, end = decoder.raw_decode(text)
+        if text[end:].strip():
+            # Never keep just the first of several values and drop the rest
+            raise ValueError(f"Extra data after the JSON document at character {pos + end}")
+        yield value
+        return
+
+    pos += 1
+    while True:
+        skip(" \t\r\n,")
+        if pos >= len(buffer) or buffer[pos] == ']':
+            return
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # A value ending exactly at the buffer edge may be a truncated number
+                if end < len(buffer) or eof:
+                    break
+            except ValueError:
+                if eof:
+                    raise
+            fill()
+        pos = end
+        yield value
+
+def iter_jsonl_records(lines: Iterable[str]) -> Iterator[Any]:
+    """Parse newline-delimited JSON, one record per line"""
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+def iter_paragraphs(lines: Iterable[str]) -> Iterator[str]:
+    """Group lines into paragraphs separated by blank lines"""
+    paragraph: list = []
+    for line in lines:
+        if line.strip():
+            paragraph.append(line)
+        elif paragraph:
+            yield ''.join(paragraph)
+            paragraph.clear()
+    if paragraph:
+        yield ''.join(paragraph)
+
+def paragraph_record(text: str, chunk_id: int) -> Optional[Dict[str, Any]]:
+    """Record for a paragraph, or None if it is too short to be meaningful"""
+    cleaned = ' '.join(text.split())
+    if len(cleaned) > 10:  # Only include meaningful chunks
+        return {"content": cleaned, "chunk_id": chunk_id, "type": "paragraph"}
+    return None
+
+def sentence_records(texts: List[str]) -> Iterator[Dict[str, Any]]:
+    """Fallback for text without meaningful paragraphs: split by sentences"""
+    sentences = re.split(r'[.!?]+', '\n\n'.join(texts).strip())
+    for i, sentence in enumerate(sentences):
+        cleaned = ' '.join(sentence.split())
+        if len(cleaned) > 10:
+            yield {"content": cleaned, "chunk_id": i, "type": "sentence"}
+
+def iter_unstructured_records(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Parse unstructured text into searchable chunks, one paragraph at a time"""
+    # Keep raw text only until the first paragraph is emitted, for the sentence fallback
+    pending_text: Optional[list] = []
+    for chunk_id, text in enumerate(iter_paragraphs(lines)):
+        record = paragraph_record(text, chunk_id)
+        if record:
+            pending_text = None
+            yield record
+        elif pending_text is not None:
+            pending_text.append(text)
+
+    # If no paragraphs found, split by sentences
+    if pending_text:
+        yield from sentence_records(pending_text)
+
+def iter_records(
+    stream: TextIO, sample: str, format_info: Dict[str, Any], prefix: Optional[ParsedPrefix] = None
+) -> Iterator[Any]:
+    """Stream records of the detected format from an already-sampled text stream
+
+    ``prefix`` holds records ``sniff`` already decoded; parsing resumes after them.
+    """
+    if prefix is not None and format_info["type"] == "json":
+        # sniff decoded the whole (untruncated) document
+        return iter(prefix.records)
+    if format_info["type"] == "json":
+        chunks = chain([sample], iter(lambda: stream.read(READ_CHUNK_CHARS), ''))
+        return iter_json_records(chunks)
+
+    if prefix is not None:
+        sample = sample[prefix.consumed:]
+    # Complete the sample's last line so line-based parsers see whole lines
+    lines = chain(io.StringIO(sample + stream.readline(), newline=''), stream)
+    if format_info["type"] == "jsonl":
+        records = iter_jsonl_records(lines)
+        return chain(prefix.records, records) if prefix is not None else records
+    if format_info["type"] == "csv":
+        return iter_csv_records(lines, format_info.get("delimiter", ","))
+    return iter_unstructured_records(lines)
+
+def record_to_row(record: Any) -> Row:
+    """Split a parsed record into its searchable content and its other fields"""
+    if isinstance(record, dict):
+        if 'content' in record:
+            return record['content'], {k: v for k, v in record.items() if k != 'content'}, False
+        return str(record), record, all(isinstance(k, str) for k in record)
+    return str(record), None, False
+
+def sniff_and_parse(stream: TextIO) -> Tuple[Dict[str, Any], Iterator[Any]]:
+    """Detect the stream's format from its prefix and return a record generator"""
+    sample = read_sample(stream)
+    if not sample.strip():
+        raise ValueError("No data provided")
+    format_info, prefix = sniff(sample)
+    return format_info, iter_records(stream, sample, format_info, prefix)
+
+# Parallel parsing
+
+def _csv_cut(text: str, delimiter: str = ',') -> int:
+    """End of the last complete CSV row in text, or -1; newlines inside quoted fields don't count
+
+    Quotes are read as the csv module reads them: a quote opens a quoted field
+    only at the start of a field, ``""`` is an escaped quote only inside one,
+    and anywhere else (``5" screen``) it is an ordinary character. text must
+    start at the beginning of a row.
+    """
+    field_starts = delimiter + '\r\n'
+    cut = -1
+    pos = 0
+    while True:
+        # The next quote that opens a quoted field
+        quote = text.find('"', pos)
+        while quote > 0 and text[quote - 1] not in field_starts:
+            quote = text.find('"', quote + 1)
+        newline = text.rfind('\n', pos, quote if quote >= 0 else len(text))
+        if newline >= 0:
+            cut = newline + 1
+        if quote < 0:
+            return cut
+        # Skip to its closing quote, past "" escapes
+        pos = quote + 1
+        while True:
+            quote = text.find('"', pos)
+            if quote < 0 or quote + 1 == len(text):
+                # The field, or the escape its last quote starts, continues past text
+                return cut
+            if text[quote + 1] != '"':
+                break
+            pos = quote + 2
+        pos = quote + 1
+
+def _newline_cut(text: str) -> int:
+    newline = text.rfind('\n')
+    return newline + 1 if newline >= 0 else -1
+
+BLANK_LINE_RE = re.compile(r'\n[ \t\r\f\v]*\n')
+
+def _paragraph_cut(text: str) -> int:
+    """End of the last blank line in text, or -1"""
+    # Search only the tail; paragraphs are short relative to a chunk
+    for window in (64 * 1024, len(text)):
+        start = max(0, len(text) - window)
+        matches = list(BLANK_LINE_RE.finditer(text, start))
+        if matches:
+            return matches[-1].end()
+        if start == 0:
+            break
+    return -1
+
+SAFE_CUTS: Dict[str, Callable[..., int]] = {
+    "csv": _csv_cut,
+    "jsonl": _newline_cut,
+    "unstructured": _paragraph_cut,
+}
+
+def iter_safe_chunks(
+    stream: TextIO,
+    prefix: str,
+    fmt: str,
+    chunk_chars: int = PARALLEL_CHUNK_CHARS,
+    delimiter: str = ',',
+    leftover: Optional[List[str]] = None,
+) -> Iterator[str]:
+    """Read the stream in chunks that each end at a record boundary
+
+    If ``leftover`` is given and no boundary turns up within MAX_UNSPLIT_CHUNKS
+    chunks, reading stops and the text not yet chunked is appended to it, for
+    the caller to parse serially; otherwise that stretch becomes one chunk.
+    """
+    cut = SAFE_CUTS[fmt]
+    if fmt == "csv":
+        cut = partial(cut, delimiter=delimiter)
+    buffer = prefix
+    while True:
+        data = stream.read(chunk_chars)
+        if not data:
+            break
+        buffer += data
+        if len(buffer) < chunk_chars:
+            continue
+        end = cut(buffer)
+        if end > 0:
+            yield buffer[:end]
+            buffer = buffer[end:]
+        elif leftover is not None and len(buffer) >= MAX_UNSPLIT_CHUNKS * chunk_chars:
+            leftover.append(buffer)
+            return
+    if buffer:
+        yield buffer
+
+def parse_chunk(fmt: str, text: str, options: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+    """Parse one chunk in a worker process; returns (rows or records, chunk info)"""
+    lines = io.StringIO(text, newline='')
+    if fmt == "csv":
+        reader = csv.DictReader(lines, fieldnames=options["fieldnames"], delimiter=options["delimiter"])
+        records = [dict(row) for row in reader]
+        return [record_to_row(r) for r in records], {"preview": records[:3]}
+    if fmt == "jsonl":
+        records = list(iter_jsonl_records(lines))
+        return [record_to_row(r) for r in records], {"preview": records[:3]}
+    # Paragraph numbering is global, so return records with chunk-local ids for the parent to offset
+    records, short = [], []
+    paragraphs = 0
+    for paragraphs, paragraph in enumerate(iter_paragraphs(lines), start=1):
+        record = paragraph_record(paragraph, paragraphs - 1)
+        if record:
+            records.append(record)
+        elif not records:
+            short.append(paragraph)
+    return records, {"paragraphs": paragraphs, "short": short if not records else None}
+
+def _map_in_order(executor: Executor, fn, argument_sets: Iterable[tuple], window: int) -> Iterator[Any]:
+    """Like executor.map, but with at most `window` tasks submitted ahead of the consumer"""
+    pending: deque = deque()
+    try:
+        for args in argument_sets:
+            pending.append(executor.submit(fn, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _parallel_csv_header(stream: TextIO, text: str, delimiter: str) -> Tuple[List[str], str]:
+    """Take the header row off the front of the input; returns (fieldnames, remaining text)"""
+    while True:
+        newline = text.find('\n')
+        if newline < 0:
+            more = stream.read(READ_CHUNK_CHARS)
+            if not more:
+                break
+            text += more
+        elif not text[:newline].strip():
+            # Leading blank lines are skipped, as in iter_csv_records
+            text = text[newline + 1:]
+        else:
+            break
+    header, rest = (text, '') if newline < 0 else (text[:newline + 1], text[newline + 1:])
+    fieldnames = next(csv.reader([header], delimiter=delimiter), [])
+    return fieldnames, rest
+
+def _iter_parallel_batches(
+    stream: TextIO,
+    sample: str,
+    format_info: Dict[str, Any],
+    prefix: Optional[ParsedPrefix],
+    batch_size: int,
+    executor: Executor,
+    workers: int,
+) -> Iterator[Tuple[List[Row], List[Any]]]:
+    fmt = format_info["type"]
+    options: Dict[str, Any] = {}
+    text = sample
+    if prefix is not None:
+        yield from _serial_batches(iter(prefix.records), batch_size)
+        text = sample[prefix.consumed:]
+    if fmt == "csv":
+        options["delimiter"] = format_info.get("delimiter", ",")
+        options["fieldnames"], text = _parallel_csv_header(stream, text, options["delimiter"])
+    leftover: List[str] = []
+    chunks = iter_safe_chunks(
+        stream, text, fmt, PARALLEL_CHUNK_CHARS, options.get("delimiter", ","), leftover if fmt == "csv" else None
+    )
+    results = _map_in_order(
+        executor, parse_chunk, ((fmt, chunk, options) for chunk in chunks), workers * PARALLEL_CHUNKS_PER_WORKER
+    )
+    if fmt != "unstructured":
+        for rows, info in results:
+            preview = info["preview"]
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size], preview if start == 0 else []
+        if leftover:
+            # No row boundary in sight: parse the rest on this thread, as iter_records would
+            lines = chain(io.StringIO(leftover[0] + stream.readline(), newline=''), stream)
+            reader = csv.DictReader(lines, fieldnames=options["fieldnames"], delimiter=options["delimiter"])
+            yield from _serial_batches((dict(row) for row in reader), batch_size)
+        return
+
+    paragraphs = 0
+    pending_text: Optional[list] = []
+    for records, info in results:
+        for record in records:
+            record["chunk_id"] += paragraphs
+        paragraphs += info["paragraphs"]
+        if records:
+            pending_text = None
+        elif pending_text is not None:
+            pending_text.extend(info["short"])
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            yield [record_to_row(r) for r in batch], batch[:3]
+    if pending_text:
+        yield from _serial_batches(sentence_records(pending_text), batch_size)
+
+def _serial_batches(records: Iterator[Any], batch_size: int) -> Iterator[Tuple[List[Row], List[Any]]]:
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield [record_to_row(r) for r in batch], batch[:3]
+
+def iter_row_batches(
+    stream: TextIO,
+    sample: str,
+    format_info: Dict[str, Any],
+    batch_size: int,
+    prefix: Optional[ParsedPrefix] = None,
+    executor: Optional[Executor] = None,
+    workers: int = 1,
+) -> Iterator[Tuple[List[Row], List[Any]]]:
+    """Yield (rows, preview records) batches of at most batch_size rows, in input order
+
+    With an executor (a process pool of `workers` processes) and a splittable
+    format, chunks are parsed in parallel; otherwise parsing streams on the
+    calling thread.
+    """
+    if executor is not None and format_info["type"] in PARALLEL_FORMATS:
+        return _iter_parallel_batches(stream, sample, format_info, prefix, batch_size, executor, workers)
+    return _serial_batches(iter_records(stream, sample, format_info, prefix), batch_size)
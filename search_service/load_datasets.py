@@ -1,53 +1,264 @@
+#!/usr/bin/env python3
+"""
+Bulk loader for the built-in document collection.
+
+Loads the sample CSV datasets in ./datasets into the ``document`` table of
+./documents.db (run it from search_service/, with the server stopped or
+restarted afterwards). Each file is streamed in batches of ``--batch-size``
+rows; a batch is one ``INSERT ... ON CONFLICT(id) DO NOTHING`` (``DO UPDATE``
+with ``--update``), so documents already present are detected by the
+database, not by a lookup per row. Independent datasets are loaded on
+parallel threads: their CSV parsing overlaps, while writes to the one SQLite
+file take turns.
+
+After every committed batch the byte offset reached in the file is saved to a
+checkpoint, so an interrupted load resumes where it stopped; batches are
+idempotent, so a batch committed just before the interruption is harmless to
+repeat. A file whose size or modification time has changed is loaded from the
+start. Once the data is in, the document search index is rebuilt and written
+to the index snapshot, so the server starts with it mapped; with
+EMBED_ON_INGEST=1 the documents are re-embedded for vector search too
+(otherwise the first vector search embeds them). ``--update`` can rewrite
+documents without changing their count or highest id, which is all the
+fingerprints of the snapshot and the embeddings look at, so whenever documents
+were written both are dropped explicitly; with ``--skip-index`` the server
+rebuilds them on startup and on the first vector search.
+
+Usage:
+    python load_datasets.py
+    python load_datasets.py news_headlines.csv --batch-size 20000
+    python load_datasets.py --update --restart
+"""
+
+import argparse
 import csv
+import json
 import os
-from sqlmodel import SQLModel, Session, create_engine, Field
-
-class Document(SQLModel, table=True):
-    id: int = Field(default=None, primary_key=True)
-    content: str
-    tags: str
-
-sqlite_url = "sqlite:///./documents.db"
-engine = create_engine(sqlite_url, echo=True)
-
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
-
-def load_csv(csv_path, content_col, tags_col, id_col=None, start_id=1):
-    docs = []
-    with open(csv_path, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for i, row in enumerate(reader, start=start_id):
-            doc_id = int(row[id_col]) if id_col and row.get(id_col) else i
-            content = row[content_col]
-            tags = row[tags_col].replace(" ", ",") if tags_col in row else ""
-            docs.append(Document(id=doc_id, content=content, tags=tags))
-    with Session(engine) as session:
-        for doc in docs:
-            if not session.get(Document, doc.id):
-                session.add(doc)
-        session.commit()
-    print(f"Loaded {len(docs)} documents from {csv_path}")
-
-def main():
-    create_db_and_tables()
-    base = os.path.join(os.path.dirname(__file__), "datasets")
-    datasets = [
-        # (filename, content_col, tags_col, id_col)
-        ("wikipedia_sample.csv", "summary", "title", "id"),
-        ("gutenberg_books.csv", "summary", "title", "id"),
-        ("stackoverflow_questions.csv", "body", "tags", "id"),
-        ("news_headlines.csv", "headline_text", "headline_text", ""),
-        ("openlibrary_books.csv", "description", "subjects", "id"),
-    ]
-    start_id = 1
-    for fname, content_col, tags_col, id_col in datasets:
-        path = os.path.join(base, fname)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional
+
+import main as service
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BATCH_SIZE = 5000
+PROGRESS_SECONDS = 5.0
+
+INSERT_SQL = "INSERT INTO document (id, content, tags) VALUES (?, ?, ?) ON CONFLICT(id) DO NOTHING"
+UPSERT_SQL = (
+    "INSERT INTO document (id, content, tags) VALUES (?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET content = excluded.content, tags = excluded.tags"
+)
+
+class DatasetSpec(NamedTuple):
+    filename: str
+    content_col: str
+    tags_col: str
+    # Column holding the document id; rows without one are numbered from start_id
+    id_col: str
+    start_id: int
+
+DATASETS = [
+    DatasetSpec("wikipedia_sample.csv", "summary", "title", "id", 1),
+    DatasetSpec("gutenberg_books.csv", "summary", "title", "id", 100001),
+    DatasetSpec("stackoverflow_questions.csv", "body", "tags", "id", 200001),
+    DatasetSpec("news_headlines.csv", "headline_text", "headline_text", "", 300001),
+    DatasetSpec("openlibrary_books.csv", "description", "subjects", "id", 400001),
+]
+
+class LineReader:
+    """Decoded lines of a binary file, tracking the byte offset of the next unread line
+
+    csv.reader pulls lines only until the current row is complete, so after a
+    row is returned ``offset`` is where the next row starts.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.offset = f.tell()
+
+    def __iter__(self) -> "LineReader":
+        return self
+
+    def __next__(self) -> str:
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode("utf-8")
+
+class Checkpoint:
+    """Per-file load progress, rewritten atomically after every committed batch"""
+
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self.state: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def resume(self, csv_path: str) -> Optional[dict]:
+        """Saved progress for a file, unless the file changed since it was saved"""
+        entry = self.state.get(csv_path)
+        stat = os.stat(csv_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return entry
+
+    def save(self, csv_path: str, **progress) -> None:
+        stat = os.stat(csv_path)
+        with self._lock:
+            self.state[csv_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **progress}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+class LoadStats(NamedTuple):
+    filename: str
+    rows: int
+    written: int
+    seconds: float
+
+def read_batches(f: BinaryIO, spec: DatasetSpec, header: List[str], row_number: int, batch_size: int) -> Iterator[tuple]:
+    """(rows, rows read so far, byte offset after the batch) for each batch, from the file's position"""
+    lines = LineReader(f)
+    reader = csv.reader(lines)
+    content_at = header.index(spec.content_col)
+    tags_at = header.index(spec.tags_col) if spec.tags_col in header else None
+    id_at = header.index(spec.id_col) if spec.id_col in header else None
+    batch = []
+    for values in reader:
+        if not values:
+            continue
+        row_id = values[id_at] if id_at is not None and id_at < len(values) else ""
+        doc_id = int(row_id) if row_id else spec.start_id + row_number
+        tags = values[tags_at].replace(" ", ",") if tags_at is not None and tags_at < len(values) else ""
+        batch.append((doc_id, values[content_at], tags))
+        row_number += 1
+        if len(batch) >= batch_size:
+            yield batch, row_number, lines.offset
+            batch = []
+    if batch:
+        yield batch, row_number, lines.offset
+
+def load_csv(spec: DatasetSpec, csv_path: str, checkpoint: Checkpoint, batch_size: int, update: bool) -> LoadStats:
+    """Stream one CSV file into the document table, resuming from its checkpoint"""
+    started = time.perf_counter()
+    saved = checkpoint.resume(csv_path)
+    if saved is not None and saved.get("done"):
+        print(f"[{spec.filename}] already loaded ({saved['rows']} rows), skipping")
+        return LoadStats(spec.filename, 0, 0, 0.0)
+    total_bytes = os.path.getsize(csv_path)
+    rows = written = 0
+    last_report = started
+    with open(csv_path, "rb") as f:
+        if saved is None:
+            lines = LineReader(f)
+            header = next(csv.reader(lines), [])
+            if header:
+                header[0] = header[0].lstrip("\ufeff")
+            row_number, offset = 0, lines.offset
+        else:
+            header, row_number, offset = saved["header"], saved["rows"], saved["offset"]
+            f.seek(offset)
+            print(f"[{spec.filename}] resuming at row {row_number} ({offset / 1e6:.1f} of {total_bytes / 1e6:.1f} MB)")
+        if spec.content_col not in header:
+            raise ValueError(f"{csv_path} has no '{spec.content_col}' column")
+        for batch, row_number, offset in read_batches(f, spec, header, row_number, batch_size):
+            # The shared SQLite file has one writer; parsing of other datasets continues meanwhile
+            with service.catalog_lock, service.engine.begin() as conn:
+                result = conn.exec_driver_sql(UPSERT_SQL if update else INSERT_SQL, batch)
+                written += max(result.rowcount, 0)
+            checkpoint.save(csv_path, header=header, rows=row_number, offset=offset, done=False)
+            rows += len(batch)
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_SECONDS:
+                last_report = now
+                print(
+                    f"[{spec.filename}] {row_number} rows, {rows / (now - started):.0f} rows/s "
+                    f"({offset / total_bytes:.0%} of {total_bytes / 1e6:.1f} MB)"
+                )
+        checkpoint.save(csv_path, header=header, rows=row_number, offset=offset, done=True)
+    seconds = time.perf_counter() - started
+    print(
+        f"[{spec.filename}] loaded {rows} rows ({written} {'written' if update else 'new'}) "
+        f"in {seconds:.1f}s, {rows / max(seconds, 1e-9):.0f} rows/s"
+    )
+    return LoadStats(spec.filename, rows, written, seconds)
+
+def refresh_search_index(changed: bool, rebuild: bool = True) -> None:
+    """Rebuild the document index (and embeddings) if documents changed and save it to the snapshot
+
+    Dataset indexes still valid in the old snapshot are restored first, so
+    saving keeps them instead of leaving them to be rebuilt on startup.
+    Without ``rebuild`` the document index is only dropped from the snapshot.
+    """
+    if not changed and not rebuild:
+        return
+    service.restore_index_snapshot()
+    if changed:
+        # Updated documents keep their count and max id, so the fingerprints cannot tell
+        # the old index and embeddings from current ones: drop them
+        service.search_indexes.remove(None)
+        service.vector_store.remove(None)
+    if not rebuild:
+        service.save_index_snapshot()
+        print("Dropped the document index and embeddings; they are rebuilt on next use")
+        return
+    if service.search_indexes.get(None) is not None:
+        print("Document index is up to date")
+        return
+    started = time.perf_counter()
+    index = service.build_document_index()
+    service.save_index_snapshot()
+    print(f"Rebuilt document index ({index.doc_count} documents) in {time.perf_counter() - started:.1f}s")
+    if service.EMBED_ON_INGEST:
+        started = time.perf_counter()
+        vectors = service.get_vectors(None)
+        print(f"Embedded {vectors.live_count} documents in {time.perf_counter() - started:.1f}s")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk-load the CSV datasets into the built-in document collection")
+    parser.add_argument("files", nargs="*", help="dataset file names to load (default: every known dataset present)")
+    parser.add_argument("--dir", default=os.path.join(HERE, "datasets"), help="directory holding the CSV files")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per insert batch and checkpoint")
+    parser.add_argument("--workers", type=int, default=0, help="datasets loaded in parallel (default: all of them)")
+    parser.add_argument("--checkpoint", default="load_checkpoint.json", help="where load progress is kept")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and load every file from the start")
+    parser.add_argument("--update", action="store_true", help="overwrite documents whose id already exists")
+    parser.add_argument("--skip-index", action="store_true", help="do not rebuild the search index afterwards")
+    args = parser.parse_args()
+
+    specs = {spec.filename: spec for spec in DATASETS}
+    unknown = set(args.files) - set(specs)
+    if unknown:
+        parser.error(f"unknown datasets: {', '.join(sorted(unknown))} (known: {', '.join(specs)})")
+    jobs = []
+    for filename in args.files or list(specs):
+        path = os.path.abspath(os.path.join(args.dir, filename))
         if os.path.exists(path):
-            load_csv(path, content_col, tags_col, id_col, start_id)
-            start_id += 100000  # Offset IDs for each dataset
+            jobs.append((specs[filename], path))
         else:
             print(f"Dataset not found: {path}")
 
+    service.create_db_and_tables()
+    checkpoint = Checkpoint(os.path.abspath(args.checkpoint), restart=args.restart)
+    started = time.perf_counter()
+    stats: List[LoadStats] = []
+    if jobs:
+        with ThreadPoolExecutor(max_workers=args.workers or len(jobs), thread_name_prefix="load") as pool:
+            futures = [
+                pool.submit(load_csv, spec, path, checkpoint, max(args.batch_size, 1), args.update)
+                for spec, path in jobs
+            ]
+            stats = [future.result() for future in futures]
+    rows = sum(s.rows for s in stats)
+    seconds = time.perf_counter() - started
+    print(f"Loaded {rows} rows from {len(stats)} dataset(s) in {seconds:.1f}s, {rows / max(seconds, 1e-9):.0f} rows/s")
+    refresh_search_index(changed=any(s.written for s in stats), rebuild=not args.skip_index)
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
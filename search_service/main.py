@@ -1,17 +1,39 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Query, Request, Response, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, confloat
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Literal, Optional, Dict, Any, Sequence, Set, TextIO, Tuple, Union
 import subprocess
+import hmac
 import json
 import asyncio
 import sys
 import os
-import csv
 import io
-import re
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import count
+import numpy as np
 from datetime import datetime
+from sqlalchemy import Column, and_, case, delete, event, func, insert, or_, text, update
 from sqlmodel import SQLModel, Field, Session, create_engine, select
+from search_index import IndexRegistry, InvertedIndex
+from shards import Shard, ShardSet
+from record_fields import CellType, FieldFilter, FieldSchema, FilterError, derived_content, filter_clause, parse_filters
+from query_engine import OPERATORS, QuerySyntaxError, match_batch_for_scoring, match_for_scoring
+from ingest import iter_row_batches, open_text_stream, read_sample, sniff
+from result_cache import QueryResultCache
+from single_flight import SingleFlight
+from scoring import CpuScorer, top_k_indices
+from doc_store import DocumentStore
+from snapshot import SnapshotError, load_snapshot, save_snapshot
+from vector_store import VectorMatrix, VectorWriter, VectorStore, make_embedder
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+import profiling
+from profiling import RequestProfile, SlowRequestLog
 
 # Database models
 class Document(SQLModel, table=True):
@@ -27,20 +49,463 @@ class UserDataset(SQLModel, table=True):
     total_records: int
     created_at: datetime = Field(default_factory=datetime.utcnow)
     file_size: Optional[int] = None
+    revision: int = 0  # Bumped by every append/delete, so index snapshots notice in-place changes
 
 class DatasetRecord(SQLModel, table=True):
     id: int = Field(default=None, primary_key=True)
-    dataset_id: int = Field(foreign_key="userdataset.id")
-    content: str
-    metadata: Optional[str] = None  # JSON string for additional data
-    search_vector: Optional[str] = None  # Pre-processed for search
+    dataset_id: int = Field(foreign_key="userdataset.id", index=True)
+    content: Optional[str] = None  # NULL when the searchable text is the record's own fields
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+# Highest record id ever handed out on a shard (one row, id 1). Ids are allocated
+# past it rather than past the live maximum, so the id of a deleted record is never
+# reused: clients, index tombstones and vector deletion masks may still hold it.
+class RecordIdMark(SQLModel, table=True):
+    id: int = Field(default=None, primary_key=True)
+    max_record_id: int
+
+# Structured fields of dataset records, stored by record_fields.py: field names
+# once per dataset, values one typed cell per (field, record)
+class DatasetField(SQLModel, table=True):
+    id: int = Field(default=None, primary_key=True)
+    dataset_id: int = Field(foreign_key="userdataset.id", index=True)
+    name: str
+    kind: str  # 'text' or 'json'
+
+class DatasetValue(SQLModel, table=True):
+    # Clustered on (field, record), so each field's values are stored together like a column
+    __table_args__ = {"sqlite_with_rowid": False}
+    field_id: int = Field(primary_key=True)
+    record_id: int = Field(primary_key=True)
+    value: Any = Field(default=None, sa_column=Column("value", CellType()))
+
 sqlite_url = "sqlite:///./documents.db"
-engine = create_engine(sqlite_url, echo=False)
+
+# Bounded worker pools: DB work gets one thread per pooled connection,
+# CPU-bound ranking gets one thread per core (NumPy releases the GIL)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+CPU_WORKERS = int(os.environ.get("CPU_WORKERS", str(os.cpu_count() or 1)))
+
+def configure_sqlite(dbapi_connection, connection_record):
+    """Tune SQLite for bulk loads: WAL lets readers run during ingest, NORMAL sync is durable under WAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def create_sqlite_engine(url: str):
+    # Keep more compiled statements around so repeated batch INSERTs reuse their prepared form
+    sqlite_engine = create_engine(
+        url,
+        echo=False,
+        connect_args={"cached_statements": 256, "check_same_thread": False},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=0,
+    )
+    event.listen(sqlite_engine, "connect", configure_sqlite)
+    return sqlite_engine
+
+engine = create_sqlite_engine(sqlite_url)
+
+# Dataset records are spread over SHARD_COUNT SQLite files (see shards.py). With one
+# shard they stay in the main database; with more, the main database keeps only the
+# catalog. SHARD_COUNT must not change once records have been written.
+SHARD_COUNT = max(int(os.environ.get("SHARD_COUNT", "1")), 1)
+SHARD_DB_PATTERN = os.environ.get("SHARD_DB_PATTERN", "./documents.shard{n}.db")
+shards = ShardSet(
+    [engine] if SHARD_COUNT == 1
+    else [create_sqlite_engine(f"sqlite:///{SHARD_DB_PATTERN.format(n=n)}") for n in range(SHARD_COUNT)]
+)
+# Serialises catalog (UserDataset) writes; shared with the records' lock when they share a file
+catalog_lock = shards.for_dataset(0).write_lock if SHARD_COUNT == 1 else threading.RLock()
+
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+
+# Uploads of at least PARALLEL_PARSE_MIN_BYTES are parsed on PARSE_WORKERS processes
+# (1 disables parallel parsing). Workers start on first use; forkserver/spawn avoid
+# forking a process that is running threads.
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_PARSE_MIN_BYTES = int(os.environ.get("PARALLEL_PARSE_MIN_BYTES", str(8 * 1024 * 1024)))
+parse_executor = ProcessPoolExecutor(
+    max_workers=PARSE_WORKERS,
+    mp_context=multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    ),
+) if PARSE_WORKERS > 1 else None
+
+async def run_db(fn, *args):
+    """Run blocking database work on the DB thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, profiling.bind(partial(fn, *args)))
+
+async def run_cpu(fn, *args):
+    """Run CPU-bound work on the compute thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, profiling.bind(partial(fn, *args)))
+
+# Rows per executemany batch during dataset ingestion
+INGEST_BATCH_SIZE = 5000
+
+# Per-dataset inverted indexes; key None holds the built-in Document table
+search_indexes = IndexRegistry()
+index_build_lock = threading.Lock()
+
+# Search result cache; a TTL of 0 disables expiry, a size of 0 disables caching
+result_cache = QueryResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", "0")) or None,
+)
+
+# Identical searches that arrive while one is being computed wait for its result
+search_flights = SingleFlight(enabled=os.environ.get("SEARCH_COALESCING", "1") != "0")
+
+# Memory-mapped index snapshot, written on shutdown and reused on the next boot
+SNAPSHOT_PATH = os.environ.get("INDEX_SNAPSHOT_PATH", "./index_snapshot.bin")
+
+# Record embeddings for vector and hybrid search, one memory-mapped float32 matrix per
+# dataset (see vector_store.py). Datasets are embedded on their first vector search, without
+# blocking writes to them (see get_vectors), or as they are uploaded with EMBED_ON_INGEST=1
+# (which slows uploads down)
+VECTOR_DIR = os.environ.get("VECTOR_DIR", "./vectors")
+EMBED_ON_INGEST = os.environ.get("EMBED_ON_INGEST", "0") == "1"
+# Embeddings built while writes landed are thrown away; after this many, the build holds writes off
+VECTOR_BUILD_ATTEMPTS = 2
+vector_build_lock = threading.Lock()
+vector_store = VectorStore(
+    VECTOR_DIR,
+    make_embedder(os.environ.get("VECTOR_EMBEDDER", "hashed-ngrams"), int(os.environ.get("VECTOR_DIM", "256"))),
+)
+
+# Prometheus metrics served by GET /metrics
+metrics = MetricsRegistry()
+REQUEST_LATENCY = metrics.histogram(
+    "zerostack_http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+# Search stages: candidates (index lookup), filter (field filters, in the DB),
+# scoring (BM25), top_k (selection), hydration (result documents); /search/batch
+# records the same stages with a batch_ prefix, once per dataset group
+SEARCH_STAGE_LATENCY = metrics.histogram(
+    "zerostack_search_stage_duration_seconds", "Time spent per /search stage", ["stage"]
+)
+# Upload stages: read (sniffed prefix), detect, parse (streamed reads + parsing), insert (DB + index)
+UPLOAD_STAGE_LATENCY = metrics.histogram(
+    "zerostack_upload_stage_duration_seconds", "Time spent per /upload stage", ["stage"]
+)
+ROWS_INGESTED = metrics.counter("zerostack_rows_ingested_total", "Dataset records ingested", ["format"])
+SLOW_REQUESTS = metrics.counter("zerostack_slow_requests_total", "Requests written to the slow-request log", ["route"])
+# Stage timings also go to the profile of the request that ran them (see profiling.py)
+SEARCH_STAGE_LATENCY.add_observer(profiling.record_stage)
+UPLOAD_STAGE_LATENCY.add_observer(profiling.record_stage)
+
+# Callers presenting ADMIN_TOKEN in X-Admin-Token may ask for a request's profile with an
+# X-Profile header or ?profile= (1 for stage timings, cprofile to add a cProfile summary).
+# Without ADMIN_TOKEN, profiling is off
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Requests taking at least SLOW_QUERY_SECONDS (0 disables) are logged as JSON lines to
+# SLOW_QUERY_LOG_PATH, or stderr, with their stage timings
+slow_log = SlowRequestLog(
+    float(os.environ.get("SLOW_QUERY_SECONDS", "0")), os.environ.get("SLOW_QUERY_LOG_PATH") or None
+)
+
+# Most queries accepted by one POST /search/batch
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "256"))
+
+# Keyset pagination: default and max rows per JSON page, rows per DB round-trip when streaming NDJSON
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+# Max bound parameters per IN (...) clause, below SQLite's SQLITE_MAX_VARIABLE_NUMBER
+SQLITE_IN_CHUNK = 900
+
+# What hydrated documents can be projected to; other requested names are record fields
+DOCUMENT_ATTRIBUTES = {"content", "tags", "metadata"}
+
+RECORD_TABLES = [DatasetRecord.__table__, DatasetField.__table__, DatasetValue.__table__, RecordIdMark.__table__]
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    for shard in shards:
+        if shard.engine is not engine:
+            SQLModel.metadata.create_all(shard.engine, tables=RECORD_TABLES)
+        # create_all skips indexes on tables that already exist, so add it to older databases too
+        with shard.engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_datasetrecord_dataset_id ON datasetrecord (dataset_id)"
+            )
+        migrate_record_storage(shard)
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(userdataset)")}
+        if "revision" not in columns:
+            conn.exec_driver_sql("ALTER TABLE userdataset ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+def migrate_record_storage(shard: Shard) -> None:
+    """Move records stored with JSON metadata and a search_vector copy into field storage
+
+    Older shards are rebuilt once: fields move to datasetvalue, content that is
+    just the text of the fields is dropped, and the file is vacuumed to give
+    the space back.
+    """
+    with shard.engine.connect() as conn:
+        columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(datasetrecord)")}
+    if "metadata" not in columns:
+        return
+    with shard.write_lock, Session(shard.engine) as session:
+        # pysqlite would run the DDL outside a transaction; open one so the rebuild is all or nothing
+        session.connection().exec_driver_sql("BEGIN")
+        session.execute(text("ALTER TABLE datasetrecord RENAME TO datasetrecord_old"))
+        session.execute(text("DROP INDEX IF EXISTS ix_datasetrecord_dataset_id"))
+        DatasetRecord.__table__.create(session.connection())
+        session.execute(text(
+            "INSERT INTO datasetrecord (id, dataset_id, content, created_at) "
+            "SELECT id, dataset_id, content, created_at FROM datasetrecord_old"
+        ))
+        schemas: Dict[int, FieldSchema] = {}
+        new_field_ids = count(1)
+        after = 0
+        while True:
+            rows = session.execute(text(
+                "SELECT id, dataset_id, content, metadata FROM datasetrecord_old "
+                "WHERE id > :after AND metadata IS NOT NULL ORDER BY id LIMIT :limit"
+            ), {"after": after, "limit": INGEST_BATCH_SIZE}).all()
+            if not rows:
+                break
+            cells = []
+            derived = []
+            for record_id, dataset_id, content, metadata in rows:
+                fields = json.loads(metadata)
+                if not fields:
+                    continue
+                schema = schemas.get(dataset_id)
+                if schema is None:
+                    schema = schemas[dataset_id] = FieldSchema(dataset_id, new_ids=new_field_ids)
+                record_cells, ordered = schema.encode(record_id, fields)
+                cells.extend(record_cells)
+                if ordered and content == derived_content(fields):
+                    derived.append(record_id)
+            write_fields(session, schemas.values(), cells)
+            for start in range(0, len(derived), SQLITE_IN_CHUNK):
+                session.execute(
+                    update(DatasetRecord)
+                    .where(DatasetRecord.id.in_(derived[start:start + SQLITE_IN_CHUNK]))
+                    .values(content=None)
+                )
+            after = rows[-1][0]
+        session.execute(text("DROP TABLE datasetrecord_old"))
+        session.commit()
+    with shard.engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").exec_driver_sql("VACUUM")
+
+def index_fingerprints() -> Dict[Optional[int], List[int]]:
+    """Cheap per-dataset summary of the DB, used to tell whether a snapshot is stale"""
+    with Session(engine) as session:
+        doc_count, doc_max = session.exec(select(func.count(Document.id), func.max(Document.id))).one()
+        fingerprints = {None: [doc_count, doc_max or 0]}
+        datasets = session.exec(select(UserDataset.id, UserDataset.total_records, UserDataset.revision)).all()
+    for shard in shards:
+        with Session(shard.engine) as session:
+            for dataset_id, total_records, revision in datasets:
+                if shards.for_dataset(dataset_id) is not shard:
+                    continue
+                # max(id) per dataset is an index seek thanks to ix_datasetrecord_dataset_id
+                max_id = session.exec(
+                    select(func.max(DatasetRecord.id)).where(DatasetRecord.dataset_id == dataset_id)
+                ).one()
+                fingerprints[dataset_id] = [total_records, max_id or 0, revision]
+    return fingerprints
+
+def dataset_fingerprint(dataset_id: Optional[int]) -> Optional[List[int]]:
+    """The index_fingerprints() entry of one dataset (or the built-in documents); None if it does not exist"""
+    if not dataset_id:
+        with Session(engine) as session:
+            doc_count, doc_max = session.exec(select(func.count(Document.id), func.max(Document.id))).one()
+        return [doc_count, doc_max or 0]
+    dataset = get_dataset_in_db(dataset_id)
+    if dataset is None:
+        return None
+    with Session(dataset_engine(dataset_id)) as session:
+        max_id = session.exec(
+            select(func.max(DatasetRecord.id)).where(DatasetRecord.dataset_id == dataset_id)
+        ).one()
+    return [dataset.total_records, max_id or 0, dataset.revision]
+
+def restore_index_snapshot() -> int:
+    """Map still-valid snapshot sections into the index registry; returns how many"""
+    try:
+        sections = load_snapshot(SNAPSHOT_PATH)
+    except SnapshotError as e:
+        print(f"Index snapshot not used: {e}")
+        return 0
+    fingerprints = index_fingerprints()
+    restored = 0
+    for dataset_id, (index, fingerprint) in sections.items():
+        if fingerprints.get(dataset_id) == fingerprint:
+            search_indexes.replace(dataset_id, index)
+            restored += 1
+    return restored
+
+def save_index_snapshot() -> None:
+    """Persist every built index with the fingerprint of the data it reflects"""
+    fingerprints = index_fingerprints()
+    entries = [
+        (dataset_id, index, fingerprints[dataset_id])
+        for dataset_id, index in search_indexes.items()
+        if dataset_id in fingerprints
+    ]
+    save_snapshot(SNAPSHOT_PATH, entries)
+
+def document_text(content: str, tags: str) -> str:
+    """The text a built-in document is indexed (and substring-matched) on"""
+    return f"{content} {tags.replace(',', ' ')}"
+
+def build_document_index() -> InvertedIndex:
+    """Build the inverted index over the built-in Document table"""
+    index = InvertedIndex()
+    with Session(engine) as session:
+        docs = session.exec(select(Document).order_by(Document.id))
+        index.add_many((doc.id, document_text(doc.content, doc.tags)) for doc in docs)
+    search_indexes.replace(None, index)
+    return index
+
+def dataset_engine(dataset_id: Optional[int]):
+    """Engine holding a dataset's records; the main database for the built-in documents"""
+    return shards.for_dataset(dataset_id).engine if dataset_id else engine
+
+def load_schema(session: Session, dataset_id: int, new_ids=None) -> FieldSchema:
+    """The fields of a dataset; new_ids lets writers add fields"""
+    fields = session.exec(
+        select(DatasetField.id, DatasetField.name, DatasetField.kind)
+        .where(DatasetField.dataset_id == dataset_id)
+        .order_by(DatasetField.id)
+    ).all()
+    return FieldSchema(dataset_id, fields, new_ids)
+
+def write_fields(session: Session, schemas: Iterable[FieldSchema], cells: List[Tuple[int, int, Any]]) -> None:
+    """Insert fields first seen since the last write, then (field id, record id, value) cells"""
+    new_fields = [
+        {"id": field_id, "dataset_id": schema.dataset_id, "name": name, "kind": kind}
+        for schema in schemas
+        for field_id, name, kind in schema.take_new()
+    ]
+    if new_fields:
+        session.execute(insert(DatasetField.__table__), new_fields)
+    if cells:
+        # Several cells per record: plain tuples through the driver skip per-row dict building
+        session.connection().exec_driver_sql(
+            "INSERT INTO datasetvalue (field_id, record_id, value) VALUES (?, ?, ?)", cells
+        )
+
+def record_fields(session: Session, schema: FieldSchema, record_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+    """Decoded fields of some of a dataset's records (ids in ascending order), keyed by record id"""
+    if not schema or not record_ids:
+        return {}
+    field_ids = schema.ids()
+    if len(record_ids) <= SQLITE_IN_CHUNK:
+        records, params = f"IN ({','.join('?' * len(record_ids))})", list(record_ids)
+    else:
+        # Long runs come from id-ordered pages; field ids already limit the range to this dataset
+        records, params = "BETWEEN ? AND ?", [record_ids[0], record_ids[-1]]
+    # Plain DBAPI tuples: a page holds several cells per record, too many for per-row result objects
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"SELECT field_id, record_id, value FROM datasetvalue WHERE field_id IN ({','.join('?' * len(field_ids))}) "
+            f"AND record_id {records} ORDER BY field_id, record_id",
+            field_ids + params,
+        )
+        return schema.decode(cursor)
+    finally:
+        cursor.close()
+
+def fill_content(session: Session, schema: FieldSchema, rows: Sequence[Tuple[int, Optional[str]]]) -> List[Tuple[int, str]]:
+    """(id, content) for (id, stored content) rows in id order, rebuilding content derived from fields"""
+    missing = [record_id for record_id, content in rows if content is None]
+    fields = record_fields(session, schema, missing)
+    return [
+        (record_id, derived_content(fields.get(record_id, {})) if content is None else content)
+        for record_id, content in rows
+    ]
+
+def record_text_pages(dataset_id: Optional[int]) -> Iterator[List[Tuple[int, str]]]:
+    """(id, searchable text) of every record of a dataset, or of every built-in document, in id-ordered pages"""
+    with Session(dataset_engine(dataset_id)) as session:
+        schema = load_schema(session, dataset_id) if dataset_id else None
+        after = 0
+        while True:
+            if dataset_id:
+                rows = session.exec(
+                    select(DatasetRecord.id, DatasetRecord.content)
+                    .where(DatasetRecord.dataset_id == dataset_id, DatasetRecord.id > after)
+                    .order_by(DatasetRecord.id)
+                    .limit(INGEST_BATCH_SIZE)
+                ).all()
+            else:
+                rows = session.exec(
+                    select(Document.id, Document.content, Document.tags)
+                    .where(Document.id > after)
+                    .order_by(Document.id)
+                    .limit(INGEST_BATCH_SIZE)
+                ).all()
+            if not rows:
+                break
+            after = rows[-1][0]
+            if dataset_id:
+                yield fill_content(session, schema, rows)
+            else:
+                yield [(doc_id, document_text(content, tags)) for doc_id, content, tags in rows]
+
+def build_dataset_index(dataset_id: int) -> InvertedIndex:
+    """Build the inverted index for a user dataset from its stored records"""
+    index = InvertedIndex()
+    for page in record_text_pages(dataset_id):
+        index.add_many(page)
+    search_indexes.replace(dataset_id, index)
+    return index
+
+def get_search_index(dataset_id: Optional[int]) -> InvertedIndex:
+    """Return the index for a dataset, building it on first use"""
+    index = search_indexes.get(dataset_id)
+    if index is None:
+        # Serialise cold builds so concurrent searches don't each rebuild the same index
+        with index_build_lock:
+            index = search_indexes.get(dataset_id)
+            if index is None:
+                index = build_document_index() if dataset_id is None else build_dataset_index(dataset_id)
+    return index
+
+def get_vectors(dataset_id: Optional[int]) -> VectorMatrix:
+    """The embeddings of a dataset: loaded, mapped from disk, or embedded from its records on first use
+
+    Embedding runs without the dataset's write lock, so uploads, appends and
+    deletes go on meanwhile; the result is published only if none of them
+    landed (the fingerprint is unchanged), else the dataset is embedded again.
+    """
+    dataset_id = dataset_id or None
+    matrix = vector_store.get(dataset_id)
+    if matrix is not None:
+        return matrix
+    write_lock = shards.for_dataset(dataset_id).write_lock if dataset_id else catalog_lock
+    # Serialise cold builds so concurrent searches don't each embed the same dataset
+    with vector_build_lock:
+        for attempt in range(VECTOR_BUILD_ATTEMPTS + 1):
+            with write_lock:
+                matrix = vector_store.get(dataset_id)
+                if matrix is not None:
+                    return matrix
+                fingerprint = dataset_fingerprint(dataset_id)
+                if fingerprint is None:
+                    return vector_store.empty()
+                matrix = vector_store.open(dataset_id, fingerprint)
+                if matrix is not None:
+                    return matrix
+                if attempt == VECTOR_BUILD_ATTEMPTS:
+                    # Writes kept landing while it was embedded: hold them off for the last try
+                    return vector_store.build(dataset_id, record_text_pages(dataset_id), fingerprint)
+            writer = vector_store.stage(dataset_id, record_text_pages(dataset_id))
+            with write_lock:
+                if dataset_fingerprint(dataset_id) == fingerprint:
+                    return writer.commit(fingerprint)
+            writer.abort()
 
 def add_sample_documents():
     docs = [
@@ -59,232 +524,614 @@ def add_sample_documents():
                 session.add(doc)
         session.commit()
 
-def detect_data_format(raw_data: str) -> Dict[str, Any]:
-    """Detect the format of uploaded data"""
-    lines = raw_data.strip().split('\n')
-    if not lines:
-        return {"type": "unstructured", "confidence": 0.0}
-    
-    # Try to detect CSV-like format
-    csv_patterns = [
-        r'^[^,\n]+(?:,[^,\n]+)*$',  # Basic CSV
-        r'^[^\t\n]+(?:\t[^\t\n]+)*$',  # TSV
-        r'^[^;\n]+(?:;[^;\n]+)*$',  # Semicolon separated
-    ]
-    
-    csv_matches = 0
-    for line in lines[:10]:  # Check first 10 lines
-        for pattern in csv_patterns:
-            if re.match(pattern, line.strip()):
-                csv_matches += 1
-                break
-    
-    csv_confidence = csv_matches / min(len(lines), 10)
+def open_upload(stream: Union[str, TextIO], file_size: Optional[int] = None):
+    """Detect the format of an upload; returns (format_info, row batches, file_size)"""
+    if isinstance(stream, str):
+        file_size = len(stream.encode('utf-8'))
+        stream = io.StringIO(stream)
     
-    # Try to detect JSON
-    json_confidence = 0.0
-    try:
-        if raw_data.strip().startswith('[') and raw_data.strip().endswith(']'):
-            json.loads(raw_data)
-            json_confidence = 1.0
-        elif raw_data.strip().startswith('{') and raw_data.strip().endswith('}'):
-            json.loads(raw_data)
-            json_confidence = 1.0
-    except:
-        pass
-    
-    # Determine the best format
-    if json_confidence > 0.8:
-        return {"type": "json", "confidence": json_confidence}
-    elif csv_confidence > 0.6:
-        return {"type": "csv", "confidence": csv_confidence, "delimiter": detect_delimiter(raw_data)}
-    else:
-        return {"type": "unstructured", "confidence": 1.0 - max(csv_confidence, json_confidence)}
+    # Detect format from a bounded prefix, then parse incrementally, resuming after
+    # whatever detection already decoded
+    with UPLOAD_STAGE_LATENCY.time("read"):
+        sample = read_sample(stream)
+    if not sample.strip():
+        raise ValueError("No data provided")
+    with UPLOAD_STAGE_LATENCY.time("detect"):
+        format_info, prefix = sniff(sample)
+    parallel = parse_executor is not None and (file_size or 0) >= PARALLEL_PARSE_MIN_BYTES
+    batches = iter_row_batches(
+        stream, sample, format_info, INGEST_BATCH_SIZE, prefix, parse_executor if parallel else None, PARSE_WORKERS
+    )
+    return format_info, batches, file_size
 
-def detect_delimiter(data: str) -> str:
-    """Detect the most likely delimiter in CSV-like data"""
-    lines = data.strip().split('\n')[:5]  # Check first 5 lines
-    delimiters = [',', '\t', ';', '|']
-    delimiter_counts = {delim: 0 for delim in delimiters}
-    
-    for line in lines:
-        for delim in delimiters:
-            delimiter_counts[delim] += line.count(delim)
-    
-    return max(delimiter_counts, key=delimiter_counts.get)
+def allocated_record_id(session: Session) -> int:
+    """Highest record id ever allocated on the session's shard, including deleted records"""
+    mark = session.get(RecordIdMark, 1)
+    # Shards written before the mark existed fall back to their highest live id
+    live_max = session.exec(select(func.max(DatasetRecord.id))).one()
+    return max(mark.max_record_id if mark else 0, live_max or 0)
 
-def parse_csv_data(data: str, delimiter: str = ',') -> List[Dict[str, str]]:
-    """Parse CSV-like data into structured format"""
-    lines = data.strip().split('\n')
-    if not lines:
-        return []
-    
-    # Try to parse as CSV
-    try:
-        csv_reader = csv.DictReader(io.StringIO(data), delimiter=delimiter)
-        return [dict(row) for row in csv_reader]
-    except:
-        # Fallback: treat as simple delimited data
-        headers = lines[0].split(delimiter)
-        records = []
-        for line in lines[1:]:
-            values = line.split(delimiter)
-            if len(values) == len(headers):
-                record = dict(zip(headers, values))
-                records.append(record)
-        return records
-
-def parse_json_data(data: str) -> List[Dict[str, Any]]:
-    """Parse JSON data into structured format"""
-    try:
-        parsed = json.loads(data)
-        if isinstance(parsed, list):
-            return parsed
-        elif isinstance(parsed, dict):
-            return [parsed]
-        else:
-            return []
-    except:
-        return []
-
-def parse_unstructured_data(data: str) -> List[Dict[str, str]]:
-    """Parse unstructured text into searchable chunks"""
-    # Split into paragraphs or sentences
-    paragraphs = re.split(r'\n\s*\n', data.strip())
-    records = []
-    
-    for i, para in enumerate(paragraphs):
-        if para.strip():
-            # Clean up the text
-            cleaned = re.sub(r'\s+', ' ', para.strip())
-            if len(cleaned) > 10:  # Only include meaningful chunks
-                records.append({
-                    "content": cleaned,
-                    "chunk_id": i,
-                    "type": "paragraph"
-                })
-    
-    # If no paragraphs found, split by sentences
-    if not records:
-        sentences = re.split(r'[.!?]+', data.strip())
-        for i, sentence in enumerate(sentences):
-            cleaned = re.sub(r'\s+', ' ', sentence.strip())
-            if len(cleaned) > 10:
-                records.append({
-                    "content": cleaned,
-                    "chunk_id": i,
-                    "type": "sentence"
-                })
-    
-    return records
+def insert_upload_rows(
+    session: Session, shard: Shard, dataset_id: int, batches, vectors: Optional[VectorWriter] = None
+) -> Tuple[InvertedIndex, int, List[Any]]:
+    """Insert parsed batches into a dataset on its shard; returns (index of the new records, count, preview)
 
-def process_uploaded_data(raw_data: str, dataset_name: str) -> Dict[str, Any]:
-    """Process uploaded data and return structured results"""
-    # Detect format
-    format_info = detect_data_format(raw_data)
-    
-    # Parse based on detected format
-    if format_info["type"] == "csv":
-        delimiter = format_info.get("delimiter", ",")
-        records = parse_csv_data(raw_data, delimiter)
-        data_type = "structured"
-    elif format_info["type"] == "json":
-        records = parse_json_data(raw_data)
-        data_type = "structured"
-    else:
-        records = parse_unstructured_data(raw_data)
-        data_type = "unstructured"
+    Must run under the shard's write lock, which keeps id allocation race-free.
+    The new records are also embedded into vectors, if given.
+    """
+    index = InvertedIndex()
+    created_at = datetime.utcnow()
+    insert_records = insert(DatasetRecord.__table__)
+    max_id = allocated_record_id(session)
+    max_field_id = session.exec(select(func.max(DatasetField.id))).one()
+    schema = load_schema(session, dataset_id, count((max_field_id or 0) + 1))
+    sample_records = []
+    total_records = 0
+    parse_seconds = insert_seconds = embed_seconds = 0.0
+    # Write records in fixed-size executemany batches as they are parsed,
+    # bypassing the ORM unit of work
+    while True:
+        batch_started = time.perf_counter()
+        batch = next(batches, None)
+        parse_seconds += time.perf_counter() - batch_started
+        if batch is None:
+            break
+        parsed_rows, preview = batch
+        if len(sample_records) < 3:
+            sample_records.extend(preview[:3 - len(sample_records)])
+        batch_started = time.perf_counter()
+        ids = shards.record_ids(shard, max_id, len(parsed_rows))
+        rows = []
+        cells = []
+        for record_id, (content, fields, derived) in zip(ids, parsed_rows):
+            stored_content = content
+            if fields:
+                record_cells, ordered = schema.encode(record_id, fields)
+                cells.extend(record_cells)
+                # Content that is just the fields' text is rebuilt from them when read
+                if derived and ordered:
+                    stored_content = None
+            rows.append({"id": record_id, "dataset_id": dataset_id, "content": stored_content, "created_at": created_at})
+        session.execute(insert_records, rows)
+        write_fields(session, [schema], cells)
+        index.add_many(zip(ids, (content for content, _, _ in parsed_rows)))
+        max_id = ids[-1]
+        total_records += len(rows)
+        insert_seconds += time.perf_counter() - batch_started
+        if vectors is not None:
+            batch_started = time.perf_counter()
+            vectors.add(ids, [content for content, _, _ in parsed_rows])
+            embed_seconds += time.perf_counter() - batch_started
+    if total_records:
+        session.merge(RecordIdMark(id=1, max_record_id=max_id))
+    profiling.count("rows", total_records)
+    UPLOAD_STAGE_LATENCY.observe(parse_seconds, "parse")
+    UPLOAD_STAGE_LATENCY.observe(insert_seconds, "insert")
+    if vectors is not None:
+        UPLOAD_STAGE_LATENCY.observe(embed_seconds, "embed")
+    return index, total_records, sample_records
+
+def update_catalog(dataset_id: int, **values) -> UserDataset:
+    """Apply one UPDATE to a dataset's catalog row and return the row as stored"""
+    with catalog_lock, Session(engine) as session:
+        session.execute(update(UserDataset).where(UserDataset.id == dataset_id).values(**values))
+        session.commit()
+        return session.get(UserDataset, dataset_id)
+
+def upload_result(dataset: UserDataset, format_info: Dict[str, Any], records: int, sample_records: List[Any], elapsed: float) -> Dict[str, Any]:
+    ROWS_INGESTED.inc(format_info["type"], amount=records)
+    return {
+        "dataset_id": dataset.id,
+        "name": dataset.name,
+        "data_type": dataset.data_type,
+        "total_records": dataset.total_records,
+        "format_detected": format_info,
+        "sample_records": [r if isinstance(r, dict) else {"content": r} for r in sample_records],  # First 3 records as preview
+        "ingest_seconds": round(elapsed, 4),
+        "rows_per_second": round(records / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+def process_uploaded_data(stream: Union[str, TextIO], dataset_name: str, file_size: Optional[int] = None) -> Dict[str, Any]:
+    """Stream uploaded data into a new dataset and return structured results"""
+    format_info, batches, file_size = open_upload(stream, file_size)
+    data_type = "unstructured" if format_info["type"] == "unstructured" else "structured"
     
-    # Create dataset record
-    with Session(engine) as session:
+    # The catalog row is committed first so the records can be written to the dataset's
+    # shard without holding the catalog's write lock; it shows 0 records until done
+    started = time.perf_counter()
+    with catalog_lock, Session(engine) as session:
         dataset = UserDataset(
             name=dataset_name,
             data_type=data_type,
-            total_records=len(records),
-            file_size=len(raw_data.encode('utf-8'))
+            total_records=0,
+            file_size=file_size
         )
         session.add(dataset)
         session.commit()
-        session.refresh(dataset)
-        
-        # Add records
-        for record in records:
-            if isinstance(record, dict):
-                content = record.get('content', str(record))
-                metadata = json.dumps({k: v for k, v in record.items() if k != 'content'})
-            else:
-                content = str(record)
-                metadata = None
-            
-            dataset_record = DatasetRecord(
-                dataset_id=dataset.id,
-                content=content,
-                metadata=metadata,
-                search_vector=content.lower()  # Simple search vector for now
+        dataset_id = dataset.id
+    profiling.annotate(dataset_id=dataset_id, format=format_info["type"], file_size=file_size)
+    shard = shards.for_dataset(dataset_id)
+    with shard.write_lock:
+        vectors = vector_store.writer(dataset_id) if EMBED_ON_INGEST else None
+        try:
+            with Session(shard.engine) as session:
+                index, total_records, sample_records = insert_upload_rows(session, shard, dataset_id, batches, vectors)
+                session.commit()
+        except BaseException:
+            if vectors is not None:
+                vectors.abort()
+            with catalog_lock, Session(engine) as session:
+                session.execute(delete(UserDataset).where(UserDataset.id == dataset_id))
+                session.commit()
+            raise
+        dataset = update_catalog(dataset_id, total_records=total_records)
+        if vectors is not None:
+            vectors.commit(dataset_fingerprint(dataset_id))
+    search_indexes.replace(dataset_id, index)
+    result_cache.invalidate_dataset(dataset_id)
+    return upload_result(dataset, format_info, total_records, sample_records, time.perf_counter() - started)
+
+def apply_index_changes(dataset_id: int, added: Optional[InvertedIndex] = None, deleted: Sequence[int] = ()) -> None:
+    """Fold a committed append/delete into the dataset's loaded index, if any
+
+    Runs under the build lock: a cold build either finished before (and the
+    change is applied on top, idempotently) or starts after and reads it from
+    the DB. Unloaded indexes are left alone and built from the DB on demand.
+    """
+    with index_build_lock:
+        index = search_indexes.segmented(dataset_id)
+        if index is not None:
+            if added is not None:
+                index.add_segment(added)
+            if deleted:
+                index.delete(deleted)
+    if deleted:
+        doc_store.discard_records(deleted)
+    result_cache.invalidate_dataset(dataset_id)
+
+def append_to_dataset(dataset_id: int, stream: Union[str, TextIO], file_size: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Stream more records into an existing dataset; None if it does not exist"""
+    format_info, batches, file_size = open_upload(stream, file_size)
+    data_type = "unstructured" if format_info["type"] == "unstructured" else "structured"
+    profiling.annotate(dataset_id=dataset_id, format=format_info["type"], file_size=file_size)
+    started = time.perf_counter()
+    shard = shards.for_dataset(dataset_id)
+    # Appends and deletes on a shard run one at a time, so total_records and the index change in step
+    with shard.write_lock:
+        if get_dataset_in_db(dataset_id) is None:
+            return None
+        # Embeddings already on disk are kept current; a dataset without them is embedded on first use
+        matrix = vector_store.open(dataset_id, dataset_fingerprint(dataset_id))
+        vectors = vector_store.writer(dataset_id, matrix) if matrix is not None else None
+        try:
+            with Session(shard.engine) as session:
+                index, added, sample_records = insert_upload_rows(session, shard, dataset_id, batches, vectors)
+                session.commit()
+        except BaseException:
+            if vectors is not None:
+                vectors.abort()
+            raise
+        dataset = update_catalog(
+            dataset_id,
+            total_records=UserDataset.total_records + added,
+            file_size=func.coalesce(UserDataset.file_size, 0) + (file_size or 0),
+            revision=UserDataset.revision + 1,
+            data_type=case((UserDataset.data_type == data_type, data_type), else_="mixed"),
+        )
+        if vectors is not None:
+            vectors.commit(dataset_fingerprint(dataset_id))
+        apply_index_changes(dataset_id, added=index)
+    result = upload_result(dataset, format_info, added, sample_records, time.perf_counter() - started)
+    result["records_added"] = added
+    return result
+
+def delete_records(dataset_id: int, record_ids: Sequence[int]) -> Optional[Dict[str, int]]:
+    """Delete records of a dataset by id; ids of other datasets are ignored. None if the dataset does not exist"""
+    records = DatasetRecord.__table__
+    shard = shards.for_dataset(dataset_id)
+    with shard.write_lock:
+        dataset = get_dataset_in_db(dataset_id)
+        if dataset is None:
+            return None
+        ids = sorted(set(record_ids))
+        deleted = []
+        matrix = vector_store.open(dataset_id, dataset_fingerprint(dataset_id))
+        field_ids = select(DatasetField.id).where(DatasetField.dataset_id == dataset_id)
+        with Session(shard.engine) as session:
+            for start in range(0, len(ids), SQLITE_IN_CHUNK):
+                chunk = ids[start:start + SQLITE_IN_CHUNK]
+                chunk_deleted = session.execute(
+                    delete(records)
+                    .where(records.c.dataset_id == dataset_id, records.c.id.in_(chunk))
+                    .returning(records.c.id)
+                ).scalars().all()
+                if chunk_deleted:
+                    session.execute(
+                        delete(DatasetValue).where(DatasetValue.field_id.in_(field_ids), DatasetValue.record_id.in_(chunk_deleted))
+                    )
+                deleted.extend(chunk_deleted)
+            session.commit()
+        if deleted:
+            dataset = update_catalog(
+                dataset_id,
+                total_records=UserDataset.total_records - len(deleted),
+                revision=UserDataset.revision + 1,
             )
-            session.add(dataset_record)
-        
-        session.commit()
-    
-    return {
-        "dataset_id": dataset.id,
-        "name": dataset.name,
-        "data_type": data_type,
-        "total_records": len(records),
-        "format_detected": format_info,
-        "sample_records": records[:3]  # First 3 records as preview
-    }
+            if matrix is not None:
+                vector_store.delete(dataset_id, deleted, dataset_fingerprint(dataset_id))
+            apply_index_changes(dataset_id, deleted=deleted)
+    return {"dataset_id": dataset_id, "deleted": len(deleted), "total_records": dataset.total_records}
 
-def search_documents_in_db(query: str, dataset_id: Optional[int] = None) -> List[Document]:
-    # Simple search: match if query is in content or tags
-    with Session(engine) as session:
-        if dataset_id:
-            # Search in specific user dataset
-            statement = select(DatasetRecord).where(DatasetRecord.dataset_id == dataset_id)
-            results = session.exec(statement).all()
-            query_lower = query.lower()
-            return [
-                Document(id=doc.id, content=doc.content, tags="user_dataset") 
-                for doc in results
-                if query_lower in doc.content.lower()
+def delete_dataset(dataset_id: int) -> bool:
+    """Delete a dataset with all its records; False if it does not exist"""
+    records = DatasetRecord.__table__
+    shard = shards.for_dataset(dataset_id)
+    with shard.write_lock:
+        # The catalog row goes first: without it the dataset is gone, whatever happens to its records
+        with catalog_lock, Session(engine) as session:
+            removed = session.execute(delete(UserDataset).where(UserDataset.id == dataset_id)).rowcount
+            session.commit()
+        if not removed:
+            return False
+        with Session(shard.engine) as session:
+            deleted = session.execute(
+                delete(records).where(records.c.dataset_id == dataset_id).returning(records.c.id)
+            ).scalars().all()
+            field_ids = select(DatasetField.id).where(DatasetField.dataset_id == dataset_id)
+            session.execute(delete(DatasetValue).where(DatasetValue.field_id.in_(field_ids)))
+            session.execute(delete(DatasetField).where(DatasetField.dataset_id == dataset_id))
+            session.commit()
+        with index_build_lock:
+            search_indexes.remove(dataset_id)
+        vector_store.remove(dataset_id)
+    doc_store.discard_records(deleted)
+    result_cache.invalidate_dataset(dataset_id)
+    return True
+
+def contains_text(dataset_id: Optional[int], candidates: np.ndarray, text: str) -> np.ndarray:
+    """Candidates whose text contains ``text`` (case-insensitive); verifies quoted substring queries"""
+    ids = candidates.tolist()
+    kept = []
+    with Session(dataset_engine(dataset_id)) as session:
+        schema = load_schema(session, dataset_id) if dataset_id else None
+        for start in range(0, len(ids), SQLITE_IN_CHUNK):
+            chunk = ids[start:start + SQLITE_IN_CHUNK]
+            if dataset_id:
+                rows = fill_content(session, schema, session.exec(
+                    select(DatasetRecord.id, DatasetRecord.content)
+                    .where(DatasetRecord.id.in_(chunk))
+                    .order_by(DatasetRecord.id)
+                ).all())
+            else:
+                docs = session.exec(select(Document).where(Document.id.in_(chunk)))
+                rows = ((doc.id, document_text(doc.content, doc.tags)) for doc in docs)
+            kept.extend(doc_id for doc_id, content in rows if text in content.lower())
+    return np.sort(np.asarray(kept, dtype=np.int64))
+
+def filter_records(session: Session, dataset_id: Optional[int], filters: List[FieldFilter], ids: np.ndarray) -> np.ndarray:
+    """The ids whose fields satisfy every filter; built-in documents have no fields"""
+    schema = load_schema(session, dataset_id) if dataset_id else FieldSchema(0)
+    for condition in filters:
+        branches = []
+        for field_id, kind in schema.named(condition.name):
+            clause = filter_clause(DatasetValue.value, kind, condition)
+            if clause is not None:
+                branches.append(and_(DatasetValue.field_id == field_id, clause))
+        if not branches or ids.size == 0:
+            return np.empty(0, dtype=np.int64)
+        statement = select(DatasetValue.record_id).where(or_(*branches))
+        # Few candidates are looked up by key; otherwise the field is scanned like a column
+        if ids.size <= SQLITE_IN_CHUNK:
+            statement = statement.where(DatasetValue.record_id.in_(ids.tolist()))
+        ids = np.intersect1d(ids, np.asarray(session.exec(statement).all(), dtype=np.int64))
+    return ids
+
+def search_documents_in_db(
+    query: str, dataset_id: Optional[int] = None, filters: Sequence[FieldFilter] = ()
+) -> Tuple[List[int], str]:
+    """Ids of the stored records matching a query and field filters, in id order, and the words to rank them by
+
+    The words come from the same parse and term expansions as the match, so
+    ranking does not expand fuzzy and wildcard leaves again.
+    """
+    # Evaluate the boolean query (implicit AND between words) against the inverted index
+    dataset_id = dataset_id or None
+    with SEARCH_STAGE_LATENCY.time("candidates"):
+        index = get_search_index(dataset_id)
+        doc_ids, terms = match_for_scoring(index, query, partial(contains_text, dataset_id))
+    profiling.count("dataset_records", index.doc_count)
+    profiling.count("matches", doc_ids.size)
+    # The index is updated with every write, so matches are not checked against the DB;
+    # a record deleted meanwhile is dropped when results are hydrated
+    if doc_ids.size and filters:
+        with SEARCH_STAGE_LATENCY.time("filter"), Session(dataset_engine(dataset_id)) as session:
+            doc_ids = filter_records(session, dataset_id, list(filters), doc_ids)
+    profiling.count("candidates", doc_ids.size)
+    return doc_ids.tolist(), terms
+
+def rank_candidates(terms: str, dataset_id: Optional[int], doc_ids: List[int], top_k: int):
+    """Score candidates with BM25 on the query's scoring words and return the top-k (ids, scores)"""
+    ids = np.asarray(doc_ids, dtype=np.int64)
+    with SEARCH_STAGE_LATENCY.time("scoring"):
+        # Only terms outside NOT clauses contribute to the ranking
+        index = get_search_index(dataset_id or None)
+        scores = index.score(terms, ids)
+    k = min(top_k, len(scores))
+    with SEARCH_STAGE_LATENCY.time("top_k"):
+        top_k_indices = np.asarray((gpu_scorer or cpu_scorer).compute_softmax_and_top_k(scores, k), dtype=np.int64)
+    return ids[top_k_indices].tolist(), scores[top_k_indices].tolist()
+
+def search_batch_in_db(
+    queries: List[str], dataset_id: Optional[int], filter_sets: Optional[List[List[FieldFilter]]] = None
+) -> Tuple[List[np.ndarray], List[str]]:
+    """Candidate ids for several queries (each with its field filters) on one dataset, filtered in one session
+
+    Also returns each query's scoring words, as search_documents_in_db does.
+    """
+    dataset_id = dataset_id or None
+    with SEARCH_STAGE_LATENCY.time("batch_candidates"):
+        index = get_search_index(dataset_id)
+        candidate_sets, terms = match_batch_for_scoring(index, queries, partial(contains_text, dataset_id))
+    profiling.count("dataset_records", index.doc_count)
+    profiling.count("matches", sum(candidates.size for candidates in candidate_sets))
+    if filter_sets and any(filter_sets):
+        with SEARCH_STAGE_LATENCY.time("batch_filter"), Session(dataset_engine(dataset_id)) as session:
+            candidate_sets = [
+                filter_records(session, dataset_id, filters, candidates) if filters else candidates
+                for candidates, filters in zip(candidate_sets, filter_sets)
             ]
+    profiling.count("candidates", sum(candidates.size for candidates in candidate_sets))
+    return candidate_sets, terms
+
+def rank_batch(terms: List[str], dataset_id: Optional[int], candidate_sets: List[np.ndarray], top_ks: List[int]):
+    """Score (by each query's scoring words) and select the top-k of several queries together; returns [(ids, scores)]"""
+    with SEARCH_STAGE_LATENCY.time("batch_scoring"):
+        index = get_search_index(dataset_id or None)
+        score_sets = index.score_batch(terms, candidate_sets)
+    # The GPU scorer has no batched API, so rows are always selected on the CPU here
+    with SEARCH_STAGE_LATENCY.time("batch_top_k"):
+        ranked = cpu_scorer.top_k_batch(score_sets, top_ks)
+    return [
+        (candidates[indices].tolist(), scores.tolist())
+        for candidates, (indices, scores) in zip(candidate_sets, ranked)
+    ]
+
+def vector_query_text(query: str) -> str:
+    """The words of a query without its boolean operators, as embedded for vector search"""
+    return " ".join(word for word in query.split() if word not in OPERATORS)
+
+def vector_candidates(dataset_id: Optional[int], filters: Sequence[FieldFilter] = ()) -> Tuple[VectorMatrix, Optional[np.ndarray]]:
+    """A dataset's embeddings and, with field filters, the ids passing them (None: every row)"""
+    matrix = get_vectors(dataset_id)
+    profiling.count("vector_rows", matrix.live_count)
+    if not filters:
+        return matrix, None
+    with SEARCH_STAGE_LATENCY.time("filter"), Session(dataset_engine(dataset_id)) as session:
+        candidates = filter_records(session, dataset_id or None, list(filters), np.asarray(matrix.live_ids()))
+    profiling.count("vector_candidates", candidates.size)
+    return matrix, candidates
+
+def rank_vectors(query: str, matrix: VectorMatrix, candidates: Optional[np.ndarray], top_k: int):
+    """Top-k (ids, cosine similarities) from one matrix-vector product over the dataset's embeddings
+
+    Records without any similarity to the query (cosine 0 or below) are not matches.
+    """
+    with SEARCH_STAGE_LATENCY.time("vector_scoring"):
+        query_vector = vector_store.embed_query(vector_query_text(query))
+        if not query_vector.any():
+            return [], []
+        ids, scores = matrix.search(query_vector, top_k, candidates)
+        similar = scores > 0
+    return ids[similar].tolist(), scores[similar].tolist()
+
+def rank_hybrid(
+    query: str, terms: str, dataset_id: Optional[int], doc_ids: List[int], matrix: VectorMatrix,
+    candidates: Optional[np.ndarray], top_k: int, vector_weight: float,
+):
+    """Fuse BM25 over the lexical matches with cosine similarity; returns the top-k (ids, scores)
+
+    The nearest vectors join the lexical matches as candidates. BM25 is scaled
+    by its maximum, so both scores lie in [0, 1] and the fused score is their
+    weighted mean.
+    """
+    with SEARCH_STAGE_LATENCY.time("hybrid_scoring"):
+        lexical_ids = np.asarray(doc_ids, dtype=np.int64)
+        bm25 = np.empty(0, dtype=np.float32)
+        if lexical_ids.size:
+            index = get_search_index(dataset_id or None)
+            bm25 = index.score(terms, lexical_ids)
+        query_vector = vector_store.embed_query(vector_query_text(query))
+        nearest = np.empty(0, dtype=np.int64)
+        if query_vector.any():
+            nearest, similarities = matrix.search(query_vector, top_k, candidates)
+            nearest = nearest[similarities > 0]
+        ids = np.union1d(lexical_ids, nearest)
+        lexical = np.zeros(ids.size, dtype=np.float32)
+        if bm25.size and bm25.max() > 0:
+            lexical[np.searchsorted(ids, lexical_ids)] = bm25 / bm25.max()
+        semantic = np.maximum(matrix.similarities(query_vector, ids), 0)
+        fused = ((1 - vector_weight) * lexical + vector_weight * semantic).astype(np.float32)
+    with SEARCH_STAGE_LATENCY.time("top_k"):
+        indices = top_k_indices(fused, top_k)
+    return ids[indices].tolist(), fused[indices].tolist()
+
+def load_records_from_db(
+    doc_ids: Sequence[int], with_fields: bool = False, of_dataset: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Load dataset records in as few round-trips as possible, with their decoded fields if asked
+
+    With ``of_dataset``, ids that are not records of that dataset are left out
+    by the same query that loads the rows.
+    """
+    records = []
+    if of_dataset is None:
+        groups = shards.group_records(doc_ids)
+    else:
+        # A dataset's records all live on its shard
+        groups = {shards.for_dataset(of_dataset): list(doc_ids)}
+    for shard, ids in groups.items():
+        with Session(shard.engine) as session:
+            for start in range(0, len(ids), SQLITE_IN_CHUNK):
+                chunk = ids[start:start + SQLITE_IN_CHUNK]
+                statement = select(DatasetRecord.id, DatasetRecord.dataset_id, DatasetRecord.content).where(
+                    DatasetRecord.id.in_(chunk)
+                )
+                if of_dataset is not None:
+                    statement = statement.where(DatasetRecord.dataset_id == of_dataset)
+                by_dataset: Dict[int, list] = {}
+                for doc_id, dataset_id, content in session.exec(statement.order_by(DatasetRecord.id)):
+                    by_dataset.setdefault(dataset_id, []).append((doc_id, content))
+                for dataset_id, rows in by_dataset.items():
+                    schema = load_schema(session, dataset_id)
+                    if not with_fields:
+                        records.extend(
+                            {"id": doc_id, "content": content, "tags": ["user_dataset"]}
+                            for doc_id, content in fill_content(session, schema, rows)
+                        )
+                        continue
+                    # Every record's fields are read anyway, so derived content comes from them
+                    fields = record_fields(session, schema, [doc_id for doc_id, _ in rows])
+                    records.extend(
+                        {
+                            "id": doc_id,
+                            "content": derived_content(fields.get(doc_id, {})) if content is None else content,
+                            "tags": ["user_dataset"],
+                            "metadata": fields.get(doc_id, {}),
+                        }
+                        for doc_id, content in rows
+                    )
+    return records
+
+def load_documents_from_db(doc_ids: Sequence[int]) -> List[Dict[str, Any]]:
+    """Load built-in documents in as few round-trips as possible"""
+    docs = []
+    with Session(engine) as session:
+        for start in range(0, len(doc_ids), SQLITE_IN_CHUNK):
+            chunk = list(doc_ids[start:start + SQLITE_IN_CHUNK])
+            docs.extend(session.exec(select(Document).where(Document.id.in_(chunk))).all())
+    return [{"id": doc.id, "content": doc.content, "tags": doc.tags.split(",")} for doc in docs]
+
+def project_document(doc: Dict[str, Any], wanted: Set[str], field_names: Set[str]) -> Dict[str, Any]:
+    """The id and requested attributes of a document; single record fields are kept under metadata"""
+    projected = {"id": doc["id"]}
+    for key in ("content", "tags"):
+        if key in wanted:
+            projected[key] = doc[key]
+    if "metadata" in wanted:
+        projected["metadata"] = doc.get("metadata", {})
+    elif field_names:
+        projected["metadata"] = {name: value for name, value in doc.get("metadata", {}).items() if name in field_names}
+    return projected
+
+def fetch_documents(
+    doc_ids: List[int], records: bool, fields: Optional[Sequence[str]] = None, of_dataset: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Built-in documents (or dataset records) by id in the given order, missing ones left out
+
+    ``fields`` picks what each document carries besides its id: ``content``,
+    ``tags``, ``metadata`` (every field of a record) or the names of single
+    record fields; by default content and tags. Content and tags come from the
+    in-memory document store; record fields are read with the records, in one
+    query per shard and chunk of ids. Records restricted to one dataset
+    (``of_dataset``) are always read from its shard, where the dataset is
+    checked in the same query.
+    """
+    wanted = set(fields) if fields is not None else {"content", "tags"}
+    field_names = wanted - DOCUMENT_ATTRIBUTES
+    with SEARCH_STAGE_LATENCY.time("hydration"):
+        if not records:
+            docs = doc_store.get_documents(doc_ids, load_documents_from_db)
+        elif of_dataset is not None or "metadata" in wanted or field_names:
+            with_fields = "metadata" in wanted or bool(field_names)
+            loaded = {record["id"]: record for record in load_records_from_db(doc_ids, with_fields, of_dataset)}
+            docs = [loaded[doc_id] for doc_id in doc_ids if doc_id in loaded]
         else:
-            # Search in default documents
-            statement = select(Document)
-            results = session.exec(statement).all()
-            query_lower = query.lower()
-            return [
-                doc for doc in results
-                if query_lower in doc.content.lower() or query_lower in doc.tags.lower()
-            ]
+            docs = doc_store.get_records(doc_ids, load_records_from_db)
+    return [project_document(doc, wanted, field_names) for doc in docs]
 
-# Import the Rust extension (this would be built with PyO3)
-try:
-    from rust_ext import LockFreeHashMap
-except ImportError:
-    # Fallback for development
-    class LockFreeHashMap:
-        def __init__(self):
-            self.data = {}
-        def insert(self, key, value):
-            self.data[key] = value
-        def get(self, key):
-            return self.data.get(key)
+def hydrated_results(
+    doc_ids: List[int], scores: List[float], documents: List[Dict[str, Any]]
+) -> Tuple[List[int], List[float]]:
+    """Results without the ones hydration found no row for, i.e. deleted after the index was read"""
+    if len(documents) == len(doc_ids):
+        return doc_ids, scores
+    found = {doc["id"] for doc in documents}
+    kept = [i for i, doc_id in enumerate(doc_ids) if doc_id in found]
+    return [doc_ids[i] for i in kept], [scores[i] for i in kept]
+
+def get_documents_batch(doc_ids: List[int], dataset_id: Optional[int], fields: Optional[Sequence[str]]) -> List[Dict[str, Any]]:
+    """Documents by id in request order, from one dataset's records or, without one, like GET /documents/{id}"""
+    if dataset_id:
+        found = fetch_documents(doc_ids, True, fields, of_dataset=dataset_id)
+    else:
+        # The Document index knows every built-in id; other ids are looked up as dataset records
+        index = get_search_index(None)
+        builtin = [doc_id for doc_id in doc_ids if index.contains(doc_id)]
+        others = [doc_id for doc_id in doc_ids if not index.contains(doc_id)]
+        found = fetch_documents(builtin, False, fields) + fetch_documents(others, True, fields)
+    by_id = {doc["id"]: doc for doc in found}
+    return [by_id[doc_id] for doc_id in doc_ids if doc_id in by_id]
+
+def get_document_or_record(doc_id: int) -> Optional[Dict[str, Any]]:
+    """Look up a built-in document, falling back to user dataset records"""
+    # The Document index knows every built-in id, so misses skip the Document table
+    if get_search_index(None).contains(doc_id):
+        docs = doc_store.get_documents([doc_id], load_documents_from_db)
+        if docs:
+            return docs[0]
+    return doc_store.get_record(doc_id, load_records_from_db)
+
+def load_search_state():
+    """Restore indexes from the snapshot, rebuilding only what changed since it was taken"""
+    restored = restore_index_snapshot()
+    if search_indexes.get(None) is None:
+        build_document_index()
+        save_index_snapshot()
+    print(f"Restored {restored} index(es) from snapshot")
+
+def page_rows(statement, key, after: Optional[int], limit: int, bind=None) -> list:
+    """Fetch one keyset page: rows whose key is greater than the cursor, in key order"""
+    if after is not None:
+        statement = statement.where(key > after)
+    with Session(bind or engine) as session:
+        return session.exec(statement.order_by(key).limit(limit)).all()
+
+def document_page(after: Optional[int], limit: int) -> List["DocumentResponse"]:
+    rows = page_rows(select(Document.id, Document.content, Document.tags), Document.id, after, limit)
+    return [DocumentResponse(id=doc_id, content=content, tags=tags.split(",")) for doc_id, content, tags in rows]
+
+def dataset_page(after: Optional[int], limit: int) -> List["DatasetInfo"]:
+    return [DatasetInfo(**dataset.dict()) for dataset in page_rows(select(UserDataset), UserDataset.id, after, limit)]
+
+def record_page(dataset_id: int, after: Optional[int], limit: int) -> List["DatasetRecordResponse"]:
+    rows = page_rows(
+        select(DatasetRecord.id, DatasetRecord.content, DatasetRecord.created_at)
+        .where(DatasetRecord.dataset_id == dataset_id),
+        DatasetRecord.id, after, limit, dataset_engine(dataset_id),
+    )
+    with Session(dataset_engine(dataset_id)) as session:
+        fields = record_fields(session, load_schema(session, dataset_id), [row[0] for row in rows])
+    return [
+        DatasetRecordResponse(
+            id=record_id,
+            dataset_id=dataset_id,
+            content=derived_content(fields.get(record_id, {})) if content is None else content,
+            metadata=fields.get(record_id),
+            created_at=created_at,
+        )
+        for record_id, content, created_at in rows
+    ]
+
+def get_dataset_in_db(dataset_id: int) -> Optional[UserDataset]:
+    with Session(engine) as session:
+        return session.get(UserDataset, dataset_id)
 
 # Import GPU scoring (this would be the actual GPU module)
 try:
     from hp_data_structures.gpu_score import GpuScorer
 except ImportError:
-    # Fallback for development
-    class GpuScorer:
-        async def new():
-            return GpuScorer()
-        def compute_softmax_and_top_k(self, input_data, k):
-            import numpy as np
-            exp_data = np.exp(input_data)
-            softmax = exp_data / np.sum(exp_data)
-            indices = np.argsort(softmax)[-k:][::-1]
-            return indices.tolist()
+    # Fallback for development: vectorized CPU scorer with the same interface
+    from scoring import CpuScorer as GpuScorer
 
 app = FastAPI(title="HP Search Service", version="1.0.0")
 
@@ -294,28 +1141,91 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Pagination cursors, so the frontend can page through list endpoints
+    expose_headers=["X-Next-Cursor", "Link"],
 )
 
 # Global state
-hash_map = LockFreeHashMap()
+doc_store = DocumentStore(max_records=int(os.environ.get("DOC_STORE_MAX_RECORDS", "100000")))
 gpu_scorer = None
+cpu_scorer = CpuScorer()
+
+def collect_cache_counters():
+    stats = result_cache.stats()
+    return [({"event": event}, stats[event]) for event in ("hits", "misses", "evictions", "expirations", "invalidations")]
+
+def collect_flight_counters():
+    stats = search_flights.stats()
+    return [({"outcome": "executed"}, stats["executions"]), ({"outcome": "coalesced"}, stats["coalesced"])]
+
+def collect_doc_store_counters():
+    stats = doc_store.stats()
+    return [({"event": event}, stats[event]) for event in ("hits", "misses", "evictions")]
+
+def collect_doc_store_size():
+    stats = doc_store.stats()
+    return [({"tier": "documents"}, stats["documents"]), ({"tier": "records"}, stats["records"])]
+
+metrics.collector("zerostack_result_cache_entries", "Cached search results", lambda: result_cache.stats()["entries"])
+metrics.collector("zerostack_result_cache_events_total", "Result cache lookups and removals", collect_cache_counters, "counter")
+def collect_pool_sizes():
+    return [({"shard": str(shard.number)}, shard.engine.pool.size()) for shard in shards]
+
+def collect_pool_checked_out():
+    return [({"shard": str(shard.number)}, shard.engine.pool.checkedout()) for shard in shards]
+
+metrics.collector("zerostack_search_flights_total", "Searches computed vs joined to an identical in-flight search", collect_flight_counters, "counter")
+metrics.collector("zerostack_search_in_flight", "Distinct searches being computed", lambda: search_flights.stats()["in_flight"])
+metrics.collector("zerostack_db_pool_size", "Configured DB connection pool size per shard", collect_pool_sizes)
+metrics.collector("zerostack_db_pool_checked_out", "DB connections currently in use per shard", collect_pool_checked_out)
+metrics.collector("zerostack_doc_store_records", "Documents held in memory for hydration", collect_doc_store_size)
+metrics.collector("zerostack_doc_store_events_total", "Document store lookups and evictions", collect_doc_store_counters, "counter")
+metrics.collector("zerostack_search_indexes", "Search indexes loaded in memory", lambda: len(search_indexes.items()))
+metrics.collector(
+    "zerostack_vector_rows", "Live embedding rows in loaded vector matrices",
+    lambda: sum(matrix.live_count for _, matrix in vector_store.items()),
+)
 
 class SearchRequest(BaseModel):
     query: str
     top_k: int = 10
     dataset_id: Optional[int] = None
+    dataset_ids: Optional[List[int]] = None  # Search several datasets at once; overrides dataset_id
+    filters: Optional[Dict[str, Any]] = None  # Field filters, e.g. {"category": "fruit", "price": {"lt": 5}}
+    mode: Literal["lexical", "vector", "hybrid"] = "lexical"  # BM25, embedding similarity, or both fused
+    vector_weight: confloat(ge=0, le=1) = 0.5  # Share of embedding similarity in hybrid scores
+    include_documents: bool = False  # Return the result documents inline, in result order
+    fields: Optional[List[str]] = None  # What inline documents carry (see DocumentBatchRequest)
 
 class SearchResponse(BaseModel):
     results: List[int]
     scores: List[float]
     query: str
     total_found: int
+    documents: Optional[List[Dict[str, Any]]] = None  # With include_documents
+    profile: Optional[Dict[str, Any]] = None  # Stage timings, when an admin asked for them
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchRequest]
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResponse]  # In request order
+    profile: Optional[Dict[str, Any]] = None
 
 class DocumentResponse(BaseModel):
     id: int
     content: str
     tags: List[str]
 
+class DocumentBatchRequest(BaseModel):
+    ids: List[int]
+    dataset_id: Optional[int] = None  # Look the ids up among this dataset's records only
+    fields: Optional[List[str]] = None  # content, tags, metadata or record field names; default content and tags
+
+class DocumentBatchResponse(BaseModel):
+    documents: List[Dict[str, Any]]  # In request order
+    missing: List[int]
+
 class UploadResponse(BaseModel):
     dataset_id: int
     name: str
@@ -323,6 +1233,20 @@ class UploadResponse(BaseModel):
     total_records: int
     format_detected: Dict[str, Any]
     sample_records: List[Dict[str, Any]]
+    ingest_seconds: float = 0.0
+    rows_per_second: float = 0.0
+    profile: Optional[Dict[str, Any]] = None
+
+class AppendResponse(UploadResponse):
+    records_added: int
+
+class DeleteRecordsRequest(BaseModel):
+    ids: List[int]
+
+class DeleteRecordsResponse(BaseModel):
+    dataset_id: int
+    deleted: int
+    total_records: int
 
 class DatasetInfo(BaseModel):
     id: int
@@ -332,28 +1256,140 @@ class DatasetInfo(BaseModel):
     created_at: datetime
     file_size: Optional[int]
 
+class DatasetRecordResponse(BaseModel):
+    id: int
+    dataset_id: int
+    content: str
+    metadata: Optional[Dict[str, Any]] = None
+    created_at: datetime
+
+# A keyset page loader: (after, limit) -> rows ordered by id
+PageLoader = Callable[[Optional[int], int], List[BaseModel]]
+
+def wants_ndjson(request: Request, output_format: Optional[str]) -> bool:
+    """NDJSON is chosen with ?format=ndjson or an Accept: application/x-ndjson header"""
+    if output_format:
+        return output_format == "ndjson"
+    return "application/x-ndjson" in request.headers.get("accept", "")
+
+async def stream_ndjson(load_page: PageLoader, after: Optional[int], limit: Optional[int]) -> AsyncIterator[str]:
+    """Yield every row after the cursor (up to limit) as NDJSON, one DB page at a time"""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = EXPORT_BATCH_SIZE if remaining is None else min(EXPORT_BATCH_SIZE, remaining)
+        rows = await run_db(load_page, after, size)
+        if rows:
+            yield "".join(row.model_dump_json() + "\n" for row in rows)
+        if len(rows) < size:
+            return
+        after = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+
+async def paginate(
+    request: Request,
+    response: Response,
+    load_page: PageLoader,
+    after: Optional[int],
+    limit: Optional[int],
+    output_format: Optional[str],
+):
+    """Serve one keyset page as a JSON array, or stream all remaining rows as NDJSON"""
+    if wants_ndjson(request, output_format):
+        return StreamingResponse(stream_ndjson(load_page, after, limit), media_type="application/x-ndjson")
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    rows = await run_db(load_page, after, limit)
+    if len(rows) == limit:
+        # A full page may have more behind it; the cursor is the last id served
+        next_cursor = rows[-1].id
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+        response.headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+    return rows
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Observe request latency, labelled by route template rather than raw path"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started, request.method, getattr(route, "path", "unmatched"), str(status)
+        )
+
+def is_admin(request: Request) -> bool:
+    """Whether the caller presented ADMIN_TOKEN"""
+    token = request.headers.get("x-admin-token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile requests an admin asked to profile, and time every request for the slow-request log"""
+    flag = (request.headers.get("x-profile") or request.query_params.get("profile") or "").lower()
+    requested = flag not in ("", "0", "false")
+    if requested and not is_admin(request):
+        return JSONResponse(status_code=403, content={"detail": "Profiling is limited to admin callers"})
+    if not requested and not slow_log.enabled:
+        return await call_next(request)
+    # Endpoints attach the report to their response while the profile is active
+    profile = RequestProfile(requested, cprofile=flag == "cprofile")
+    try:
+        with profiling.activate(profile, finish=False):
+            response = await call_next(request)
+    except BaseException:
+        profile.finish()
+        raise
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    body = response.body_iterator
+
+    async def body_then_finish() -> AsyncIterator[bytes]:
+        # call_next returns once the headers are ready; a streamed body (NDJSON exports)
+        # is still being produced, so the request ends when its last chunk is sent
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            profile.finish()
+            if slow_log.record(profile, request.method, route, response.status_code):
+                SLOW_REQUESTS.inc(route)
+
+    response.body_iterator = body_then_finish()
+    return response
+
 @app.on_event("startup")
 async def startup_event():
-    global gpu_scorer, hash_map
-    create_db_and_tables()
-    add_sample_documents()
+    global gpu_scorer
+    await run_db(create_db_and_tables)
+    await run_db(add_sample_documents)
     try:
         gpu_scorer = await GpuScorer.new()
     except Exception as e:
         print(f"Warning: GPU scorer initialization failed: {e}")
         gpu_scorer = None
-    # Load all documents into the hash map for fast access
-    with Session(engine) as session:
-        docs = session.exec(select(Document)).all()
-        for doc in docs:
-            hash_map.insert(doc.id, {"id": doc.id, "content": doc.content, "tags": doc.tags.split(",")})
+    # Map search structures from the snapshot; documents are loaded into the store on demand
+    await run_db(load_search_state)
     print("Search service initialized successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    try:
+        await run_db(save_index_snapshot)
+    except Exception as e:
+        print(f"Warning: failed to save index snapshot: {e}")
+    db_executor.shutdown(wait=True)
+    cpu_executor.shutdown(wait=True)
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=True)
+
 @app.get("/")
 async def root():
     return {"message": "HP Search Service is running", "version": "1.0.0"}
 
-@app.post("/upload", response_model=UploadResponse)
+@app.post("/upload", response_model=UploadResponse, response_model_exclude_none=True)
 async def upload_dataset(
     file: Optional[UploadFile] = File(None),
     text_data: Optional[str] = Form(None),
@@ -362,96 +1398,317 @@ async def upload_dataset(
     """Upload a dataset via file or text paste"""
     try:
         if file:
-            # Handle file upload
-            content = await file.read()
-            raw_data = content.decode('utf-8')
+            # Handle file upload: decode the spooled upload incrementally instead of reading it whole
+            stream = open_text_stream(file.file)
+            try:
+                result = await run_db(process_uploaded_data, stream, dataset_name, file.size)
+            finally:
+                stream.detach()  # leave closing the upload to FastAPI
         elif text_data:
             # Handle text paste
-            raw_data = text_data
+            result = await run_db(process_uploaded_data, text_data, dataset_name)
         else:
             raise HTTPException(status_code=400, detail="Either file or text_data must be provided")
         
-        if not raw_data.strip():
-            raise HTTPException(status_code=400, detail="No data provided")
-        
-        # Process the uploaded data
-        result = process_uploaded_data(raw_data, dataset_name)
-        return UploadResponse(**result)
+        return UploadResponse(**result, profile=profiling.report())
         
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Malformed or undecodable payloads (JSON, UTF-8) are client errors
+        raise HTTPException(status_code=400, detail=f"Upload failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @app.get("/datasets", response_model=List[DatasetInfo])
-async def list_datasets():
-    """List all user-uploaded datasets"""
-    with Session(engine) as session:
-        datasets = session.exec(select(UserDataset)).all()
-        return [DatasetInfo(**dataset.dict()) for dataset in datasets]
+async def list_datasets(
+    request: Request,
+    response: Response,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output_format: Optional[str] = Query(None, alias="format", pattern="^(json|ndjson)$"),
+):
+    """List user-uploaded datasets, one keyset page at a time"""
+    return await paginate(request, response, dataset_page, after, limit, output_format)
+
+@app.get("/datasets/{dataset_id}/records", response_model=List[DatasetRecordResponse])
+async def list_dataset_records(
+    dataset_id: int,
+    request: Request,
+    response: Response,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output_format: Optional[str] = Query(None, alias="format", pattern="^(json|ndjson)$"),
+):
+    """List or export the records of a dataset"""
+    if not await run_db(get_dataset_in_db, dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return await paginate(request, response, partial(record_page, dataset_id), after, limit, output_format)
+
+@app.post("/datasets/{dataset_id}/append", response_model=AppendResponse, response_model_exclude_none=True)
+async def append_dataset(
+    dataset_id: int,
+    file: Optional[UploadFile] = File(None),
+    text_data: Optional[str] = Form(None),
+):
+    """Add records to an existing dataset via file or text paste"""
+    try:
+        if file:
+            stream = open_text_stream(file.file)
+            try:
+                result = await run_db(append_to_dataset, dataset_id, stream, file.size)
+            finally:
+                stream.detach()  # leave closing the upload to FastAPI
+        elif text_data:
+            result = await run_db(append_to_dataset, dataset_id, text_data)
+        else:
+            raise HTTPException(status_code=400, detail="Either file or text_data must be provided")
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Append failed: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Append failed: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return AppendResponse(**result, profile=profiling.report())
+
+@app.post("/datasets/{dataset_id}/records/delete", response_model=DeleteRecordsResponse)
+async def delete_dataset_records(dataset_id: int, request: DeleteRecordsRequest):
+    """Delete records of a dataset by id; ids not in the dataset are ignored"""
+    result = await run_db(delete_records, dataset_id, request.ids)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return DeleteRecordsResponse(**result)
 
-@app.post("/search", response_model=SearchResponse)
+@app.delete("/datasets/{dataset_id}/records/{record_id}", response_model=DeleteRecordsResponse)
+async def delete_dataset_record(dataset_id: int, record_id: int):
+    """Delete a single record of a dataset"""
+    result = await run_db(delete_records, dataset_id, [record_id])
+    if result is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if not result["deleted"]:
+        raise HTTPException(status_code=404, detail="Record not found")
+    return DeleteRecordsResponse(**result)
+
+@app.delete("/datasets/{dataset_id}", status_code=204)
+async def delete_user_dataset(dataset_id: int):
+    """Delete a dataset and all of its records"""
+    if not await run_db(delete_dataset, dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return Response(status_code=204)
+
+def search_cache_key(request: SearchRequest, dataset_id: Optional[int]):
+    mode = f"hybrid:{request.vector_weight}" if request.mode == "hybrid" else request.mode
+    return result_cache.make_key(request.query, dataset_id, request.top_k, request.filters, mode)
+
+async def search_dataset_cached(request: SearchRequest, dataset_id: Optional[int], filters: List[FieldFilter]) -> Tuple[List[int], List[float]]:
+    """Top-k (ids, scores) of one dataset, through the result cache and in-flight searches"""
+    cache_key = search_cache_key(request, dataset_id)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        profiling.count("cache_hits")
+        return cached
+    return await search_dataset_uncached(request, dataset_id, filters, cache_key)
+
+async def search_dataset_uncached(
+    request: SearchRequest, dataset_id: Optional[int], filters: List[FieldFilter], cache_key
+) -> Tuple[List[int], List[float]]:
+    """Compute the top-k of one dataset in the request's ranking mode and cache it"""
+    generation = result_cache.generation(dataset_id)
+
+    async def compute():
+        result = ([], [])
+        if request.mode == "vector":
+            matrix, candidates = await run_db(vector_candidates, dataset_id, filters)
+            result = await run_cpu(rank_vectors, request.query, matrix, candidates, request.top_k)
+        else:
+            doc_ids, terms = await run_db(search_documents_in_db, request.query, dataset_id, filters)
+            if request.mode == "hybrid":
+                matrix, candidates = await run_db(vector_candidates, dataset_id, filters)
+                result = await run_cpu(
+                    rank_hybrid, request.query, terms, dataset_id, doc_ids, matrix, candidates, request.top_k,
+                    request.vector_weight,
+                )
+            elif doc_ids:
+                result = await run_cpu(rank_candidates, terms, dataset_id, doc_ids, request.top_k)
+        result_cache.put(cache_key, result, generation)
+        return result
+
+    # Keyed on the generation too: a search started before a write is never joined after it
+    return await search_flights.run((cache_key, generation), compute)
+
+def searches_records(request: SearchRequest) -> bool:
+    """Whether a search ranks dataset records rather than the built-in documents"""
+    return bool(request.dataset_ids or request.dataset_id)
+
+def merge_top_k(parts: List[Tuple[List[int], List[float]]], top_k: int) -> Tuple[List[int], List[float]]:
+    """Merge per-dataset top-k results into one top-k; record ids are unique across datasets
+
+    The merge is by score as computed within each dataset. BM25 scores use each
+    dataset's own document count, average length and document frequencies, so
+    the merged order is approximate: the same text scores higher in a dataset
+    where its terms are rare. Scoring against statistics of the whole request
+    would make a dataset's (cached, coalesced) result depend on which other
+    datasets it was searched with.
+    """
+    ids = np.array([doc_id for part_ids, _ in parts for doc_id in part_ids], dtype=np.int64)
+    scores = np.array([score for _, part_scores in parts for score in part_scores], dtype=np.float32)
+    indices, top_scores = cpu_scorer.top_k(scores, top_k)
+    return ids[indices].tolist(), top_scores.tolist()
+
+@app.post("/search", response_model=SearchResponse, response_model_exclude_none=True)
 async def search_documents(request: SearchRequest):
+    profiling.annotate(
+        query=request.query, dataset_ids=request.dataset_ids or [request.dataset_id], mode=request.mode,
+        top_k=request.top_k, filters=request.filters,
+    )
     try:
-        docs = search_documents_in_db(request.query, request.dataset_id)
-        initial_doc_ids = [doc.id for doc in docs]
-        if not initial_doc_ids:
-            return SearchResponse(results=[], scores=[], query=request.query, total_found=0)
-        
-        # Get documents from hash map or database
-        if request.dataset_id:
-            # Search in user dataset
-            with Session(engine) as session:
-                dataset_records = session.exec(
-                    select(DatasetRecord).where(DatasetRecord.id.in_(initial_doc_ids))
-                ).all()
-                documents = [
-                    {"id": record.id, "content": record.content, "tags": ["user_dataset"]}
-                    for record in dataset_records
-                ]
+        filters = parse_filters(request.filters)
+        if request.dataset_ids:
+            # Each dataset lives on one shard: scatter to them in parallel, gather the top-k
+            parts = await asyncio.gather(*(
+                search_dataset_cached(request, dataset_id, filters)
+                for dataset_id in dict.fromkeys(request.dataset_ids)
+            ))
+            final_doc_ids, final_scores = merge_top_k(parts, request.top_k)
         else:
-            # Search in default documents
-            documents = [hash_map.get(doc_id) for doc_id in initial_doc_ids]
+            # Candidates are ranked with BM25 over the dataset's term statistics
+            final_doc_ids, final_scores = await search_dataset_cached(request, request.dataset_id, filters)
+        profiling.count("results", len(final_doc_ids))
+        documents = None
+        if request.include_documents:
+            # Hydrated in one batched lookup instead of a GET /documents/{id} per result
+            documents = await run_db(fetch_documents, final_doc_ids, searches_records(request), request.fields)
+            final_doc_ids, final_scores = hydrated_results(final_doc_ids, final_scores, documents)
+        return SearchResponse(
+            results=final_doc_ids, scores=final_scores, query=request.query, total_found=len(final_doc_ids),
+            documents=documents, profile=profiling.report(),
+        )
+    except QuerySyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+@app.post("/search/batch", response_model=BatchSearchResponse, response_model_exclude_none=True)
+async def search_documents_batch(request: BatchSearchRequest):
+    """Run many searches in one request, sharing lookups and scoring per dataset"""
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries are allowed per batch"
+        )
+    profiling.annotate(queries=[item.query for item in request.queries])
+    try:
+        item_filters = [parse_filters(item.filters) for item in request.queries]
+        # Per query, one (query, dataset, top_k, filters, mode) cache key per dataset it searches
+        item_keys = [
+            [
+                search_cache_key(item, dataset_id)
+                for dataset_id in dict.fromkeys(item.dataset_ids or [item.dataset_id or None])
+            ]
+            for item in request.queries
+        ]
+        computed: Dict[Any, Tuple[List[int], List[float]]] = {}
+        # dataset_id -> cache key -> (query text, filters); repeated queries are computed once
+        groups: Dict[Optional[int], Dict[Any, Tuple[str, List[FieldFilter]]]] = {}
+        # Vector and hybrid queries are ranked one by one: cache key -> (item, filters)
+        singles: Dict[Any, Tuple[SearchRequest, List[FieldFilter]]] = {}
+        for item, filters, keys in zip(request.queries, item_filters, item_keys):
+            for cache_key in keys:
+                if cache_key in computed or cache_key in singles:
+                    continue
+                cached = result_cache.get(cache_key)
+                if cached is not None:
+                    profiling.count("cache_hits")
+                    computed[cache_key] = cached
+                elif item.mode != "lexical":
+                    singles[cache_key] = (item, filters)
+                else:
+                    groups.setdefault(cache_key[1], {})[cache_key] = (item.query, filters)
         
-        # Compute embeddings (mock)
-        import random
-        random.seed(42)
-        embeddings = [[random.uniform(-1, 1) for _ in range(1000)] for _ in initial_doc_ids]
+        async def run_group(dataset_id: Optional[int], pending: Dict[Any, Tuple[str, List[FieldFilter]]]):
+            generation = result_cache.generation(dataset_id)
+            keys = list(pending)
+            queries = [query for query, _ in pending.values()]
+            filter_sets = [filters for _, filters in pending.values()]
+            candidate_sets, terms = await run_db(search_batch_in_db, queries, dataset_id, filter_sets)
+            ranked = await run_cpu(rank_batch, terms, dataset_id, candidate_sets, [key[2] for key in keys])
+            for key, result in zip(keys, ranked):
+                result_cache.put(key, result, generation)
+                computed[key] = result
         
-        # Use GPU scoring for ranking
-        if gpu_scorer and len(embeddings) > 0:
-            import numpy as np
-            scores = np.sum(embeddings, axis=1).tolist()
-            top_k_indices = gpu_scorer.compute_softmax_and_top_k(scores, min(request.top_k, len(scores)))
-            final_doc_ids = [initial_doc_ids[i] for i in top_k_indices]
-            final_scores = [scores[i] for i in top_k_indices]
-        else:
-            final_doc_ids = initial_doc_ids[:request.top_k]
-            final_scores = [1.0] * len(final_doc_ids)
+        async def run_single(cache_key, item: SearchRequest, filters: List[FieldFilter]):
+            computed[cache_key] = await search_dataset_uncached(item, cache_key[1], filters, cache_key)
         
-        return SearchResponse(results=final_doc_ids, scores=final_scores, query=request.query, total_found=len(final_doc_ids))
+        # Datasets (and so shards) are searched in parallel
+        await asyncio.gather(
+            *(run_group(dataset_id, pending) for dataset_id, pending in groups.items()),
+            *(run_single(cache_key, item, filters) for cache_key, (item, filters) in singles.items()),
+        )
+        results = [
+            computed[keys[0]] if len(keys) == 1 else merge_top_k([computed[key] for key in keys], item.top_k)
+            for item, keys in zip(request.queries, item_keys)
+        ]
+        profiling.count("results", sum(len(ids) for ids, _ in results))
+        hydrate = [i for i, item in enumerate(request.queries) if item.include_documents]
+        hydrated = await asyncio.gather(*(
+            run_db(fetch_documents, results[i][0], searches_records(request.queries[i]), request.queries[i].fields)
+            for i in hydrate
+        ))
+        documents: Dict[int, List[Dict[str, Any]]] = dict(zip(hydrate, hydrated))
+        for i, docs in documents.items():
+            results[i] = hydrated_results(*results[i], docs)
+        return BatchSearchResponse(results=[
+            SearchResponse(results=ids, scores=scores, query=item.query, total_found=len(ids), documents=documents.get(i))
+            for i, (item, (ids, scores)) in enumerate(zip(request.queries, results))
+        ], profile=profiling.report())
+    except QuerySyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+    except FilterError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {str(e)}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit, miss and eviction counters for the search result cache, and search coalescing counters"""
+    return {**result_cache.stats(), "coalescing": search_flights.stats()}
+
+@app.post("/documents/batch", response_model=DocumentBatchResponse)
+async def get_documents(request: DocumentBatchRequest):
+    """Fetch many documents or dataset records at once, optionally projected to some fields"""
+    doc_ids = list(dict.fromkeys(request.ids))
+    if len(doc_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids are allowed per request")
+    if request.dataset_id and await run_db(get_dataset_in_db, request.dataset_id) is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    documents = await run_db(get_documents_batch, doc_ids, request.dataset_id, request.fields)
+    found = {doc["id"] for doc in documents}
+    return DocumentBatchResponse(documents=documents, missing=[doc_id for doc_id in doc_ids if doc_id not in found])
 
 @app.get("/documents/{doc_id}", response_model=DocumentResponse)
 async def get_document(doc_id: int):
-    doc = hash_map.get(doc_id)
+    doc = await run_db(get_document_or_record, doc_id)
     if not doc:
-        # Try to find in user datasets
-        with Session(engine) as session:
-            record = session.get(DatasetRecord, doc_id)
-            if record:
-                return DocumentResponse(
-                    id=record.id,
-                    content=record.content,
-                    tags=["user_dataset"]
-                )
         raise HTTPException(status_code=404, detail="Document not found")
     return DocumentResponse(**doc)
 
 @app.get("/documents", response_model=List[DocumentResponse])
-async def list_documents():
-    with Session(engine) as session:
-        docs = session.exec(select(Document)).all()
-        return [{"id": doc.id, "content": doc.content, "tags": doc.tags.split(",")} for doc in docs]
+async def list_documents(
+    request: Request,
+    response: Response,
+    after: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    output_format: Optional[str] = Query(None, alias="format", pattern="^(json|ndjson)$"),
+):
+    return await paginate(request, response, document_page, after, limit, output_format)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,193 @@
+"""
+In-process Prometheus metrics for the search service.
+
+Counters and histograms are recorded in memory and rendered in the Prometheus
+text exposition format by ``GET /metrics``. Numbers that already live in
+other components (result cache, DB pool, document store) are read at scrape
+time by collector callbacks rather than being counted twice.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond index lookups to multi-second uploads
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+LabelValues = Tuple[str, ...]
+# What a collector callback returns: a bare value, or (labels, value) pairs
+CollectorResult = Union[float, Iterable[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing value, one series per label combination"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        key = tuple(str(v) for v in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Bucketed distribution of observed values, one series per label combination"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per series: [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._observers: List[Callable[[float, LabelValues], None]] = []
+        self._lock = threading.Lock()
+
+    def add_observer(self, callback: Callable[[float, LabelValues], None]) -> None:
+        """Also pass every observation to ``callback(value, labelvalues)``, e.g. for per-request profiling"""
+        self._observers.append(callback)
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        key = tuple(str(v) for v in labelvalues)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][slot] += 1
+            series[1][0] += value
+        for callback in self._observers:
+            callback(value, key)
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Observe the wall-clock duration of the enclosed block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _Collected:
+    """Metric whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name: str, documentation: str, type_name: str, collect: Callable[[], CollectorResult]):
+        self.name = name
+        self.documentation = documentation
+        self.type_name = type_name
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        result = self.collect()
+        if isinstance(result, (int, float)):
+            return [f"{self.name} {_format_value(result)}"]
+        lines = []
+        for labels, value in result:
+            names = tuple(labels)
+            lines.append(f"{self.name}{_format_labels(names, [labels[n] for n in names])} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Set of metrics rendered together in the text exposition format"""
+
+    def __init__(self):
+        self._metrics: List[Union[Counter, Histogram, _Collected]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(
+        self, name: str, documentation: str, collect: Callable[[], CollectorResult], type_name: str = "gauge"
+    ) -> None:
+        """Register a gauge (or counter) read from ``collect`` on every scrape"""
+        self._metrics.append(_Collected(name, documentation, type_name, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                # A failing collector must not take the whole scrape down
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,209 @@
+"""
+Per-request profiling and the slow-request log.
+
+A RequestProfile collects the stage timings and counters of one request. While
+it is active (see ``activate``), stage histograms that pass their observations
+to ``record_stage`` add them to it, and ``count`` adds to its counters. Work
+handed to a worker thread through ``bind`` runs in a copy of the request's
+context, so stages timed on the DB and CPU pools land in the right profile.
+Stages a request runs more than once (one per dataset, say) add up.
+
+cProfile is deterministic and slows everything it watches, so it runs only
+when asked for, for one request at a time, and only around the request's work
+on the worker threads; the event loop, shared by every request, is not
+profiled.
+"""
+
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Functions listed in a cProfile summary, by cumulative time
+CPROFILE_TOP_FUNCTIONS = 25
+
+_active: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+# Held by the one request being run under cProfile
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """Stage timings and counters of one request, optionally with a cProfile of its worker-thread work"""
+
+    def __init__(self, requested: bool = False, cprofile: bool = False):
+        # Whether the caller asked for the profile (else it only feeds the slow-request log)
+        self.requested = requested
+        self.cprofile_requested = cprofile
+        self.cprofile = cprofile and _cprofile_lock.acquire(blocking=False)
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.details: Dict[str, Any] = {}
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_count(self, name: str, amount: int) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """Run fn, under cProfile if this request is being profiled with it"""
+        if not self.cprofile:
+            return fn()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another thread of this request already holds the interpreter's profiler
+            return fn()
+        try:
+            return fn()
+        finally:
+            profiler.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profiler)
+                else:
+                    self._stats.add(profiler)
+
+    def elapsed(self) -> float:
+        return self.seconds if self.seconds is not None else time.perf_counter() - self.started
+
+    def finish(self) -> None:
+        """Stop the clock and let the next request use cProfile"""
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+            if self.cprofile:
+                _cprofile_lock.release()
+
+    def cprofile_summary(self) -> Any:
+        if not self.cprofile:
+            return {"skipped": "another request is being profiled"}
+        with self._lock:
+            if self._stats is None:
+                return []
+            entries = sorted(self._stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        return [
+            {
+                "function": f"{name} ({os.path.basename(filename)}:{line})",
+                "calls": calls,
+                "own_seconds": round(own, 6),
+                "cumulative_seconds": round(cumulative, 6),
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in entries[:CPROFILE_TOP_FUNCTIONS]
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            report = {
+                **self.details,
+                "seconds": round(self.elapsed(), 6),
+                "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+                "counts": dict(self.counts),
+            }
+        if self.cprofile_requested:
+            report["cprofile"] = self.cprofile_summary()
+        return report
+
+
+@contextmanager
+def activate(profile: RequestProfile, finish: bool = True) -> Iterator[RequestProfile]:
+    """Make profile the current request's profile for the enclosed block (and tasks it starts)
+
+    With ``finish=False`` the profile keeps running after the block, e.g. while
+    a streamed response body is still being produced; the caller finishes it.
+    """
+    token = _active.set(profile)
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+        if finish:
+            profile.finish()
+
+
+def bind(fn: Callable[[], T]) -> Callable[[], T]:
+    """fn, made to run on another thread inside the current request's profile, if any"""
+    profile = _active.get()
+    if profile is None:
+        return fn
+    return partial(contextvars.copy_context().run, profile.call, fn)
+
+
+def record_stage(seconds: float, labelvalues: Sequence[str]) -> None:
+    """Histogram observer: add a stage timing to the current request's profile"""
+    profile = _active.get()
+    if profile is not None:
+        profile.add_stage(labelvalues[0], seconds)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a counter of the current request's profile (candidates, records, ...)"""
+    profile = _active.get()
+    if profile is not None:
+        profile.add_count(name, amount)
+
+
+def annotate(**details: Any) -> None:
+    """Describe the current request (query, dataset, ...) in its profile"""
+    profile = _active.get()
+    if profile is not None:
+        profile.details.update(details)
+
+
+def report() -> Optional[Dict[str, Any]]:
+    """The current request's profile for its response, if the caller asked for one"""
+    profile = _active.get()
+    if profile is None or not profile.requested:
+        return None
+    return profile.summary()
+
+
+class SlowRequestLog:
+    """Writes requests slower than a threshold as JSON lines, to a file or stderr"""
+
+    def __init__(self, threshold_seconds: float, path: Optional[str] = None):
+        self.threshold_seconds = threshold_seconds
+        self.logged = 0
+        self._logger = logging.getLogger("zerostack.slow_requests")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if self.enabled and not self._logger.handlers:
+            handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_seconds > 0
+
+    def record(self, profile: RequestProfile, method: str, route: str, status: int) -> bool:
+        """Log the request if it was slow; returns whether it was"""
+        if not self.enabled or profile.elapsed() < self.threshold_seconds:
+            return False
+        entry = {
+            "time": datetime.utcnow().isoformat(timespec="milliseconds"),
+            "method": method,
+            "route": route,
+            "status": status,
+            **profile.summary(),
+        }
+        self._logger.info(json.dumps(entry, default=str))
+        self.logged += 1
+        return True
@@ -0,0 +1,393 @@
+"""
+Boolean query language and selectivity-ordered planner over the inverted indexes.
+
+Queries combine words with ``AND``, ``OR``, ``NOT`` (upper case) and
+parentheses; adjacent words are implicitly ANDed, so a plain query such as
+``apple pie`` keeps its meaning of "records containing every word". This is
+the same ``And``/``Or``/``Not``/``Term`` algebra as ``hp_query_planner``, but
+evaluated in-process against the posting lists.
+
+The planner orders ``And`` children by estimated document frequency and
+evaluates only the rarest one against the full index; every other child is
+then checked against that (shrinking) candidate set by binary search into its
+posting list. Empty intermediate results short-circuit, and ``NOT`` is a set
+difference against the current candidates. A query therefore costs roughly
+the size of its rarest terms rather than a scan per term.
+
+A blank query matches every record, as the substring search it replaced did
+(every text contains the empty string); it has nothing to rank by, so every
+match scores zero.
+
+Fuzzy (``word~``, ``word~1``), wildcard (``app*``, ``*ple``) and quoted
+substring (``"w york"``) leaves are expanded through the index's trigram
+vocabulary into the terms they match, and then evaluated like an ``Or`` of
+those terms. Quoted substrings that span word boundaries are verified against
+the record text by a caller-supplied callback, on the candidates only.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from search_index import TOKEN_RE, IndexReader, tokenize
+from trigram_index import MAX_DISTANCE, auto_distance
+
+OPERATORS = ("AND", "OR", "NOT")
+QUERY_TOKEN_RE = re.compile(r'"[^"]*"?|\(|\)|[^\s()"]+')
+FUZZY_RE = re.compile(r"^(.*)~(\d?)$")
+WILDCARD_PIECE_RE = re.compile(r"[\w*]+")
+# Closest terms a fuzzy leaf expands to, as in Lucene's maxExpansions
+MAX_FUZZY_EXPANSIONS = 50
+# Expanded terms per leaf that contribute to BM25 ranking
+MAX_SCORING_EXPANSIONS = 64
+
+# Substring verifier: (candidate ids, lower-case text) -> the ids whose record text contains it
+Verifier = Callable[[np.ndarray, str], np.ndarray]
+
+
+class QuerySyntaxError(ValueError):
+    """Raised for malformed boolean queries"""
+
+
+@dataclass(frozen=True)
+class Term:
+    term: str
+
+
+@dataclass(frozen=True)
+class Fuzzy:
+    term: str
+    distance: int
+
+
+@dataclass(frozen=True)
+class Wildcard:
+    pattern: str  # "*" matches any run of characters
+
+
+@dataclass(frozen=True)
+class Substring:
+    text: str  # Lower-case literal, may span words
+
+
+@dataclass(frozen=True)
+class And:
+    children: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    children: Tuple["Node", ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    child: "Node"
+
+
+Node = Union[Term, Fuzzy, Wildcard, Substring, And, Or, Not]
+# Leaves matched through the trigram vocabulary rather than one posting list
+Expansion = (Fuzzy, Wildcard, Substring)
+
+
+def _combine(kind, children: Iterable[Optional[Node]]) -> Optional[Node]:
+    """Build an n-ary And/Or, flattening nested nodes of the same kind"""
+    flat: List[Node] = []
+    for child in children:
+        if child is None:
+            continue
+        flat.extend(child.children if isinstance(child, kind) else [child])
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else kind(tuple(flat))
+
+
+class _Parser:
+    """Recursive-descent parser: or := and (OR and)*, and := unary ([AND] unary)*, unary := NOT unary | atom"""
+
+    def __init__(self, text: str):
+        self.tokens = QUERY_TOKEN_RE.findall(text)
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self) -> Optional[Node]:
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"unexpected '{self.peek()}'")
+        return node
+
+    def parse_or(self) -> Optional[Node]:
+        branches = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            branches.append(self.parse_and())
+        return _combine(Or, branches)
+
+    def parse_and(self) -> Optional[Node]:
+        children = [self.parse_unary()]
+        while self.peek() not in (None, ")", "OR"):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.parse_unary())
+        return _combine(And, children)
+
+    def parse_unary(self) -> Optional[Node]:
+        token = self.peek()
+        if token is None or token in (")", "AND", "OR"):
+            raise QuerySyntaxError("expected a term" + (f" before '{token}'" if token else " at end of query"))
+        self.take()
+        if token == "NOT":
+            child = self.parse_unary()
+            return Not(child) if child is not None else None
+        if token == "(":
+            node = self.parse_or()
+            if self.peek() != ")":
+                raise QuerySyntaxError("missing ')'")
+            self.take()
+            return node
+        if token.startswith('"'):
+            text = token.strip('"').lower()
+            return Substring(text) if TOKEN_RE.search(text) else None
+        return _word(token)
+
+
+def _word(token: str) -> Optional[Node]:
+    """Leaf node(s) for one query word; a word may hold several index tokens ("e-mail"), which must all match"""
+    fuzzy = FUZZY_RE.match(token)
+    if fuzzy:
+        base, distance = fuzzy.groups()
+        return _combine(And, (
+            Fuzzy(t, min(int(distance), MAX_DISTANCE) if distance else auto_distance(t)) for t in tokenize(base)
+        ))
+    if "*" in token:
+        leaves = []
+        for piece in WILDCARD_PIECE_RE.findall(token.lower()):
+            piece = re.sub(r"\*+", "*", piece)
+            if "*" not in piece:
+                leaves.append(Term(piece))
+            elif piece != "*":
+                leaves.append(Wildcard(piece))
+        return _combine(And, leaves)
+    return _combine(And, (Term(t) for t in tokenize(token)))
+
+
+def parse_query(text: str) -> Optional[Node]:
+    """Parse a query into an expression tree; None if it has no searchable terms"""
+    if not text.strip():
+        return None
+    return _Parser(text).parse()
+
+
+def positive_terms(
+    node: Optional[Node], negated: bool = False, planner: Optional["QueryPlanner"] = None
+) -> List[str]:
+    """Terms a match must (or may) contain, i.e. not under a NOT; used for ranking
+
+    Fuzzy, wildcard and substring leaves only count when a planner is given to
+    expand them, and then with their closest expansions only.
+    """
+    if node is None:
+        return []
+    if isinstance(node, Term):
+        return [] if negated else [node.term]
+    if isinstance(node, Expansion):
+        if negated or planner is None:
+            return []
+        return [t for group in planner.expand(node) for t in group[:MAX_SCORING_EXPANSIONS]]
+    if isinstance(node, Not):
+        return positive_terms(node.child, not negated, planner)
+    terms: List[str] = []
+    for child in node.children:
+        terms.extend(t for t in positive_terms(child, negated, planner) if t not in terms)
+    return terms
+
+
+def scoring_query(text: str, index: Optional[IndexReader] = None) -> str:
+    """The words of a boolean query that BM25 should score; expansions need the index"""
+    if index is not None:
+        return QueryPlanner(index).scoring_query(text)
+    return " ".join(positive_terms(parse_query(text)))
+
+
+class QueryPlanner:
+    """Evaluates expression trees against one index, cheapest branches first"""
+
+    def __init__(self, index: IndexReader, verify: Optional[Verifier] = None):
+        self.index = index
+        self.verify = verify
+        # Memoised per planner, so a batch of queries reads each posting list once
+        self._postings: Dict[str, np.ndarray] = {}
+        self._doc_freqs: Dict[str, int] = {}
+        self._expansions: Dict[Node, List[List[str]]] = {}
+        self._parsed: Dict[str, Optional[Node]] = {}
+        self._universe: Optional[np.ndarray] = None
+
+    def parse(self, query: str) -> Optional[Node]:
+        if query not in self._parsed:
+            self._parsed[query] = parse_query(query)
+        return self._parsed[query]
+
+    def scoring_query(self, query: str) -> str:
+        """``scoring_query`` reusing this planner's parse and expansions, e.g. from ``run``"""
+        return " ".join(positive_terms(self.parse(query), planner=self))
+
+    def doc_freq(self, term: str) -> int:
+        if term not in self._doc_freqs:
+            self._doc_freqs[term] = self.index.doc_freq(term)
+        return self._doc_freqs[term]
+
+    def expand(self, node: Node) -> List[List[str]]:
+        """Index terms an expansion leaf stands for, one group per word; a record must match every group"""
+        if node not in self._expansions:
+            vocabulary = self.index.vocabulary()
+            if isinstance(node, Fuzzy):
+                matches = vocabulary.fuzzy(node.term, node.distance)[:MAX_FUZZY_EXPANSIONS]
+                groups = [[term for term, _ in matches]]
+            elif isinstance(node, Wildcard):
+                groups = [sorted(vocabulary.match_pattern(node.pattern), key=lambda t: (len(t), t))]
+            else:
+                # Words cut off by the quote edges may continue past them; inner ones are whole
+                groups = [
+                    sorted(
+                        vocabulary.match(m.group(), prefix=m.start() > 0, suffix=m.end() < len(node.text)),
+                        key=lambda t: (len(t), t),
+                    )
+                    for m in TOKEN_RE.finditer(node.text)
+                ]
+            self._expansions[node] = groups
+        return self._expansions[node]
+
+    def estimate(self, node: Node) -> int:
+        """Upper bound on the number of matching records"""
+        if isinstance(node, Term):
+            return self.doc_freq(node.term)
+        if isinstance(node, Expansion):
+            return min(
+                min(sum(self.doc_freq(t) for t in group), self.index.doc_count) for group in self.expand(node)
+            )
+        if isinstance(node, And):
+            return min(self.estimate(child) for child in node.children)
+        if isinstance(node, Or):
+            return min(sum(self.estimate(child) for child in node.children), self.index.doc_count)
+        return self.index.doc_count - self.estimate(node.child)
+
+    def universe(self) -> np.ndarray:
+        if self._universe is None:
+            self._universe = self.index.all_ids()
+        return self._universe
+
+    def run(self, query: str) -> np.ndarray:
+        """Sorted ids matching a query string; a blank query matches every record"""
+        if not query.strip():
+            return self.universe()
+        return self.execute(self.parse(query))
+
+    def execute(self, node: Optional[Node], within: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sorted ids matching ``node``, restricted to ``within`` when given"""
+        if node is None:
+            return np.empty(0, dtype=np.int64)
+        if within is not None and within.size == 0:
+            return within
+        if isinstance(node, Term):
+            if within is None:
+                if node.term not in self._postings:
+                    self._postings[node.term] = self.index.posting(node.term)
+                return self._postings[node.term]
+            return self.index.filter_term(within, node.term)
+        if isinstance(node, Expansion):
+            return self._execute_expansion(node, within)
+        if isinstance(node, Not):
+            base = self.universe() if within is None else within
+            if isinstance(node.child, Term):
+                return self.index.filter_term(base, node.child.term, keep=False)
+            return np.setdiff1d(base, self.execute(node.child, base), assume_unique=True)
+        if isinstance(node, And):
+            return self._execute_and(node, within)
+        return self._execute_or(node, within)
+
+    def _execute_and(self, node: And, within: Optional[np.ndarray]) -> np.ndarray:
+        positives = sorted((c for c in node.children if not isinstance(c, Not)), key=self.estimate)
+        negatives = [c for c in node.children if isinstance(c, Not)]
+        result = within
+        # The rarest child seeds the candidates; the rest only filter them
+        for child in positives:
+            result = self.execute(child, result)
+            if result.size == 0:
+                return result
+        if result is None:
+            result = self.universe()
+        # Exclude the broadest NOTs first, they remove the most candidates
+        for child in sorted(negatives, key=lambda c: -self.estimate(c.child)):
+            result = self.execute(child, result)
+            if result.size == 0:
+                break
+        return result
+
+    def _execute_expansion(self, node: Node, within: Optional[np.ndarray]) -> np.ndarray:
+        result = within
+        # Rarest word first, as in _execute_and
+        for group in sorted(self.expand(node), key=lambda g: sum(self.doc_freq(t) for t in g)):
+            if not group:
+                return np.empty(0, dtype=np.int64)
+            if result is None:
+                parts = [self.execute(Term(t)) for t in group]
+                result = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+            else:
+                result = self.index.filter_any(result, group)
+            if result.size == 0:
+                return result
+        return self._verify(node, result)
+
+    def _verify(self, node: Node, candidates: np.ndarray) -> np.ndarray:
+        """Check substring candidates against the record text, unless the term match already proves it"""
+        if not isinstance(node, Substring) or TOKEN_RE.fullmatch(node.text) or self.verify is None:
+            return candidates
+        return self.verify(candidates, node.text)
+
+    def _execute_or(self, node: Or, within: Optional[np.ndarray]) -> np.ndarray:
+        parts = []
+        # Broadest branch first: it is the one most likely to cover every candidate
+        for child in sorted(node.children, key=self.estimate, reverse=True):
+            part = self.execute(child, within)
+            if part.size:
+                parts.append(part)
+            if within is not None and part.size == within.size:
+                # One branch already matches every candidate
+                return within
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+
+
+def match(index: IndexReader, query: str, verify: Optional[Verifier] = None) -> np.ndarray:
+    """Ids of records matching a boolean query, ascending"""
+    return QueryPlanner(index, verify).run(query)
+
+
+def match_for_scoring(index: IndexReader, query: str, verify: Optional[Verifier] = None) -> Tuple[np.ndarray, str]:
+    """``match``, plus its ``scoring_query`` from the same parse and term expansions"""
+    planner = QueryPlanner(index, verify)
+    return planner.run(query), planner.scoring_query(query)
+
+
+def match_batch(index: IndexReader, queries: Iterable[str], verify: Optional[Verifier] = None) -> List[np.ndarray]:
+    """``match`` for many queries, sharing posting lists between them"""
+    planner = QueryPlanner(index, verify)
+    return [planner.run(query) for query in queries]
+
+
+def match_batch_for_scoring(
+    index: IndexReader, queries: List[str], verify: Optional[Verifier] = None
+) -> Tuple[List[np.ndarray], List[str]]:
+    """``match_batch``, plus each query's ``scoring_query`` from the same parse and term expansions"""
+    planner = QueryPlanner(index, verify)
+    return [planner.run(query) for query in queries], [planner.scoring_query(query) for query in queries]
@@ -0,0 +1,246 @@
+"""
+Compact, typed storage for the structured fields of dataset records.
+
+A record's fields (CSV columns, JSON keys other than ``content``) are stored
+one value per row in a WITHOUT ROWID table clustered on (field id, record id),
+so each field's values lie together like a column. Field names are stored once
+per dataset, and values keep their type through SQLite storage classes
+instead of being serialized as JSON:
+
+- strings go to ``text`` fields; numbers written as text (as in CSV columns)
+  are stored as INTEGER/REAL whenever they convert back to the identical
+  string, so they compare and range-filter as numbers
+- every other value goes to a ``json`` field: null, 64-bit integers and finite
+  floats natively, anything else (booleans, lists, objects) as a JSON blob
+
+Both kinds read back exactly as parsed. A record without a ``content`` key is
+searched on the text of the record itself; that text is rebuilt from its
+fields when read rather than stored a second time.
+"""
+
+import json
+import math
+import operator
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import Float, and_, cast, func, not_, or_
+from sqlalchemy.types import UserDefinedType
+
+TEXT, JSON = "text", "json"
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+NUMBER_START = frozenset("-0123456789")
+
+# A stored value: what SQLite returns for the value column
+Cell = Union[None, int, float, str, bytes]
+
+
+class CellType(UserDefinedType):
+    """A column of BLOB affinity: SQLite keeps every value in its own storage class"""
+
+    cache_ok = True
+
+    def get_col_spec(self, **kw) -> str:
+        return "BLOB"
+
+
+class FilterError(ValueError):
+    """Raised for malformed field filters"""
+
+
+def field_name(key: Any) -> str:
+    """Column name for a record key; non-string keys are named as JSON would name them"""
+    return key if isinstance(key, str) else json.dumps(key)
+
+
+def field_kind(value: Any) -> str:
+    return TEXT if isinstance(value, str) else JSON
+
+
+def text_cell(value: str) -> Cell:
+    """A string, or the number it spells when that number prints back as the same string"""
+    if value[:1] in NUMBER_START:
+        try:
+            number = int(value)
+            if str(number) == value and INT64_MIN <= number <= INT64_MAX:
+                return number
+        except ValueError:
+            try:
+                number = float(value)
+                if repr(number) == value and math.isfinite(number):
+                    return number
+            except ValueError:
+                pass
+    return value
+
+
+def to_cell(value: Any) -> Cell:
+    if isinstance(value, str):
+        return text_cell(value)
+    if value is None:
+        return None
+    if type(value) is int and INT64_MIN <= value <= INT64_MAX:
+        return value
+    if type(value) is float and math.isfinite(value):
+        return value
+    return json.dumps(value).encode()
+
+
+def from_cell(cell: Cell, kind: str) -> Any:
+    if kind == TEXT:
+        return cell if isinstance(cell, str) else repr(cell)
+    if isinstance(cell, bytes):
+        return json.loads(cell)
+    return cell
+
+
+class FieldSchema:
+    """A dataset's fields, (name, kind) <-> field id; ids grow in first-seen order
+
+    Fields met by ``encode`` for the first time take their ids from
+    ``new_ids`` (shared by every schema written on a shard, under its write
+    lock) and are returned by ``take_new`` to be inserted.
+    """
+
+    def __init__(
+        self, dataset_id: int, fields: Iterable[Tuple[int, str, str]] = (), new_ids: Optional[Iterator[int]] = None
+    ):
+        self.dataset_id = dataset_id
+        self.fields: Dict[int, Tuple[str, str]] = {}
+        self._ids: Dict[Tuple[str, str], int] = {}
+        self._new: List[Tuple[int, str, str]] = []
+        self._new_ids = new_ids
+        for field_id, name, kind in fields:
+            self.fields[field_id] = (name, kind)
+            self._ids[(name, kind)] = field_id
+
+    def __bool__(self) -> bool:
+        return bool(self.fields)
+
+    def ids(self) -> List[int]:
+        return list(self.fields)
+
+    def named(self, name: str) -> List[Tuple[int, str]]:
+        """(field id, kind) of every field called name"""
+        return [(field_id, kind) for field_id, (field, kind) in self.fields.items() if field == name]
+
+    def field_id(self, name: str, kind: str) -> int:
+        field_id = self._ids.get((name, kind))
+        if field_id is None:
+            if self._new_ids is None:
+                raise RuntimeError("FieldSchema opened without new_ids cannot add fields")
+            field_id = self._ids[(name, kind)] = next(self._new_ids)
+            self.fields[field_id] = (name, kind)
+            self._new.append((field_id, name, kind))
+        return field_id
+
+    def take_new(self) -> List[Tuple[int, str, str]]:
+        new, self._new = self._new, []
+        return new
+
+    def encode(self, record_id: int, fields: Dict[Any, Any]) -> Tuple[List[Tuple[int, int, Cell]], bool]:
+        """(field id, record id, cell) rows for a record, and whether they decode in key order"""
+        cells = []
+        previous = 0
+        ordered = True
+        for key, value in fields.items():
+            field_id = self.field_id(field_name(key), field_kind(value))
+            ordered = ordered and field_id > previous
+            previous = field_id
+            cells.append((field_id, record_id, to_cell(value)))
+        return cells, ordered
+
+    def decode(self, cells: Iterable[Tuple[int, int, Cell]]) -> Dict[int, Dict[str, Any]]:
+        """Fields by record id from (field id, record id, cell) rows in field id order"""
+        records: Dict[int, Dict[str, Any]] = {}
+        current = None
+        for field_id, record_id, cell in cells:
+            if field_id != current:
+                current = field_id
+                name, kind = self.fields[field_id]
+                text = kind == TEXT
+            fields = records.get(record_id)
+            if fields is None:
+                fields = records[record_id] = {}
+            # from_cell, inlined for the common case of strings in text fields
+            fields[name] = cell if text and type(cell) is str else from_cell(cell, kind)
+        return records
+
+
+def derived_content(fields: Dict[str, Any]) -> str:
+    """The searchable text of a record without a content key: the record itself"""
+    return str(fields)
+
+
+# Field filters: {"name": value} or {"name": {"op": operand, ...}}
+COMPARISONS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+FILTER_OPS = ("eq", "in") + tuple(COMPARISONS)
+
+
+class FieldFilter(NamedTuple):
+    name: str
+    op: str
+    operand: Any
+
+
+def parse_filters(filters: Optional[Dict[str, Any]]) -> List[FieldFilter]:
+    """Validate filters; a plain value means equality, an object maps operators to operands"""
+    parsed = []
+    for name, spec in (filters or {}).items():
+        conditions = spec.items() if isinstance(spec, dict) else [("eq", spec)]
+        for op, operand in conditions:
+            if op not in FILTER_OPS:
+                raise FilterError(f"Unknown operator '{op}' for field '{name}' (expected one of {', '.join(FILTER_OPS)})")
+            if op == "in" and not isinstance(operand, list):
+                raise FilterError(f"'in' for field '{name}' needs a list")
+            if op in COMPARISONS and (isinstance(operand, bool) or not isinstance(operand, (int, float, str))):
+                raise FilterError(f"'{op}' for field '{name}' needs a number or a string")
+            parsed.append(FieldFilter(name, op, operand))
+    return parsed
+
+
+# SQLite storage class of a cell, as reported by typeof()
+STORAGE = {int: "integer", float: "real", str: "text"}
+
+
+def _numeric(column, compare, number, kind: str):
+    """Numeric comparison with numeric cells and, in text fields, text spelling a number ("3.50")"""
+    clause = and_(func.typeof(column).in_(("integer", "real")), compare(column, number))
+    if kind != TEXT:
+        return clause
+    numeric_text = and_(
+        func.typeof(column) == "text",
+        column.op("GLOB")("*[0-9]*"),
+        not_(column.op("GLOB")("*[^0-9.eE+-]*")),
+    )
+    return or_(clause, and_(numeric_text, compare(cast(column, Float), number)))
+
+
+def _condition(column, kind: str, op: str, operand: Any):
+    """SQL for one comparison on a value column of the given kind, or None if no value can match"""
+    compare = operator.eq if op == "eq" else COMPARISONS[op]
+    if isinstance(operand, str):
+        if kind != TEXT:
+            return None
+        cell = text_cell(operand)
+        if op == "eq":
+            # Exactly the string: "10" is stored as 10, but must not match "10.0" stored as 10.0
+            return and_(func.typeof(column) == STORAGE[type(cell)], column == cell)
+        if isinstance(cell, str):
+            return and_(func.typeof(column) == "text", compare(column, cell))
+        return _numeric(column, compare, cell, kind)
+    cell = to_cell(operand)
+    if isinstance(cell, (int, float)) and not isinstance(operand, bool):
+        return _numeric(column, compare, cell, kind)
+    # null, booleans, lists, objects and out-of-range numbers equal JSON values only
+    if kind != JSON or op != "eq":
+        return None
+    return column.is_(None) if cell is None else column == cell
+
+
+def filter_clause(column, kind: str, condition: FieldFilter):
+    """SQL condition on a value column of the given kind, or None if no value can match"""
+    if condition.op == "in":
+        clauses = [_condition(column, kind, "eq", operand) for operand in condition.operand]
+        clauses = [clause for clause in clauses if clause is not None]
+        return or_(*clauses) if clauses else None
+    return _condition(column, kind, condition.op, condition.operand)
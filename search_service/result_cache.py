@@ -0,0 +1,123 @@
+"""
+In-process cache for search results.
+
+Entries are keyed on (normalized query, dataset_id, top_k, field filters, ranking mode), bounded with LRU
+eviction and an optional TTL, and invalidated per dataset whenever that
+dataset is written to.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from query_engine import OPERATORS
+
+CacheKey = Tuple[str, Optional[int], int, Optional[str], str]
+QUERY_PART_RE = re.compile(r'"[^"]*"?|[^\s"]+')
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, keeping boolean operators and quoted text distinct"""
+    return " ".join(
+        word if word in OPERATORS else word.lower() for word in QUERY_PART_RE.findall(query)
+    )
+
+
+class QueryResultCache:
+    """Thread-safe LRU cache of search results with optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        self._keys_by_dataset: Dict[Optional[int], Set[CacheKey]] = {}
+        # Bumped on every invalidation so results computed before a write are never stored
+        self._generations: Dict[Optional[int], int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(
+        query: str, dataset_id: Optional[int], top_k: int, filters: Optional[Dict[str, Any]] = None, mode: str = "lexical"
+    ) -> CacheKey:
+        filter_key = json.dumps(filters, sort_keys=True) if filters else None
+        return (normalize_query(query), dataset_id or None, top_k, filter_key, mode)
+
+    def generation(self, dataset_id: Optional[int]) -> int:
+        """Current write generation of a dataset, to pass back to ``put``"""
+        with self._lock:
+            return self._generations.get(dataset_id or None, 0)
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: CacheKey, value: Any, generation: Optional[int] = None) -> None:
+        """Store a result; skipped if the dataset was written since ``generation``"""
+        if self.max_entries <= 0:
+            return
+        dataset_id = key[1]
+        with self._lock:
+            if generation is not None and generation != self._generations.get(dataset_id, 0):
+                return
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.monotonic(), value)
+            self._keys_by_dataset.setdefault(dataset_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_dataset(self, dataset_id: Optional[int]) -> int:
+        """Drop every cached result for a dataset; returns the number removed"""
+        dataset_id = dataset_id or None
+        with self._lock:
+            self._generations[dataset_id] = self._generations.get(dataset_id, 0) + 1
+            keys = self._keys_by_dataset.pop(dataset_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def _remove(self, key: CacheKey) -> None:
+        self._entries.pop(key, None)
+        keys = self._keys_by_dataset.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_dataset[key[1]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,105 @@
+"""
+CPU scoring backend used when the GPU scorer is unavailable.
+
+Scores are handled as contiguous float32 arrays (the same layout the wgpu
+``GpuScorer`` takes) and top-k selection uses ``np.argpartition``, so picking
+k results out of n candidates costs O(n + k log k) instead of a full sort.
+"""
+
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+# Pad ragged batches into one matrix only while padding stays under this overhead
+MAX_BATCH_PADDING = 2.0
+
+
+def as_scores(scores) -> np.ndarray:
+    """View scores as a contiguous float32 array, copying only if needed"""
+    return np.ascontiguousarray(scores, dtype=np.float32)
+
+
+def ranking_keys(scores: np.ndarray) -> np.ndarray:
+    """Scores as they are ranked: NaN counts as -inf, below every number"""
+    missing = np.isnan(scores)
+    return np.where(missing, np.float32(-np.inf), scores) if missing.any() else scores
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first; ties go to the lower index, NaN ranks last"""
+    scores = ranking_keys(as_scores(scores))
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        # argpartition picks arbitrary members of a tie at the k-th place, so
+        # take everything above the k-th score plus the lowest-index ties
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - above.size]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(scores.size)
+    # Order the k survivors by score, then index, for deterministic ties
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class CpuScorer:
+    """Drop-in CPU replacement for ``hp_data_structures.gpu_score.GpuScorer``"""
+
+    @staticmethod
+    async def new() -> "CpuScorer":
+        return CpuScorer()
+
+    def compute_softmax_and_top_k(self, input_data, k: int) -> List[int]:
+        # Softmax is monotonic, so ranking raw scores gives the same top-k
+        return top_k_indices(input_data, k).tolist()
+
+    def top_k(self, scores, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the k best candidates"""
+        scores = as_scores(scores)
+        indices = top_k_indices(scores, k)
+        return indices, scores[indices]
+
+    def top_k_batch(
+        self, score_sets: Sequence[np.ndarray], k: Union[int, Sequence[int]]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Rank many queries' candidate sets in one call"""
+        score_sets = [as_scores(scores) for scores in score_sets]
+        ks = [k] * len(score_sets) if isinstance(k, int) else list(k)
+        if not score_sets:
+            return []
+        lengths = np.array([scores.size for scores in score_sets])
+        width = int(lengths.max())
+        k_max = min(max(ks), width)
+        if k_max <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in score_sets]
+        if width * len(score_sets) > MAX_BATCH_PADDING * max(int(lengths.sum()), 1):
+            # Too ragged to pad efficiently: rank each set on its own
+            return [self.top_k(scores, k_i) for scores, k_i in zip(score_sets, ks)]
+
+        # Pad into one (queries x candidates) matrix and select along rows at once
+        matrix = np.full((len(score_sets), width), -np.inf, dtype=np.float32)
+        for row, scores in enumerate(score_sets):
+            matrix[row, :scores.size] = ranking_keys(scores)
+        if k_max < width:
+            # Same tie rule as top_k_indices, row-wise: above the k-th score, then lowest-index ties
+            kth = -np.partition(-matrix, k_max - 1, axis=1)[:, k_max - 1:k_max]
+            above = matrix > kth
+            ties = matrix == kth
+            need = k_max - above.sum(axis=1, keepdims=True)
+            selected = above | (ties & (np.cumsum(ties, axis=1) <= need))
+            part = np.nonzero(selected)[1].reshape(len(score_sets), k_max)
+        else:
+            part = np.broadcast_to(np.arange(width), (len(score_sets), width))
+        values = np.take_along_axis(matrix, part, axis=1)
+        # Stable sort over index-ordered survivors breaks ties toward the lower index
+        order = np.argsort(-values, axis=1, kind="stable")
+        part = np.take_along_axis(part, order, axis=1)
+
+        results = []
+        for row, (length, k_i) in enumerate(zip(lengths, ks)):
+            keep = min(k_i, int(length))
+            indices = part[row, :keep].astype(np.int64)
+            results.append((indices, score_sets[row][indices]))
+        return results
@@ -0,0 +1,537 @@
+"""
+In-memory inverted index and BM25 ranking used by the search service.
+
+Each searchable table (the built-in ``Document`` table and every user dataset)
+gets its own ``InvertedIndex`` mapping normalized tokens to posting lists of
+record ids, so a lookup touches only the postings of the query terms instead
+of scanning the whole corpus. Term frequencies and document lengths are kept
+alongside the postings so candidates can be ranked with vectorized BM25.
+
+Datasets that change after upload are served by a ``SegmentedIndex``: appends
+add a small immutable segment, deletes add tombstones, and segments are merged
+log-structured style so an update costs the size of the change.
+"""
+
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from trigram_index import TrigramIndex
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens"""
+    return TOKEN_RE.findall(text.lower())
+
+
+class IndexReader:
+    """Candidate lookup and BM25 scoring shared by every index implementation"""
+
+    _lock: threading.RLock
+    total_len: int
+    _vocabulary: Optional[TrigramIndex] = None
+
+    def _before_read(self) -> None:
+        """Hook run under the lock before arrays are read"""
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(record ids, term frequencies) for a term; only valid while holding the lock"""
+        raise NotImplementedError
+
+    def _doc_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(record ids, document lengths); only valid while holding the lock"""
+        raise NotImplementedError
+
+    def terms(self) -> List[str]:
+        raise NotImplementedError
+
+    @property
+    def doc_count(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def avg_doc_len(self) -> float:
+        return self.total_len / self.doc_count if self.doc_count else 0.0
+
+    def contains(self, doc_id: int) -> bool:
+        """Whether a record id is indexed"""
+        with self._lock:
+            self._before_read()
+            doc_ids = self._doc_arrays()[0]
+            i = int(np.searchsorted(doc_ids, doc_id))
+            return i < doc_ids.size and int(doc_ids[i]) == doc_id
+
+    def posting(self, term: str) -> np.ndarray:
+        """Return a copy of the posting list for a term as an int64 array"""
+        with self._lock:
+            self._before_read()
+            arrays = self._term_arrays(term)
+            if arrays is None:
+                return np.empty(0, dtype=np.int64)
+            return np.array(arrays[0], dtype=np.int64)
+
+    def export(self) -> Tuple[List[str], List[np.ndarray], List[np.ndarray], np.ndarray, np.ndarray]:
+        """Copy out terms, posting lists, term frequencies and document arrays"""
+        with self._lock:
+            self._before_read()
+            terms, postings, term_freqs = [], [], []
+            for term in self.terms():
+                arrays = self._term_arrays(term)
+                if arrays is None:
+                    # Every record holding the term has been deleted
+                    continue
+                ids, tfs = arrays
+                terms.append(term)
+                postings.append(np.array(ids, dtype=np.int64))
+                term_freqs.append(np.array(tfs, dtype=np.uint32))
+            doc_ids, doc_lens = self._doc_arrays()
+            return terms, postings, term_freqs, np.array(doc_ids, dtype=np.int64), np.array(doc_lens, dtype=np.uint32)
+
+    def vocabulary(self) -> TrigramIndex:
+        """Trigram index over the indexed terms, for substring and fuzzy lookups; built on first use"""
+        with self._lock:
+            if self._vocabulary is None:
+                self._vocabulary = TrigramIndex(self.terms())
+            return self._vocabulary
+
+    def doc_freq(self, term: str) -> int:
+        """Number of records containing a term"""
+        with self._lock:
+            self._before_read()
+            arrays = self._term_arrays(term)
+            return arrays[0].size if arrays is not None else 0
+
+    def all_ids(self) -> np.ndarray:
+        """Copy of every indexed record id, ascending"""
+        with self._lock:
+            self._before_read()
+            return np.array(self._doc_arrays()[0], dtype=np.int64)
+
+    def filter_term(self, candidates: np.ndarray, term: str, keep: bool = True) -> np.ndarray:
+        """Candidates that contain (or, with keep=False, lack) a term, without copying its postings"""
+        candidates = np.asarray(candidates, dtype=np.int64)
+        with self._lock:
+            self._before_read()
+            arrays = self._term_arrays(term)
+            if arrays is None or candidates.size == 0:
+                return candidates[:0] if keep else candidates
+            posting = arrays[0]
+            idx = np.minimum(np.searchsorted(posting, candidates), posting.size - 1)
+            present = posting[idx] == candidates
+            del posting, arrays
+        return candidates[present if keep else ~present]
+
+    def filter_any(self, candidates: np.ndarray, terms: Iterable[str]) -> np.ndarray:
+        """Candidates that contain at least one of the terms"""
+        candidates = np.asarray(candidates, dtype=np.int64)
+        found = np.zeros(candidates.size, dtype=bool)
+        with self._lock:
+            self._before_read()
+            for term in terms:
+                arrays = self._term_arrays(term)
+                if arrays is None or candidates.size == 0:
+                    continue
+                posting = arrays[0]
+                idx = np.minimum(np.searchsorted(posting, candidates), posting.size - 1)
+                found |= posting[idx] == candidates
+                del posting, arrays
+        return candidates[found]
+
+    def idf(self, term: str) -> float:
+        """BM25 inverse document frequency (always non-negative)"""
+        return self._idf(self.doc_freq(term))
+
+    def _idf(self, df: int) -> float:
+        n = self.doc_count
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str, candidate_ids: np.ndarray) -> np.ndarray:
+        """BM25 scores for the given sorted candidate ids, as float32"""
+        return self.score_batch([query], [candidate_ids])[0]
+
+    def score_batch(self, queries: List[str], candidate_sets: List[np.ndarray]) -> List[np.ndarray]:
+        """BM25 scores for several queries at once, one vectorized pass per distinct term"""
+        candidate_sets = [np.asarray(c, dtype=np.int64) for c in candidate_sets]
+        sizes = [c.size for c in candidate_sets]
+        # All candidate sets share one flat array; owner[i] is the query candidate i belongs to
+        candidates = np.concatenate(candidate_sets) if candidate_sets else np.empty(0, dtype=np.int64)
+        scores = np.zeros(candidates.size, dtype=np.float32)
+        splits = np.cumsum(sizes)[:-1]
+        if candidates.size == 0:
+            return np.split(scores, splits)
+        owner = np.repeat(np.arange(len(candidate_sets)), sizes)
+        query_terms = [set(tokenize(query)) for query in queries]
+        with self._lock:
+            self._before_read()
+            # Zero-copy views are only valid while the lock keeps the arrays from growing
+            doc_ids, doc_lens = self._doc_arrays()
+            positions = np.minimum(np.searchsorted(doc_ids, candidates), doc_ids.size - 1)
+            lengths = doc_lens[positions].astype(np.float32)
+            del doc_ids, doc_lens
+            # Length normalisation is shared by every query term
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / (self.avg_doc_len or 1.0))
+            for term in set().union(*query_terms):
+                arrays = self._term_arrays(term)
+                if arrays is None:
+                    continue
+                # Only candidates of queries containing the term get its contribution
+                mask = np.array([term in terms for terms in query_terms])[owner]
+                selected = slice(None) if mask.all() else mask
+                rows = candidates[selected]
+                posting, tfs = arrays
+                idx = np.minimum(np.searchsorted(posting, rows), posting.size - 1)
+                tf = np.where(posting[idx] == rows, tfs[idx], 0).astype(np.float32)
+                # The posting in hand gives the document frequency; no second lookup
+                idf = np.float32(self._idf(posting.size))
+                del posting, tfs, arrays
+                scores[selected] += idf * (tf * (BM25_K1 + 1.0) / (tf + norm[selected]))
+        return np.split(scores, splits)
+
+
+class InvertedIndex(IndexReader):
+    """Token -> sorted posting list of record ids, with BM25 term statistics"""
+
+    def __init__(self):
+        self.postings: Dict[str, array] = {}
+        self.term_freqs: Dict[str, array] = {}
+        self.doc_ids = array("q")
+        self.doc_lens = array("I")
+        self.total_len = 0
+        # Postings stay sorted as long as ids arrive in increasing order,
+        # which is what SQLite's rowid allocation gives us on ingest.
+        self._last_id = -1
+        self._unsorted = False
+        # Guards posting arrays: an array cannot grow while numpy is reading it
+        self._lock = threading.RLock()
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_ids)
+
+    def add(self, doc_id: int, text: str) -> None:
+        """Index a single record and update term statistics"""
+        tokens = tokenize(text)
+        with self._lock:
+            if doc_id <= self._last_id:
+                self._unsorted = True
+            self._last_id = max(self._last_id, doc_id)
+            for term, tf in Counter(tokens).items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = array("q")
+                    self.term_freqs[term] = array("I")
+                posting.append(doc_id)
+                self.term_freqs[term].append(tf)
+            self.doc_ids.append(doc_id)
+            self.doc_lens.append(len(tokens))
+            self.total_len += len(tokens)
+            self._vocabulary = None
+
+    def add_many(self, docs: Iterable[Tuple[int, str]]) -> None:
+        """Index a batch of (id, text) pairs"""
+        with self._lock:
+            for doc_id, text in docs:
+                self.add(doc_id, text)
+
+    def _before_read(self) -> None:
+        if self._unsorted:
+            for term, posting in self.postings.items():
+                self.postings[term], self.term_freqs[term] = _sort_parallel(posting, self.term_freqs[term])
+            self.doc_ids, self.doc_lens = _sort_parallel(self.doc_ids, self.doc_lens)
+            self._unsorted = False
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        posting = self.postings.get(term)
+        if posting is None:
+            return None
+        return np.frombuffer(posting, dtype=np.int64), np.frombuffer(self.term_freqs[term], dtype=np.uint32)
+
+    def _doc_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.frombuffer(self.doc_ids, dtype=np.int64), np.frombuffer(self.doc_lens, dtype=np.uint32)
+
+    def terms(self) -> List[str]:
+        with self._lock:
+            return list(self.postings)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        doc_ids: np.ndarray,
+        doc_lens: np.ndarray,
+    ) -> "InvertedIndex":
+        """Build an index straight from sorted posting arrays, without re-tokenizing"""
+        index = cls()
+        for term, (ids, tfs) in postings.items():
+            index.postings[term] = array("q", np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+            index.term_freqs[term] = array("I", np.ascontiguousarray(tfs, dtype=np.uint32).tobytes())
+        index.doc_ids = array("q", np.ascontiguousarray(doc_ids, dtype=np.int64).tobytes())
+        index.doc_lens = array("I", np.ascontiguousarray(doc_lens, dtype=np.uint32).tobytes())
+        index.total_len = int(np.sum(doc_lens, dtype=np.int64))
+        index._last_id = int(doc_ids[-1]) if len(doc_ids) else -1
+        return index
+
+
+def _sort_parallel(keys: array, values: array) -> Tuple[array, array]:
+    """Sort two parallel arrays by the first one"""
+    key_arr = np.array(keys, dtype=np.int64)
+    order = np.argsort(key_arr, kind="stable")
+    sorted_values = np.array(values, dtype=np.uint32)[order]
+    return array("q", key_arr[order].tobytes()), array("I", sorted_values.tobytes())
+
+
+def _present(ids: np.ndarray, sorted_ids: np.ndarray) -> np.ndarray:
+    """Boolean mask of which ids occur in a sorted id array"""
+    if sorted_ids.size == 0:
+        return np.zeros(ids.size, dtype=bool)
+    idx = np.minimum(np.searchsorted(sorted_ids, ids), sorted_ids.size - 1)
+    return sorted_ids[idx] == ids
+
+
+# A segment is merged into its predecessor once it reaches this fraction of its size
+SEGMENT_MERGE_RATIO = 0.5
+# Hard cap on segments, so reads never concatenate more than this many parts
+MAX_SEGMENTS = 16
+# A segment is rewritten without its deleted records past this tombstone share
+TOMBSTONE_PURGE_RATIO = 0.2
+EMPTY_IDS = np.empty(0, dtype=np.int64)
+
+
+class SegmentedIndex(IndexReader):
+    """Index over immutable segments with per-segment tombstones, for datasets that change
+
+    Segments are ordered by record id (ids are allocated in increasing order and
+    never reused, see ShardSet.record_ids), so
+    concatenating their live postings keeps every posting list sorted. Term
+    statistics (document frequency, document count, total length) always
+    exclude deleted records.
+    """
+
+    def __init__(self, base: Optional[IndexReader] = None):
+        self._lock = threading.RLock()
+        self._segments: List[IndexReader] = []
+        self._tombstones: List[np.ndarray] = []
+        # Live document frequencies per segment, filled on lookup; parallel to _segments
+        self._doc_freqs: List[Dict[str, int]] = []
+        self._doc_cache: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._live = 0
+        self.total_len = 0
+        if base is not None:
+            self.add_segment(base)
+
+    @property
+    def doc_count(self) -> int:
+        return self._live
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    @staticmethod
+    def _seal(segment: IndexReader) -> None:
+        # Segments are never written again, so their arrays may be read without their lock
+        with segment._lock:
+            segment._before_read()
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        parts = []
+        for segment, dead in zip(self._segments, self._tombstones):
+            arrays = segment._term_arrays(term)
+            if arrays is None:
+                continue
+            ids, tfs = arrays
+            if dead.size:
+                keep = ~_present(ids, dead)
+                ids, tfs = ids[keep], tfs[keep]
+            if ids.size:
+                parts.append((ids, tfs))
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def doc_freq(self, term: str) -> int:
+        """Number of live records containing a term, summed over segments without concatenating postings"""
+        with self._lock:
+            total = 0
+            for segment, dead, cache in zip(self._segments, self._tombstones, self._doc_freqs):
+                df = cache.get(term)
+                if df is None:
+                    arrays = segment._term_arrays(term)
+                    df = 0 if arrays is None else int(arrays[0].size)
+                    if df and dead.size:
+                        df -= int(np.count_nonzero(_present(dead, arrays[0])))
+                    cache[term] = df
+                total += df
+            return total
+
+    def _doc_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._doc_cache is None:
+            ids_parts, len_parts = [], []
+            for segment, dead in zip(self._segments, self._tombstones):
+                ids, lens = segment._doc_arrays()
+                if dead.size:
+                    keep = ~_present(ids, dead)
+                    ids, lens = ids[keep], lens[keep]
+                ids_parts.append(ids)
+                len_parts.append(lens)
+            if not ids_parts:
+                self._doc_cache = (EMPTY_IDS, np.empty(0, dtype=np.uint32))
+            elif len(ids_parts) == 1:
+                self._doc_cache = (ids_parts[0], len_parts[0])
+            else:
+                self._doc_cache = (np.concatenate(ids_parts), np.concatenate(len_parts))
+        return self._doc_cache
+
+    def terms(self) -> List[str]:
+        with self._lock:
+            seen: Dict[str, None] = {}
+            for segment in self._segments:
+                seen.update(dict.fromkeys(segment.terms()))
+            return list(seen)
+
+    def add_segment(self, segment: IndexReader) -> bool:
+        """Append a segment of records newer than every indexed one
+
+        Returns False (and changes nothing) if its records are already indexed,
+        e.g. because a cold rebuild read them from the database first.
+        """
+        self._seal(segment)
+        ids, lens = segment._doc_arrays()
+        if ids.size == 0:
+            return True
+        with self._lock:
+            if self.contains(int(ids[0])):
+                return False
+            self._segments.append(segment)
+            self._tombstones.append(EMPTY_IDS)
+            self._doc_freqs.append({})
+            if self._vocabulary is not None:
+                self._vocabulary.add(segment.terms())
+            self._live += int(ids.size)
+            self.total_len += int(np.sum(lens, dtype=np.int64))
+            self._doc_cache = None
+            self._compact()
+            return True
+
+    def delete(self, doc_ids: Iterable[int]) -> int:
+        """Tombstone records; returns how many were indexed"""
+        targets = np.unique(np.fromiter(doc_ids, dtype=np.int64))
+        removed = 0
+        with self._lock:
+            for i, segment in enumerate(self._segments):
+                ids, lens = segment._doc_arrays()
+                # Binary search the targets into the segment: cost follows the delete, not the segment
+                found = targets[_present(targets, ids)]
+                dead = self._tombstones[i]
+                if dead.size:
+                    found = found[~_present(found, dead)]
+                if found.size == 0:
+                    continue
+                self._tombstones[i] = np.union1d(dead, found)
+                self._doc_freqs[i] = {}
+                removed += int(found.size)
+                self.total_len -= int(np.sum(lens[np.searchsorted(ids, found)], dtype=np.int64))
+            if removed:
+                self._live -= removed
+                self._doc_cache = None
+                self._compact()
+        return removed
+
+    def _merge(self, start: int, end: int) -> None:
+        """Replace segments[start:end] by one segment holding only their live records"""
+        group = list(zip(self._segments[start:end], self._tombstones[start:end]))
+        terms: Dict[str, None] = {}
+        for segment, _ in group:
+            terms.update(dict.fromkeys(segment.terms()))
+        postings = {}
+        for term in terms:
+            parts = []
+            for segment, dead in group:
+                arrays = segment._term_arrays(term)
+                if arrays is None:
+                    continue
+                ids, tfs = arrays
+                if dead.size:
+                    keep = ~_present(ids, dead)
+                    ids, tfs = ids[keep], tfs[keep]
+                if ids.size:
+                    parts.append((ids, tfs))
+            if parts:
+                postings[term] = (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]))
+        doc_ids, doc_lens = [], []
+        for segment, dead in group:
+            ids, lens = segment._doc_arrays()
+            keep = ~_present(ids, dead)
+            doc_ids.append(ids[keep])
+            doc_lens.append(lens[keep])
+        merged = InvertedIndex.from_arrays(postings, np.concatenate(doc_ids), np.concatenate(doc_lens))
+        self._seal(merged)
+        self._segments[start:end] = [merged]
+        self._tombstones[start:end] = [EMPTY_IDS]
+        self._doc_freqs[start:end] = [{}]
+
+    def _compact(self) -> None:
+        """Purge heavily deleted segments and merge small ones into their predecessor"""
+        for i, segment in enumerate(self._segments):
+            dead = self._tombstones[i].size
+            if dead and dead > TOMBSTONE_PURGE_RATIO * segment.doc_count:
+                self._merge(i, i + 1)
+        if len(self._segments) > 1:
+            kept = [i for i in range(len(self._segments)) if self._segments[i].doc_count]
+            self._segments = [self._segments[i] for i in kept] or self._segments[:1]
+            self._tombstones = [self._tombstones[i] for i in kept] or self._tombstones[:1]
+            self._doc_freqs = [self._doc_freqs[i] for i in kept] or self._doc_freqs[:1]
+        # Log-structured merging: each record is rewritten O(log n) times
+        while len(self._segments) > 1:
+            last, previous = self._live_count(-1), self._live_count(-2)
+            if last < SEGMENT_MERGE_RATIO * previous and len(self._segments) <= MAX_SEGMENTS:
+                break
+            self._merge(len(self._segments) - 2, len(self._segments))
+        self._doc_cache = None
+
+    def _live_count(self, i: int) -> int:
+        return self._segments[i].doc_count - self._tombstones[i].size
+
+
+class IndexRegistry:
+    """Holds one index per dataset (``None`` is the built-in Document table)"""
+
+    def __init__(self):
+        self._indexes: Dict[Optional[int], IndexReader] = {}
+        self._lock = threading.Lock()
+
+    def get(self, dataset_id: Optional[int]) -> Optional[IndexReader]:
+        return self._indexes.get(dataset_id)
+
+    def replace(self, dataset_id: Optional[int], index: IndexReader) -> None:
+        with self._lock:
+            self._indexes[dataset_id] = index
+
+    def remove(self, dataset_id: Optional[int]) -> None:
+        with self._lock:
+            self._indexes.pop(dataset_id, None)
+
+    def segmented(self, dataset_id: Optional[int]) -> Optional[SegmentedIndex]:
+        """The dataset's index as a SegmentedIndex, wrapping it on first write; None if not loaded"""
+        with self._lock:
+            index = self._indexes.get(dataset_id)
+            if index is not None and not isinstance(index, SegmentedIndex):
+                index = self._indexes[dataset_id] = SegmentedIndex(index)
+            return index
+
+    def items(self) -> List[Tuple[Optional[int], IndexReader]]:
+        with self._lock:
+            return list(self._indexes.items())
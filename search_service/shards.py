@@ -0,0 +1,68 @@
+"""
+Dataset-sharded record storage.
+
+Dataset records can be spread over several SQLite files so that writes to
+different datasets take different writer locks. Dataset ``d`` lives wholly on
+shard ``d % n``. With one shard the records stay in the main database next to
+the catalog (``Document`` and ``UserDataset``); with more, every shard is a
+file of its own and the main database holds only the catalog. Record ids are
+allocated with stride ``n`` (every id on shard ``k`` is ``k`` modulo ``n``), so
+ids stay unique across files and ``id % n`` names the shard holding a record
+without a lookup.
+
+The shard count is part of the on-disk layout and must not change once
+records have been written.
+"""
+
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy.engine import Engine
+
+
+class Shard:
+    """One SQLite file holding the records of the datasets assigned to it"""
+
+    def __init__(self, number: int, engine: Engine):
+        self.number = number
+        self.engine = engine
+        # Serialises record writes, which also makes id allocation race-free
+        self.write_lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return f"Shard({self.number})"
+
+
+class ShardSet:
+    """Routes datasets and records to their shard"""
+
+    def __init__(self, engines: List[Engine]):
+        self.shards = [Shard(number, engine) for number, engine in enumerate(engines)]
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def __iter__(self) -> Iterator[Shard]:
+        return iter(self.shards)
+
+    def for_dataset(self, dataset_id: int) -> Shard:
+        return self.shards[dataset_id % len(self.shards)]
+
+    def for_record(self, record_id: int) -> Shard:
+        return self.shards[record_id % len(self.shards)]
+
+    def group_records(self, record_ids: Iterable[int]) -> Dict[Shard, List[int]]:
+        """Split record ids by the shard holding them, keeping their order"""
+        groups: Dict[Shard, List[int]] = {}
+        for record_id in record_ids:
+            groups.setdefault(self.for_record(record_id), []).append(record_id)
+        return groups
+
+    def record_ids(self, shard: Shard, max_id: Optional[int], count: int) -> range:
+        """The next count ids for a shard that has allocated ids up to max_id
+
+        max_id must cover deleted records too, so their ids are never reused.
+        """
+        after = (max_id or 0) + 1
+        first = after + (shard.number - after) % len(self.shards)
+        return range(first, first + count * len(self.shards), len(self.shards))
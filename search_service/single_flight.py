@@ -0,0 +1,59 @@
+"""
+Request coalescing ("single flight") for identical concurrent work.
+
+The first caller for a key starts the computation as a task; callers arriving
+with the same key while it runs await that task instead of starting their
+own, and all of them receive its result (or its exception). Nothing is kept
+once the task finishes, so a flight never serves a result computed before
+it was joined: callers whose result may depend on a write (the search path
+keys on the dataset's cache generation) use keys that change with it.
+
+Flights live on one event loop and need no locking. A caller that is
+cancelled (e.g. its client disconnected) stops waiting without cancelling
+the shared task, so the other callers still get their result.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        # Calls that started a computation, and calls that joined one already running
+        self.executions = 0
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of fn(), shared with every concurrent call for the same key"""
+        if not self.enabled:
+            self.executions += 1
+            return await fn()
+        task = self._flights.get(key)
+        if task is None:
+            self.executions += 1
+            task = self._flights[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Mark the exception retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.executions + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / calls if calls else 0.0,
+        }
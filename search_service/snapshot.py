@@ -0,0 +1,200 @@
+"""
+Versioned binary snapshots of the search indexes.
+
+A snapshot holds, per dataset, the term dictionary, posting lists, term
+frequencies and document arrays of its index. On startup the file is
+memory-mapped and each section is served directly by a ``MappedIndex``, so
+readiness no longer depends on corpus size.
+
+Layout (little-endian, every block 8-byte aligned)::
+
+    MAGIC | blocks ... | JSON header | footer(header_offset u64, header_len u64, MAGIC)
+
+The header records the format version, and for every section its dataset id,
+the DB fingerprint it was built from and the offset/length of each block.
+Terms are stored ordered by a stable 64-bit hash so a lookup is one binary
+search over the mapped hash array.
+
+A new snapshot replaces the old file with ``os.replace`` while indexes may
+still be served from the old mapping. POSIX keeps the old pages alive for
+those readers; Windows refuses to replace a mapped file, so there the
+snapshot is read into memory instead of mapped.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from search_index import IndexReader
+
+MAGIC = b"ZSIDXv1\0"
+FORMAT_VERSION = 1
+FOOTER = struct.Struct("<QQ8s")
+
+# Windows cannot replace a file that is still mapped (see load_snapshot)
+MAP_SNAPSHOTS = os.name != "nt"
+
+# (block name, dtype) in on-disk order
+BLOCKS = [
+    ("term_hashes", np.uint64),
+    ("term_offsets", np.uint64),
+    ("term_bytes", np.uint8),
+    ("posting_offsets", np.uint64),
+    ("postings", np.int64),
+    ("term_freqs", np.uint32),
+    ("doc_ids", np.int64),
+    ("doc_lens", np.uint32),
+]
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, corrupt or of another version"""
+
+
+def term_hash(term: str) -> int:
+    """Stable 64-bit hash of a term (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MappedIndex(IndexReader):
+    """Read-only index served straight from a memory-mapped snapshot section"""
+
+    def __init__(self, buffer, section: Dict[str, Any]):
+        self._buffer = buffer
+        self._lock = threading.RLock()
+        self.total_len = section["total_len"]
+        views = {}
+        for name, dtype in BLOCKS:
+            offset, count = section["blocks"][name]
+            views[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        self._hashes = views["term_hashes"]
+        self._term_offsets = views["term_offsets"]
+        self._term_bytes = views["term_bytes"]
+        self._posting_offsets = views["posting_offsets"]
+        self._postings = views["postings"]
+        self._term_freqs = views["term_freqs"]
+        self._doc_ids = views["doc_ids"]
+        self._doc_lens = views["doc_lens"]
+
+    @property
+    def doc_count(self) -> int:
+        return self._doc_ids.size
+
+    def _term_slot(self, term: str) -> Optional[int]:
+        encoded = term.encode("utf-8")
+        h = np.uint64(term_hash(term))
+        i = int(np.searchsorted(self._hashes, h))
+        # Walk the (almost always single) run of equal hashes and compare bytes
+        while i < self._hashes.size and self._hashes[i] == h:
+            start, end = int(self._term_offsets[i]), int(self._term_offsets[i + 1])
+            if self._term_bytes[start:end].tobytes() == encoded:
+                return i
+            i += 1
+        return None
+
+    def _term_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        slot = self._term_slot(term)
+        if slot is None:
+            return None
+        start, end = int(self._posting_offsets[slot]), int(self._posting_offsets[slot + 1])
+        return self._postings[start:end], self._term_freqs[start:end]
+
+    def _doc_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._doc_ids, self._doc_lens
+
+    def terms(self) -> List[str]:
+        data = self._term_bytes.tobytes()
+        offsets = self._term_offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(self._hashes.size)]
+
+
+def _write_block(f, array: np.ndarray) -> Tuple[int, int]:
+    """Append an 8-byte aligned block, returning (offset, element count)"""
+    pad = -f.tell() % 8
+    if pad:
+        f.write(b"\0" * pad)
+    offset = f.tell()
+    f.write(np.ascontiguousarray(array).tobytes())
+    return offset, int(array.size)
+
+
+def _write_section(f, index: IndexReader) -> Dict[str, Any]:
+    terms, postings, term_freqs, doc_ids, doc_lens = index.export()
+    hashes = np.array([term_hash(term) for term in terms], dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+    encoded = [terms[i].encode("utf-8") for i in order]
+    term_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    term_offsets[1:] = np.cumsum([len(b) for b in encoded])
+    posting_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    posting_offsets[1:] = np.cumsum([postings[i].size for i in order])
+
+    blocks = {
+        "term_hashes": _write_block(f, hashes[order]),
+        "term_offsets": _write_block(f, term_offsets),
+        "term_bytes": _write_block(f, np.frombuffer(b"".join(encoded), dtype=np.uint8)),
+        "posting_offsets": _write_block(f, posting_offsets),
+    }
+    # Posting blocks are streamed term by term to avoid one more full copy
+    for name, arrays, dtype in (("postings", postings, np.int64), ("term_freqs", term_freqs, np.uint32)):
+        pad = -f.tell() % 8
+        if pad:
+            f.write(b"\0" * pad)
+        offset = f.tell()
+        for i in order:
+            f.write(np.ascontiguousarray(arrays[i], dtype=dtype).tobytes())
+        blocks[name] = (offset, int(posting_offsets[-1]))
+    blocks["doc_ids"] = _write_block(f, doc_ids.astype(np.int64))
+    blocks["doc_lens"] = _write_block(f, doc_lens.astype(np.uint32))
+    return {"total_len": int(index.total_len), "blocks": blocks}
+
+
+def save_snapshot(path: str, entries: List[Tuple[Optional[int], IndexReader, Any]]) -> None:
+    """Atomically write (dataset_id, index, fingerprint) entries to a snapshot file"""
+    tmp_path = f"{path}.tmp"
+    sections = []
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        for dataset_id, index, fingerprint in entries:
+            section = _write_section(f, index)
+            section.update({"dataset_id": dataset_id, "fingerprint": fingerprint})
+            sections.append(section)
+        header = json.dumps({"version": FORMAT_VERSION, "sections": sections}).encode("utf-8")
+        header_offset = f.tell()
+        f.write(header)
+        f.write(FOOTER.pack(header_offset, len(header), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers that still map the old file keep their pages; new readers see the new one.
+    # On Windows nothing maps it (see MAP_SNAPSHOTS), so the replace cannot fail.
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> Dict[Optional[int], Tuple[MappedIndex, Any]]:
+    """Memory-map a snapshot and return {dataset_id: (index, fingerprint)}"""
+    try:
+        with open(path, "rb") as f:
+            if MAP_SNAPSHOTS:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # A mapping would make the next save_snapshot's os.replace fail
+                buffer = f.read()
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"cannot map {path}: {e}") from e
+    if len(buffer) < len(MAGIC) + FOOTER.size or buffer[:len(MAGIC)] != MAGIC:
+        raise SnapshotError(f"{path} is not an index snapshot")
+    header_offset, header_len, magic = FOOTER.unpack_from(buffer, len(buffer) - FOOTER.size)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is truncated")
+    header = json.loads(buffer[header_offset:header_offset + header_len])
+    if header.get("version") != FORMAT_VERSION:
+        raise SnapshotError(f"{path} has unsupported version {header.get('version')}")
+    return {
+        section["dataset_id"]: (MappedIndex(buffer, section), section["fingerprint"])
+        for section in header["sections"]
+    }
@@ -133,6 +133,65 @@ def test_list_datasets():
         print(f"❌ Failed to list datasets: {response.text}")
         return False
 
+def test_list_records(dataset_id):
+    """Test paging and exporting the records of a dataset"""
+    print(f"\nTesting record listing for dataset {dataset_id}...")
+    
+    response = requests.get(f"{BASE_URL}/datasets/{dataset_id}/records", params={'limit': 2})
+    if response.status_code != 200:
+        print(f"❌ Failed to list records: {response.text}")
+        return False
+    first_page = response.json()
+    print(f"✅ First page has {len(first_page)} records, next cursor: {response.headers.get('X-Next-Cursor')}")
+    
+    response = requests.get(f"{BASE_URL}/datasets/{dataset_id}/records", params={'format': 'ndjson'})
+    if response.status_code != 200:
+        print(f"❌ Failed to export records: {response.text}")
+        return False
+    exported = [json.loads(line) for line in response.text.splitlines() if line]
+    print(f"✅ Exported {len(exported)} records as NDJSON")
+    return [r['id'] for r in exported[:len(first_page)]] == [r['id'] for r in first_page]
+
+def test_append_and_delete(dataset_id):
+    """Test appending to a dataset and deleting records from it"""
+    print(f"\nTesting append/delete for dataset {dataset_id}...")
+    
+    response = requests.post(
+        f"{BASE_URL}/datasets/{dataset_id}/append",
+        data={'text_data': "name,city\nZelda Quinn,Reykjavik"}
+    )
+    if response.status_code != 200:
+        print(f"❌ Append failed: {response.text}")
+        return False
+    print(f"✅ Appended {response.json()['records_added']} records, total {response.json()['total_records']}")
+    
+    results = requests.post(f"{BASE_URL}/search", json={'query': 'reykjavik', 'dataset_id': dataset_id}).json()['results']
+    if not results:
+        print("❌ Appended record not found by search")
+        return False
+    
+    response = requests.delete(f"{BASE_URL}/datasets/{dataset_id}/records/{results[0]}")
+    if response.status_code != 200:
+        print(f"❌ Delete failed: {response.text}")
+        return False
+    print(f"✅ Deleted record {results[0]}, total {response.json()['total_records']}")
+    
+    results = requests.post(f"{BASE_URL}/search", json={'query': 'reykjavik', 'dataset_id': dataset_id}).json()['results']
+    return not results
+
+def test_field_filters(dataset_id):
+    """Test filtering search results on typed CSV fields"""
+    print(f"\nTesting field filters in dataset {dataset_id}...")
+    
+    search_data = {'query': 'city', 'top_k': 10, 'dataset_id': dataset_id, 'filters': {'age': {'gt': 28}}}
+    response = requests.post(f"{BASE_URL}/search", json=search_data)
+    if response.status_code != 200:
+        print(f"❌ Filtered search failed: {response.text}")
+        return False
+    results = response.json()['results']
+    print(f"✅ {len(results)} records with age > 28")
+    return len(results) == 2
+
 def main():
     """Run all tests"""
     print("🚀 Starting upload functionality tests...\n")
@@ -153,6 +212,12 @@ def main():
     if unstructured_dataset_id:
         test_search_in_dataset(unstructured_dataset_id)
     
+    # Test paging and exporting records
+    if csv_dataset_id:
+        test_list_records(csv_dataset_id)
+        test_field_filters(csv_dataset_id)
+        test_append_and_delete(csv_dataset_id)
+    
     print("\n🎉 All tests completed!")
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+"""
+Shared fixtures for the search service tests.
+
+``service`` starts the FastAPI app once per session in a temporary directory,
+with two record shards so that stride id allocation and scatter-gather
+search are exercised by every API test. The result cache is disabled so
+every request computes its result. main.py reads its configuration when it
+is imported, so the environment is set and the directory changed first.
+"""
+
+import os
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+ADMIN_TOKEN = "test-admin-token"
+
+SERVICE_ENV = {
+    "SHARD_COUNT": "2",
+    "RESULT_CACHE_SIZE": "0",
+    "PARSE_WORKERS": "1",
+    "ADMIN_TOKEN": ADMIN_TOKEN,
+}
+
+
+@pytest.fixture(scope="session")
+def service(tmp_path_factory):
+    """The running app: ``client`` (a TestClient) and ``main`` (the module)"""
+    workdir = tmp_path_factory.mktemp("service")
+    previous_dir = os.getcwd()
+    previous_env = {name: os.environ.get(name) for name in SERVICE_ENV}
+    os.chdir(workdir)
+    os.environ.update(SERVICE_ENV)
+    try:
+        import main
+
+        with TestClient(main.app) as client:
+            yield SimpleNamespace(client=client, main=main, workdir=workdir)
+    finally:
+        os.chdir(previous_dir)
+        for name, value in previous_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@pytest.fixture
+def upload(service):
+    """Upload text as a new dataset and return its id"""
+
+    def upload_text(text: str, name: str = "test") -> int:
+        response = service.client.post("/upload", data={"dataset_name": name, "text_data": text})
+        assert response.status_code == 200, response.text
+        return response.json()["dataset_id"]
+
+    return upload_text
@@ -0,0 +1,78 @@
+from sqlalchemy import event
+
+
+def test_upload_and_search_a_dataset(service, upload):
+    dataset_id = upload("name,city\nada,paris\nbob,london\ncyd,paris\n")
+    response = service.client.post("/search", json={"query": "paris", "dataset_id": dataset_id})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total_found"] == 2
+    records = service.client.get(f"/datasets/{dataset_id}/records").json()
+    paris = sorted(record["id"] for record in records if record["metadata"]["city"] == "paris")
+    assert sorted(body["results"]) == paris
+
+
+def test_search_builtin_documents(service):
+    body = service.client.post("/search", json={"query": "apple cinnamon"}).json()
+    assert body["results"] == [7, 1]
+    assert service.client.get("/documents/7").json()["content"] == "apple cinnamon muffins"
+
+
+def test_blank_query_matches_every_record(service, upload):
+    dataset_id = upload("name\nada\nbob\ncyd\n")
+    for query in ("", "   "):
+        response = service.client.post("/search", json={"query": query, "dataset_id": dataset_id})
+        assert response.status_code == 200, response.text
+        assert response.json()["total_found"] == 3
+    batch = service.client.post("/search/batch", json={"queries": [{"query": "", "dataset_id": dataset_id}]})
+    assert batch.json()["results"][0]["total_found"] == 3
+
+
+def test_documents_batch_of_one_dataset_checks_membership_in_the_row_lookup(service, upload):
+    client, main = service.client, service.main
+    fruit = upload("name,colour\napple,red\nbanana,yellow\n", "fruit")
+    other = upload("name,colour\ncherry,red\n", "other")
+    fruit_ids = [record["id"] for record in client.get(f"/datasets/{fruit}/records").json()]
+    other_ids = [record["id"] for record in client.get(f"/datasets/{other}/records").json()]
+    main.search_indexes.remove(fruit)
+
+    ids = [other_ids[0], fruit_ids[1], 1, fruit_ids[0], 10 ** 9]
+    body = client.post("/documents/batch", json={"ids": ids, "dataset_id": fruit, "fields": ["colour"]}).json()
+    assert body["documents"] == [
+        {"id": fruit_ids[1], "metadata": {"colour": "yellow"}},
+        {"id": fruit_ids[0], "metadata": {"colour": "red"}},
+    ]
+    assert body["missing"] == [other_ids[0], 1, 10 ** 9]
+    plain = client.post("/documents/batch", json={"ids": ids, "dataset_id": fruit}).json()
+    assert [doc["id"] for doc in plain["documents"]] == [fruit_ids[1], fruit_ids[0]]
+    assert plain["documents"][0]["tags"] == ["user_dataset"]
+    # The lookup did not need the dataset's search index
+    assert main.search_indexes.get(fruit) is None
+
+
+def test_searches_read_no_rows_until_hydration(service, upload):
+    client, main = service.client, service.main
+    dataset_id = upload("name\napple pie\napple tart\ncherry pie\n", "hydrated race")
+    search = {"query": "apple", "dataset_id": dataset_id}
+    ids = client.post("/search", json=search).json()["results"]  # loads the index
+    statements = []
+    engine = main.dataset_engine(dataset_id)
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        assert client.post("/search", json=search).json()["results"] == ids
+        assert client.post("/search/batch", json={"queries": [search]}).json()["results"][0]["results"] == ids
+        assert statements == []
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    # A record deleted behind the index's back is dropped from hydrated results only
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM datasetrecord WHERE id = ?", (ids[0],))
+    main.doc_store.discard_records([ids[0]])
+    assert client.post("/search", json=search).json()["results"] == ids
+    hydrated = client.post("/search", json={**search, "include_documents": True}).json()
+    assert hydrated["results"] == [doc["id"] for doc in hydrated["documents"]] == ids[1:]
+    assert len(hydrated["scores"]) == hydrated["total_found"] == 1
+    batch = client.post("/search/batch", json={"queries": [{**search, "include_documents": True}]}).json()
+    assert batch["results"][0]["results"] == ids[1:]
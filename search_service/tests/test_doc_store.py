@@ -0,0 +1,117 @@
+from doc_store import DocumentStore
+
+
+class Loader:
+    """Record loader over a dict, remembering which ids it was asked for"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def __call__(self, ids):
+        self.calls.append(list(ids))
+        return [
+            {"id": doc_id, "content": self.records[doc_id][0], "tags": list(self.records[doc_id][1])}
+            for doc_id in ids if doc_id in self.records
+        ]
+
+
+def test_insert_and_get_builtin_documents():
+    store = DocumentStore()
+    store.insert(1, {"content": "apple pie", "tags": ["apple", "pie"]})
+    store.insert(2, {"content": "cherry pie", "tags": ["cherry", "pie"]})
+    store.insert(1, {"content": "apple tart", "tags": ["apple", "tart"]})
+    assert store.get(1) == {"id": 1, "content": "apple tart", "tags": ["apple", "tart"]}
+    assert store.get(3) is None
+    assert store.stats()["documents"] == 2
+
+
+def test_misses_are_loaded_once_in_one_call_and_returned_in_order():
+    loader = Loader({1: ("a", ["x"]), 2: ("b", ["x"]), 3: ("c", ["y"])})
+    store = DocumentStore()
+    assert [d["id"] for d in store.get_documents([3, 1, 9], loader)] == [3, 1]
+    assert loader.calls == [[3, 1, 9]]
+    assert [d["content"] for d in store.get_documents([1, 2, 3], loader)] == ["a", "b", "c"]
+    assert loader.calls == [[3, 1, 9], [2]]
+    stats = store.stats()
+    assert (stats["hits"], stats["misses"], stats["tag_sets"]) == (2, 4, 2)
+
+
+def test_record_tier_is_an_lru_capped_at_max_records():
+    loader = Loader({i: (f"record {i}", ["user_dataset"]) for i in range(1, 10)})
+    store = DocumentStore(max_records=3)
+    store.get_records([1, 2, 3], loader)
+    store.get_record(1, loader)  # 2 is now the least recently used
+    store.get_records([4], loader)
+    assert store.stats()["records"] == 3 and store.stats()["evictions"] == 1
+    loader.calls.clear()
+    store.get_records([1, 3, 4], loader)
+    assert loader.calls == []
+    store.get_records([2], loader)
+    assert loader.calls == [[2]]
+
+
+def test_a_cap_of_zero_never_caches_records():
+    loader = Loader({1: ("a", [])})
+    store = DocumentStore(max_records=0)
+    assert store.get_record(1, loader)["content"] == "a"
+    assert store.get_record(1, loader)["content"] == "a"
+    assert len(loader.calls) == 2 and store.stats()["records"] == 0
+
+
+def test_discarded_slots_are_reused_without_leaking_old_content():
+    records = {1: ("one", ["a"]), 2: ("two", ["b"]), 3: ("three", ["c"])}
+    loader = Loader(records)
+    store = DocumentStore()
+    store.get_records([1, 2, 3], loader)
+    slots = store._records
+    freed = {slots.slot_of[1], slots.slot_of[2]}
+    store.discard_records([1, 2, 42])
+    assert store.stats()["records"] == 1
+    assert {slots.contents[slot] for slot in freed} == {None}
+
+    # Deleted records are reloaded (and found gone); new ids take the freed slots
+    del records[1], records[2]
+    records[4], records[5] = ("four", ["d"]), ("five", ["e"])
+    assert store.get_records([1, 2, 4, 5, 3], loader) == [
+        {"id": 4, "content": "four", "tags": ["d"]},
+        {"id": 5, "content": "five", "tags": ["e"]},
+        {"id": 3, "content": "three", "tags": ["c"]},
+    ]
+    assert {slots.slot_of[4], slots.slot_of[5]} == freed
+    assert len(slots.contents) == 3
+
+
+def test_records_loaded_across_a_discard_are_not_cached():
+    store = DocumentStore()
+
+    def loader(ids):
+        # The record is deleted while it is being read
+        store.discard_records(ids)
+        return [{"id": doc_id, "content": "deleted meanwhile", "tags": []} for doc_id in ids]
+
+    assert store.get_record(1, loader)["content"] == "deleted meanwhile"
+    assert store.stats()["records"] == 0
+
+
+def test_hydration_after_a_delete_and_an_append(service, upload):
+    client, main = service.client, service.main
+    dataset_id = upload("name\napple pie\napple tart\ncherry pie\n", "hydrated")
+    body = client.post("/search", json={"query": "apple", "dataset_id": dataset_id, "include_documents": True}).json()
+    first, second = body["results"]
+    # Hydrating the results cached the records
+    assert main.doc_store.get_record(first, lambda ids: []) is not None
+
+    client.post(f"/datasets/{dataset_id}/records/delete", json={"ids": [first]})
+    assert main.doc_store.get_record(first, lambda ids: []) is None
+    appended = client.post(f"/datasets/{dataset_id}/append", data={"text_data": "name\napple crumble\n"}).json()
+    assert appended["records_added"] == 1
+
+    body = client.post("/search", json={"query": "apple", "dataset_id": dataset_id, "include_documents": True}).json()
+    assert first not in body["results"] and len(body["results"]) == 2
+    contents = {doc["id"]: doc["content"] for doc in body["documents"]}
+    new_id = (set(body["results"]) - {second}).pop()
+    assert new_id > max(first, second)
+    assert "apple crumble" in contents[new_id] and "apple crumble" not in contents[second]
+    batch = client.post("/documents/batch", json={"ids": [first, new_id], "dataset_id": dataset_id}).json()
+    assert batch["missing"] == [first] and batch["documents"][0]["content"] == contents[new_id]
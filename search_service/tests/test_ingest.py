@@ -0,0 +1,67 @@
+import io
+import json
+
+import pytest
+
+from ingest import SNIFF_CHARS, iter_json_records, sniff, sniff_and_parse
+
+
+def parse(text: str):
+    format_info, records = sniff_and_parse(io.StringIO(text, newline=""))
+    return format_info, list(records)
+
+
+def bracketed_log(min_chars: int) -> str:
+    lines = []
+    size = 0
+    i = 0
+    while size < min_chars:
+        line = f"[2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}] INFO served request {i} in {i % 97} ms\n"
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return "".join(lines)
+
+
+def test_small_json_and_jsonl_are_detected():
+    assert sniff('[{"a": 1}, {"a": 2}]')[0]["type"] == "json"
+    assert sniff('{"a": 1}\n{"a": 2}\n')[0]["type"] == "jsonl"
+    assert sniff("a,b\n1,2\n3,4\n")[0]["type"] == "csv"
+
+
+def test_bracket_prefixed_log_over_the_sample_is_not_json():
+    text = bracketed_log(2 * SNIFF_CHARS)
+    format_info, records = parse(text)
+    assert format_info["type"] in ("csv", "unstructured")
+    assert records
+    assert "served request 0 " in json.dumps(records)
+
+
+def test_bracket_prefixed_log_upload_succeeds(service):
+    response = service.client.post(
+        "/upload", data={"dataset_name": "log", "text_data": bracketed_log(2 * SNIFF_CHARS)}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["format_detected"]["type"] != "json"
+
+
+def test_truncated_json_array_is_json():
+    records = [{"id": i, "text": "word " * 20} for i in range(2000)]
+    text = json.dumps(records)
+    assert len(text) > SNIFF_CHARS
+    format_info, parsed = parse(text)
+    assert format_info["type"] == "json"
+    assert parsed == records
+
+
+def test_jsonl_with_a_first_line_longer_than_the_sample_keeps_every_record():
+    records = [{"id": 0, "text": "x" * (2 * SNIFF_CHARS)}] + [{"id": i, "text": "short"} for i in range(1, 5)]
+    text = "".join(json.dumps(record) + "\n" for record in records)
+    format_info, parsed = parse(text)
+    assert format_info["type"] == "jsonl"
+    assert parsed == records
+
+
+def test_single_json_value_with_trailing_data_is_rejected():
+    with pytest.raises(ValueError):
+        list(iter_json_records(['{"a": 1}\n{"a": 2}\n']))
@@ -0,0 +1,118 @@
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import ingest
+from ingest import SNIFF_CHARS, _csv_cut, iter_row_batches, iter_safe_chunks, read_sample, record_to_row, sniff, sniff_and_parse
+
+CHUNK_CHARS = 8 * 1024
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ProcessPoolExecutor(2) as executor:
+        yield executor
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Many chunks, cut past the sniffed sample, without megabytes of test data
+    monkeypatch.setattr(ingest, "PARALLEL_CHUNK_CHARS", CHUNK_CHARS)
+
+
+def serial_rows(text):
+    format_info, records = sniff_and_parse(io.StringIO(text, newline=""))
+    return format_info["type"], [record_to_row(record) for record in records]
+
+
+def parallel_rows(text, executor, batch_size=97):
+    stream = io.StringIO(text, newline="")
+    sample = read_sample(stream)
+    format_info, prefix = sniff(sample)
+    batches = iter_row_batches(stream, sample, format_info, batch_size, prefix, executor, workers=2)
+    return format_info["type"], [row for rows, _ in batches for row in rows]
+
+
+def assert_parallel_matches_serial(text, executor, fmt):
+    assert len(text) > 2 * SNIFF_CHARS
+    serial = serial_rows(text)
+    assert serial[0] == fmt
+    assert parallel_rows(text, executor) == serial
+    return serial[1]
+
+
+def test_csv_cut_follows_csv_quoting():
+    assert _csv_cut('a,b\n1,2\n3') == 8
+    assert _csv_cut('a,"b\n1",2\n3') == 10
+    assert _csv_cut('a\nb,"c\n1') == 2
+    # A quote inside an unquoted field is an ordinary character
+    assert _csv_cut('tv,5" screen\nradio,7" speaker\nx') == 30
+    # "" is an escape inside a quoted field, and a quote after the closing one is literal
+    assert _csv_cut('a,"say ""hi""\n"\nb,"x"y"\nz') == 24
+    assert _csv_cut('a;"b\nc";d\ne', delimiter=";") == 10
+    assert _csv_cut('a,"b\nc\n') == -1
+    assert _csv_cut('a,"b\nc\n', delimiter=";") == 7
+    # A closing quote at the very end may start an escape, so the field may continue
+    assert _csv_cut('a\n"b\n"') == 2
+    assert _csv_cut('no newline') == -1
+
+
+def test_csv_with_inch_marks_in_unquoted_fields(executor):
+    rows = "".join(
+        f'{i},TV {i % 40 + 20}" screen,"{"great picture " * 30}\n{"sharp colours " * 30}"\n' for i in range(200)
+    )
+    parsed = assert_parallel_matches_serial("id,name,review\n" + rows, executor, "csv")
+    assert len(parsed) == 200
+
+
+def test_csv_with_quoted_newlines(executor):
+    rows = "".join(
+        f'{i},"line one\nline two, with ""quotes""\r\n{"and more text " * (i % 50)}",{i * 2}\r\n' for i in range(600)
+    )
+    parsed = assert_parallel_matches_serial("id,notes,double\r\n" + rows, executor, "csv")
+    assert len(parsed) == 600
+    assert parsed[5][1]["notes"].startswith('line one\nline two, with "quotes"')
+
+
+def test_csv_with_an_unterminated_quote_falls_back_to_serial(executor):
+    head = "".join(f"{i},plain row {i}\n" for i in range(2000))
+    tail = "".join(f"{i},more text {i}\n" for i in range(6000))
+    text = "id,text\n" + head + '2000,"never closed\n' + tail
+    rows = assert_parallel_matches_serial(text, executor, "csv")
+    assert len(rows) == 2001
+
+
+def test_unterminated_csv_quote_stops_chunking():
+    text = "a\n" + '"' + "x\n" * (3 * CHUNK_CHARS)
+    leftover = []
+    stream = io.StringIO(text, newline="")
+    chunks = list(iter_safe_chunks(stream, "", "csv", CHUNK_CHARS, leftover=leftover))
+    assert chunks == ["a\n"]
+    assert chunks[0] + leftover[0] + stream.read() == text
+
+
+def test_jsonl(executor):
+    records = [{"id": i, "text": f"record {i}\nwith an escaped newline", "pad": "x" * (i % 300)} for i in range(1500)]
+    text = "".join(json.dumps(record) + "\n" for record in records)
+    assert assert_parallel_matches_serial(text, executor, "jsonl") == [record_to_row(r) for r in records]
+
+
+def test_crlf_paragraphs_keep_their_numbering(executor):
+    paragraphs = []
+    for i in range(3000):
+        # Short paragraphs are numbered but produce no record
+        paragraphs.append("short" if i % 7 == 0 else f"Paragraph {i} has enough words to be a record.")
+    rows = assert_parallel_matches_serial("\r\n\r\n".join(paragraphs) + "\r\n", executor, "unstructured")
+    assert rows[0][1]["chunk_id"] == 1
+    assert rows[-1][1]["chunk_id"] == 2999
+
+
+def test_sentence_fallback_spans_chunks(executor):
+    # Every paragraph is too short to be a record, so sentences are cut from the whole text
+    words = [f"word{i}" + ("." if i % 4 == 3 else "") for i in range(30000)]
+    rows = assert_parallel_matches_serial("\n\n".join(words), executor, "unstructured")
+    assert rows[0][1] == {"chunk_id": 0, "type": "sentence"}
+    assert rows[0][0] == "word0 word1 word2 word3"
+    assert len(rows) == 7500
@@ -0,0 +1,175 @@
+import os
+
+import pytest
+
+from snapshot import load_snapshot
+
+FIRST_ID = 900001
+
+
+@pytest.fixture
+def loader(service):
+    """The load_datasets module, imported once main is configured; removes the documents it loaded afterwards"""
+    import load_datasets
+
+    yield load_datasets
+    main = service.main
+    with main.catalog_lock, main.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM document WHERE id >= ?", (FIRST_ID,))
+    load_datasets.refresh_search_index(changed=True)
+
+
+def write_csv(path, rows):
+    lines = ["id,summary,title"] + [f"{doc_id},{summary},{title}" for doc_id, summary, title in rows]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def load(loader, path, update=False, batch_size=2, restart=True, id_col="id"):
+    spec = loader.DatasetSpec(path.name, "summary", "title", id_col, FIRST_ID)
+    checkpoint = loader.Checkpoint(str(path) + ".checkpoint.json", restart=restart)
+    return loader.load_csv(spec, str(path), checkpoint, batch_size, update)
+
+
+def stored(service):
+    """{id: (content, tags)} of the documents a test loaded"""
+    with service.main.engine.connect() as conn:
+        rows = conn.exec_driver_sql("SELECT id, content, tags FROM document WHERE id >= ?", (FIRST_ID,))
+        return {doc_id: (content, tags) for doc_id, content, tags in rows}
+
+
+def search(service, query, mode="lexical"):
+    response = service.client.post("/search", json={"query": query, "mode": mode})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_update_rebuilds_the_index_and_embeddings_of_rewritten_documents(service, loader, tmp_path, monkeypatch):
+    main = service.main
+    path = tmp_path / "docs.csv"
+    write_csv(path, [(FIRST_ID, "quokka lemonade", "quokka"), (FIRST_ID + 1, "wombat stew", "wombat")])
+    assert load(loader, path).written == 2
+    loader.refresh_search_index(changed=True)
+    assert search(service, "quokka")["results"] == [FIRST_ID]
+    assert search(service, "quokka lemonade", "vector")["results"][0] == FIRST_ID
+    fingerprint = main.dataset_fingerprint(None)
+
+    write_csv(path, [(FIRST_ID, "marmot pudding", "marmot"), (FIRST_ID + 1, "wombat stew", "wombat")])
+    assert load(loader, path, update=True).written == 2
+    # Same count and highest id: only the explicit drop keeps the old text out
+    assert main.dataset_fingerprint(None) == fingerprint
+    monkeypatch.setattr(main, "EMBED_ON_INGEST", True)
+    loader.refresh_search_index(changed=True)
+    assert main.vector_store.get(None) is not None
+
+    assert search(service, "quokka")["results"] == []
+    assert search(service, "marmot")["results"] == [FIRST_ID]
+    # Documents are embedded with their tags
+    vector = search(service, "marmot pudding marmot", "vector")
+    assert vector["results"][0] == FIRST_ID and vector["scores"][0] == pytest.approx(1, abs=1e-5)
+    assert FIRST_ID not in search(service, "quokka lemonade", "vector")["results"][:1]
+    # The saved snapshot holds the new index
+    sections = load_snapshot(main.SNAPSHOT_PATH)
+    assert sections[None][0].contains(FIRST_ID)
+
+
+def test_skip_index_drops_the_stale_snapshot_section_and_embeddings(service, loader, tmp_path):
+    main = service.main
+    path = tmp_path / "docs.csv"
+    write_csv(path, [(FIRST_ID, "quokka lemonade", "quokka")])
+    load(loader, path)
+    loader.refresh_search_index(changed=True)
+    search(service, "quokka", "vector")
+    assert os.path.exists(main.vector_store.path(None) + ".json")
+
+    write_csv(path, [(FIRST_ID, "marmot pudding", "marmot")])
+    load(loader, path, update=True)
+    loader.refresh_search_index(changed=True, rebuild=False)
+    assert None not in load_snapshot(main.SNAPSHOT_PATH)
+    assert not os.path.exists(main.vector_store.path(None) + ".json")
+    assert main.search_indexes.get(None) is None and main.vector_store.get(None) is None
+    # Both are rebuilt from the current documents on next use
+    assert search(service, "marmot")["results"] == [FIRST_ID]
+    assert search(service, "marmot pudding", "vector")["results"][0] == FIRST_ID
+
+
+def test_nothing_written_keeps_the_snapshot(service, loader, tmp_path):
+    main = service.main
+    main.save_index_snapshot()
+    before = os.stat(main.SNAPSHOT_PATH).st_mtime_ns
+    loader.refresh_search_index(changed=False, rebuild=False)
+    assert os.stat(main.SNAPSHOT_PATH).st_mtime_ns == before
+
+
+# Rows without ids are numbered by position; a quoted summary spans two lines and
+# multi-byte text makes byte offsets differ from character offsets
+UNNUMBERED = 'summary,title\ncrème brûlée,dessert\n"two\nlines",prose\nplum jam,jam\nfig roll,biscuit\nõun,x\n'
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_an_interrupted_load_resumes_without_duplicates(service, loader, tmp_path, monkeypatch):
+    path = tmp_path / "unnumbered.csv"
+    path.write_text(UNNUMBERED, encoding="utf-8")
+    saves = []
+    original = loader.Checkpoint.save
+
+    def save_then_stop(self, csv_path, **progress):
+        # The second batch is committed, but the process dies before its checkpoint is written
+        if len(saves) == 1:
+            raise Interrupted
+        saves.append(progress)
+        original(self, csv_path, **progress)
+
+    monkeypatch.setattr(loader.Checkpoint, "save", save_then_stop)
+    with pytest.raises(Interrupted):
+        load(loader, path, id_col="")
+    assert sorted(stored(service)) == [FIRST_ID + i for i in range(4)]
+    monkeypatch.undo()
+
+    resumed = load(loader, path, restart=False, id_col="")
+    # The batch committed after the last checkpoint is read again and finds its rows present
+    assert (resumed.rows, resumed.written) == (3, 1)
+    assert stored(service) == {
+        FIRST_ID: ("crème brûlée", "dessert"),
+        FIRST_ID + 1: ("two\nlines", "prose"),
+        FIRST_ID + 2: ("plum jam", "jam"),
+        FIRST_ID + 3: ("fig roll", "biscuit"),
+        FIRST_ID + 4: ("õun", "x"),
+    }
+    # A finished file is skipped, a changed one is loaded again from the start
+    assert load(loader, path, restart=False, id_col="").rows == 0
+    path.write_text(UNNUMBERED + "oat cake,biscuit\n", encoding="utf-8")
+    again = load(loader, path, restart=False, id_col="")
+    assert (again.rows, again.written) == (6, 1)
+    assert stored(service)[FIRST_ID + 5] == ("oat cake", "biscuit")
+
+
+def test_batches_are_committed_and_checkpointed_at_the_batch_size(service, loader, tmp_path, monkeypatch):
+    path = tmp_path / "docs.csv"
+    write_csv(path, [(FIRST_ID + i, f"word{i}", "t") for i in range(7)])
+    saves = []
+    original = loader.Checkpoint.save
+
+    def save(self, csv_path, **progress):
+        saves.append(progress)
+        original(self, csv_path, **progress)
+
+    monkeypatch.setattr(loader.Checkpoint, "save", save)
+    assert load(loader, path, batch_size=3).written == 7
+    assert [(save["rows"], save["done"]) for save in saves] == [(3, False), (6, False), (7, False), (7, True)]
+    offsets = [save["offset"] for save in saves]
+    assert offsets == sorted(offsets) and offsets[-1] == path.stat().st_size
+    assert len(stored(service)) == 7
+
+
+def test_existing_ids_are_kept_unless_updating(service, loader, tmp_path):
+    path = tmp_path / "docs.csv"
+    write_csv(path, [(FIRST_ID, "quokka lemonade", "quokka")])
+    load(loader, path)
+    write_csv(path, [(FIRST_ID, "marmot pudding", "marmot"), (FIRST_ID + 1, "wombat stew", "wombat")])
+    assert load(loader, path).written == 1
+    assert stored(service)[FIRST_ID] == ("quokka lemonade", "quokka")
+    assert load(loader, path, update=True).written == 2
+    assert stored(service) == {FIRST_ID: ("marmot pudding", "marmot"), FIRST_ID + 1: ("wombat stew", "wombat")}
@@ -0,0 +1,140 @@
+import math
+import re
+
+import pytest
+
+from metrics import CONTENT_TYPE, MetricsRegistry
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_exposition(text):
+    """{name: {"type", "help", "samples": [(sample name, labels, value)]}}, checking the format on the way"""
+    assert text.endswith("\n")
+    metrics = {}
+    current = None
+    for line in text.rstrip("\n").split("\n"):
+        if line.startswith("# HELP "):
+            name, help_text = line[len("# HELP "):].split(" ", 1)
+            assert name not in metrics, f"{name} rendered twice"
+            current = metrics[name] = {"help": help_text, "samples": []}
+        elif line.startswith("# TYPE "):
+            name, type_name = line[len("# TYPE "):].split(" ")
+            assert current is metrics.get(name) and type_name in ("counter", "gauge", "histogram")
+            current["type"] = type_name
+        else:
+            match = SAMPLE_RE.match(line)
+            assert match, f"not a sample line: {line!r}"
+            sample, labels, value = match.group(1), dict(LABEL_RE.findall(match.group(2) or "")), match.group(3)
+            assert sample.startswith(name)
+            current["samples"].append((sample, labels, float(value.replace("Inf", "inf"))))
+    return metrics
+
+
+def test_counters_histograms_and_collectors_render_in_the_text_format():
+    registry = MetricsRegistry()
+    requests = registry.counter("app_requests_total", "Requests", ["route"])
+    latency = registry.histogram("app_latency_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    registry.collector("app_entries", "Entries", lambda: 3)
+    registry.collector("app_events_total", "Events", lambda: [({"event": "hit"}, 2), ({"event": "miss"}, 1)], "counter")
+    registry.collector("app_broken", "Fails on every scrape", lambda: 1 / 0)
+    requests.inc('/a"b\\c\n')
+    requests.inc("/x", amount=2)
+    for value in (0.05, 0.1, 0.5, 7.0):
+        latency.observe(value, "scoring")
+
+    text = registry.render()
+    assert 'app_requests_total{route="/a\\"b\\\\c\\n"} 1.0' in text
+    metrics = parse_exposition(text)
+    assert "app_broken" not in metrics
+    assert {name: m["type"] for name, m in metrics.items()} == {
+        "app_requests_total": "counter", "app_latency_seconds": "histogram", "app_entries": "gauge", "app_events_total": "counter",
+    }
+    assert metrics["app_entries"]["samples"] == [("app_entries", {}, 3.0)]
+    # Buckets are cumulative and include +Inf; a value equal to a bound falls in that bucket
+    assert metrics["app_latency_seconds"]["samples"] == [
+        ("app_latency_seconds_bucket", {"stage": "scoring", "le": "0.1"}, 2),
+        ("app_latency_seconds_bucket", {"stage": "scoring", "le": "1.0"}, 3),
+        ("app_latency_seconds_bucket", {"stage": "scoring", "le": "+Inf"}, 4),
+        ("app_latency_seconds_sum", {"stage": "scoring"}, pytest.approx(7.65)),
+        ("app_latency_seconds_count", {"stage": "scoring"}, 4),
+    ]
+
+
+def test_histogram_time_observes_the_block_and_notifies_observers():
+    registry = MetricsRegistry()
+    latency = registry.histogram("app_latency_seconds", "Latency", ["stage"])
+    seen = []
+    latency.add_observer(lambda value, labels: seen.append((labels, value)))
+    with pytest.raises(ValueError):
+        with latency.time("parse"):
+            raise ValueError("the block failed")
+    assert [labels for labels, _ in seen] == [("parse",)] and seen[0][1] >= 0
+    assert "app_latency_seconds_count{stage=\"parse\"} 1" in registry.render()
+
+
+# Series dashboards and alerts are built on; renaming any of them breaks them
+EXPECTED = {
+    "zerostack_http_request_duration_seconds": "histogram",
+    "zerostack_search_stage_duration_seconds": "histogram",
+    "zerostack_upload_stage_duration_seconds": "histogram",
+    "zerostack_rows_ingested_total": "counter",
+    "zerostack_slow_requests_total": "counter",
+    "zerostack_result_cache_entries": "gauge",
+    "zerostack_result_cache_events_total": "counter",
+    "zerostack_search_flights_total": "counter",
+    "zerostack_search_in_flight": "gauge",
+    "zerostack_db_pool_size": "gauge",
+    "zerostack_db_pool_checked_out": "gauge",
+    "zerostack_doc_store_records": "gauge",
+    "zerostack_doc_store_events_total": "counter",
+    "zerostack_search_indexes": "gauge",
+    "zerostack_vector_rows": "gauge",
+}
+
+
+def histogram_series(metric, labels):
+    """(cumulative bucket counts, count) of the series whose labels include these"""
+    buckets = [
+        value for sample, sample_labels, value in metric["samples"]
+        if sample.endswith("_bucket") and labels.items() <= sample_labels.items()
+    ]
+    [count] = [
+        value for sample, sample_labels, value in metric["samples"]
+        if sample.endswith("_count") and sample_labels == labels
+    ]
+    return buckets, count
+
+
+def test_metrics_endpoint_after_a_search(service, upload):
+    client = service.client
+    dataset_id = upload("name\napple pie\ncherry pie\n", "metered")
+    assert client.post("/search", json={"query": "apple", "dataset_id": dataset_id}).status_code == 200
+    assert client.get(f"/datasets/{dataset_id}/records").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == CONTENT_TYPE
+    metrics = parse_exposition(response.text)
+    assert {name: metrics[name]["type"] for name in EXPECTED if name in metrics} == EXPECTED
+
+    # Requests are labelled by route template, not raw path
+    buckets, count = histogram_series(
+        metrics["zerostack_http_request_duration_seconds"], {"method": "POST", "route": "/search", "status": "200"}
+    )
+    assert count >= 1 and buckets == sorted(buckets) and buckets[-1] == count
+    routes = {labels["route"] for _, labels, _ in metrics["zerostack_http_request_duration_seconds"]["samples"]}
+    assert "/datasets/{dataset_id}/records" in routes and f"/datasets/{dataset_id}/records" not in routes
+    for stage in ("candidates", "scoring", "top_k"):
+        buckets, count = histogram_series(metrics["zerostack_search_stage_duration_seconds"], {"stage": stage})
+        assert count >= 1 and buckets[-1] == count
+    for stage in ("read", "detect", "parse", "insert"):
+        assert histogram_series(metrics["zerostack_upload_stage_duration_seconds"], {"stage": stage})[1] >= 1
+
+    ingested = {labels["format"]: value for _, labels, value in metrics["zerostack_rows_ingested_total"]["samples"]}
+    assert ingested.get("csv", 0) >= 2
+    flights = {labels["outcome"] for _, labels, _ in metrics["zerostack_search_flights_total"]["samples"]}
+    assert flights == {"executed", "coalesced"}
+    assert {labels["shard"] for _, labels, _ in metrics["zerostack_db_pool_size"]["samples"]} == {"0", "1"}
+    assert all(not math.isnan(value) for m in metrics.values() for _, _, value in m["samples"])
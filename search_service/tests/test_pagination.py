@@ -0,0 +1,92 @@
+import json
+
+NAMES = ["apple", "banana", "cherry", "damson", "elder"]
+
+
+def records_csv(names=NAMES):
+    return "name\n" + "".join(f"{name}\n" for name in names)
+
+
+def follow(client, url, **params):
+    """Every page of a list endpoint, following X-Next-Cursor"""
+    pages = []
+    while True:
+        response = client.get(url, params=params)
+        assert response.status_code == 200, response.text
+        pages.append(response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return pages
+        assert response.headers["link"].endswith('>; rel="next"') and f"after={cursor}" in response.headers["link"]
+        params = {**params, "after": int(cursor)}
+
+
+def test_cursor_walks_every_record_once_in_id_order(service, upload):
+    dataset_id = upload(records_csv(), "paged")
+    pages = follow(service.client, f"/datasets/{dataset_id}/records", limit=2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    rows = [row for page in pages for row in page]
+    ids = [row["id"] for row in rows]
+    assert ids == sorted(set(ids))
+    assert [row["metadata"]["name"] for row in rows] == NAMES
+    assert {row["dataset_id"] for row in rows} == {dataset_id}
+
+    # A page that ends exactly at the last row still advertises a cursor; the next page is empty
+    pages = follow(service.client, f"/datasets/{dataset_id}/records", limit=5)
+    assert [len(page) for page in pages] == [5, 0]
+    after_last = service.client.get(f"/datasets/{dataset_id}/records", params={"after": ids[-1]})
+    assert after_last.json() == [] and "x-next-cursor" not in after_last.headers
+
+
+def test_datasets_and_documents_page_with_the_same_cursor(service, upload):
+    created = [upload(records_csv(NAMES[:1]), f"listed {i}") for i in range(3)]
+    pages = follow(service.client, "/datasets", limit=1)
+    ids = [dataset["id"] for page in pages for dataset in page]
+    assert ids == sorted(set(ids)) and set(created) <= set(ids)
+
+    first = service.client.get("/documents", params={"limit": 2})
+    cursor = int(first.headers["x-next-cursor"])
+    assert cursor == first.json()[-1]["id"]
+    second = service.client.get("/documents", params={"limit": 2, "after": cursor}).json()
+    assert second and all(doc["id"] > cursor for doc in second)
+
+
+def test_limit_defaults_and_is_clamped_to_max_page_size(service, upload, monkeypatch):
+    main = service.main
+    dataset_id = upload(records_csv(), "clamped")
+    url = f"/datasets/{dataset_id}/records"
+    monkeypatch.setattr(main, "DEFAULT_PAGE_SIZE", 2)
+    monkeypatch.setattr(main, "MAX_PAGE_SIZE", 3)
+    assert len(service.client.get(url).json()) == 2
+    response = service.client.get(url, params={"limit": 1000})
+    assert len(response.json()) == 3 and "x-next-cursor" in response.headers
+    assert service.client.get(url, params={"limit": 0}).status_code == 422
+
+
+def ndjson_rows(response):
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.text.endswith("\n")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_ndjson_streams_all_rows_after_the_cursor_across_db_pages(service, upload, monkeypatch):
+    monkeypatch.setattr(service.main, "EXPORT_BATCH_SIZE", 2)
+    dataset_id = upload(records_csv(), "exported")
+    url = f"/datasets/{dataset_id}/records"
+    paged = [row for page in follow(service.client, url) for row in page]
+
+    # The format parameter and the Accept header both select NDJSON; no page limit applies
+    assert ndjson_rows(service.client.get(url, params={"format": "ndjson"})) == paged
+    assert ndjson_rows(service.client.get(url, headers={"Accept": "application/x-ndjson"})) == paged
+    exported = ndjson_rows(service.client.get(url, params={"format": "ndjson", "after": paged[0]["id"], "limit": 3}))
+    assert exported == paged[1:4]
+    # An explicit format=json wins over the Accept header
+    response = service.client.get(url, params={"format": "json"}, headers={"Accept": "application/x-ndjson"})
+    assert response.json() == paged
+
+
+def test_frontend_can_read_the_cursor_across_origins(service):
+    response = service.client.get("/datasets", params={"limit": 1}, headers={"Origin": "http://localhost:3000"})
+    exposed = {name.strip().lower() for name in response.headers["access-control-expose-headers"].split(",")}
+    assert {"x-next-cursor", "link"} <= exposed
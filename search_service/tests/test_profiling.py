@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import profiling
+from profiling import RequestProfile
+
+from .conftest import ADMIN_TOKEN
+
+
+def record_work(stage, seconds, counted):
+    profiling.record_stage(seconds, [stage])
+    profiling.count("rows", counted)
+    return threading.get_ident()
+
+
+def test_bind_carries_the_profile_into_worker_threads():
+    with ThreadPoolExecutor(2) as pool, profiling.activate(RequestProfile(requested=True)) as profile:
+        threads = {
+            pool.submit(profiling.bind(lambda n=n: record_work("scoring", 0.25, n))).result()
+            for n in (1, 2, 3)
+        }
+        # Unbound work runs in the worker's own context and is not attributed to the request
+        pool.submit(record_work, "lost", 1.0, 100).result()
+        report = profiling.report()
+    assert threading.get_ident() not in threads
+    assert report["stages"] == {"scoring": pytest.approx(0.75)}
+    assert report["counts"] == {"rows": 6}
+    assert profile.seconds is not None
+
+
+def test_profiles_of_concurrent_requests_stay_apart():
+    async def request(number, pool):
+        with profiling.activate(RequestProfile(requested=True)):
+            profiling.annotate(number=number)
+            loop = asyncio.get_running_loop()
+            for _ in range(3):
+                await loop.run_in_executor(pool, profiling.bind(lambda: record_work(f"stage{number}", 0.1, number)))
+                await asyncio.sleep(0)
+            return profiling.report()
+
+    async def scenario():
+        with ThreadPoolExecutor(2) as pool:
+            return await asyncio.gather(*(request(number, pool) for number in (1, 2, 3)))
+
+    for number, report in enumerate(asyncio.run(scenario()), 1):
+        assert report["number"] == number
+        assert report["stages"] == {f"stage{number}": pytest.approx(0.3)}
+        assert report["counts"] == {"rows": 3 * number}
+
+
+def test_without_an_active_profile_nothing_is_recorded():
+    work = lambda: record_work("scoring", 1.0, 1)  # noqa: E731
+    assert profiling.bind(work) is work
+    assert profiling.report() is None
+    with profiling.activate(RequestProfile(requested=False)):
+        profiling.count("rows")
+        assert profiling.report() is None
+
+
+def test_only_one_request_at_a_time_runs_under_cprofile():
+    first = RequestProfile(requested=True, cprofile=True)
+    second = RequestProfile(requested=True, cprofile=True)
+    assert first.cprofile and not second.cprofile
+    assert second.cprofile_summary() == {"skipped": "another request is being profiled"}
+    first.call(lambda: sum(range(1000)))
+    assert first.cprofile_summary()
+    first.finish()
+    second.finish()
+    # Finishing the first request frees cProfile for the next one
+    third = RequestProfile(cprofile=True)
+    assert third.cprofile
+    third.finish()
+
+
+@pytest.fixture
+def recipes(upload):
+    return upload("name,kind\napple pie,dessert\napple tart,dessert\ncherry pie,dessert\nbean soup,main\n", "recipes")
+
+
+@pytest.mark.parametrize("headers, params", [
+    ({"X-Profile": "1"}, {}),
+    ({}, {"profile": "1"}),
+    ({"X-Profile": "cprofile"}, {}),
+    ({"X-Profile": "1", "X-Admin-Token": "wrong"}, {}),
+    ({"X-Profile": "1", "X-Admin-Token": ""}, {}),
+])
+def test_profiling_is_refused_to_callers_without_the_admin_token(service, recipes, headers, params):
+    response = service.client.post(
+        "/search", json={"query": "apple", "dataset_id": recipes}, headers=headers, params=params,
+    )
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Profiling is limited to admin callers"}
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Profile": "0"}, {"X-Profile": "false"}, {"X-Admin-Token": ADMIN_TOKEN}])
+def test_requests_not_asking_for_a_profile_get_none(service, recipes, headers):
+    response = service.client.post("/search", json={"query": "apple", "dataset_id": recipes}, headers=headers)
+    assert response.status_code == 200
+    assert "profile" not in response.json()
+
+
+def test_admin_profile_holds_the_stages_run_on_worker_threads(service, recipes):
+    response = service.client.post(
+        "/search",
+        json={"query": "apple", "dataset_id": recipes, "filters": {"kind": "dessert"}, "include_documents": True},
+        headers={"X-Profile": "1", "X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200, response.text
+    profile = response.json()["profile"]
+    assert profile["query"] == "apple" and profile["dataset_ids"] == [recipes]
+    # Candidates and filtering run on the DB pool, scoring on the CPU pool
+    assert {"candidates", "filter", "scoring", "top_k", "hydration"} <= set(profile["stages"])
+    assert profile["counts"] == {"dataset_records": 4, "matches": 2, "candidates": 2, "results": 2}
+    assert "cprofile" not in profile
+
+
+def test_admin_can_ask_for_a_cprofile_summary(service, recipes):
+    response = service.client.post(
+        "/search", json={"query": "apple", "dataset_id": recipes},
+        params={"profile": "cprofile"}, headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200, response.text
+    summary = response.json()["profile"]["cprofile"]
+    assert summary and {"function", "calls", "own_seconds", "cumulative_seconds"} <= set(summary[0])
+    assert any("search_documents_in_db" in entry["function"] for entry in summary)
+
+
+def test_upload_profile_counts_rows(service):
+    response = service.client.post(
+        "/upload", data={"dataset_name": "profiled", "text_data": "name\na\nb\nc\n"},
+        headers={"X-Profile": "1", "X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200, response.text
+    profile = response.json()["profile"]
+    assert profile["counts"]["rows"] == 3
+    assert profile["dataset_id"] == response.json()["dataset_id"]
+
+
+class RecordingLog:
+    """Stands in for the slow-request log, keeping what it was asked to record"""
+
+    enabled = True
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, profile, method, route, status):
+        self.entries.append((method, route, status, profile.seconds, dict(profile.counts)))
+        return False
+
+
+def test_streamed_responses_are_profiled_until_their_last_chunk(service, recipes, monkeypatch):
+    main = service.main
+    log = RecordingLog()
+    monkeypatch.setattr(main, "slow_log", log)
+    monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 1)
+    original = main.record_page
+
+    def slow_page(dataset_id, after, limit):
+        time.sleep(0.05)
+        profiling.count("pages")
+        return original(dataset_id, after, limit)
+
+    monkeypatch.setattr(main, "record_page", slow_page)
+    response = service.client.get(f"/datasets/{recipes}/records", params={"format": "ndjson"})
+    assert response.status_code == 200 and len(response.text.splitlines()) == 4
+    # Recorded once the body was sent: every page load is in the profile, and in its time
+    [(method, route, status, seconds, counts)] = log.entries
+    assert (method, route, status) == ("GET", "/datasets/{dataset_id}/records", 200)
+    assert counts == {"pages": 5} and seconds >= 5 * 0.05
+
+
+def test_a_streamed_cprofile_holds_the_profiler_until_the_body_is_sent(service, recipes, monkeypatch):
+    main = service.main
+    held = []
+    original = main.record_page
+
+    def page(dataset_id, after, limit):
+        # Another request asking for cProfile now is told one is running
+        held.append(not RequestProfile(cprofile=True).cprofile)
+        return original(dataset_id, after, limit)
+
+    monkeypatch.setattr(main, "record_page", page)
+    response = service.client.get(
+        f"/datasets/{recipes}/records", params={"format": "ndjson", "profile": "cprofile"},
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200 and held == [True]
+    released = RequestProfile(cprofile=True)
+    assert released.cprofile
+    released.finish()
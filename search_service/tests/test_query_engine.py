@@ -0,0 +1,231 @@
+import numpy as np
+import pytest
+
+from query_engine import (
+    MAX_FUZZY_EXPANSIONS,
+    And,
+    Fuzzy,
+    Not,
+    Or,
+    QueryPlanner,
+    QuerySyntaxError,
+    Substring,
+    Term,
+    Wildcard,
+    match,
+    match_batch,
+    match_batch_for_scoring,
+    match_for_scoring,
+    parse_query,
+    scoring_query,
+)
+from search_index import InvertedIndex
+
+DOCS = {
+    1: "apple pie",
+    2: "apple tart",
+    3: "cherry pie",
+    4: "banana bread",
+    5: "apple banana smoothie",
+    6: "cherry tart with apple",
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = InvertedIndex()
+    index.add_many(DOCS.items())
+    return index
+
+
+def brute_force(predicate):
+    """Ids whose word set satisfies predicate, computed without the index"""
+    return [doc_id for doc_id, text in sorted(DOCS.items()) if predicate(set(text.split()))]
+
+
+@pytest.mark.parametrize("query, tree", [
+    ("apple", Term("apple")),
+    ("Apple PIE", And((Term("apple"), Term("pie")))),
+    ("apple AND pie", And((Term("apple"), Term("pie")))),
+    ("apple OR pie", Or((Term("apple"), Term("pie")))),
+    ("apple pie OR tart", Or((And((Term("apple"), Term("pie"))), Term("tart")))),
+    ("apple (pie OR tart)", And((Term("apple"), Or((Term("pie"), Term("tart")))))),
+    ("NOT apple", Not(Term("apple"))),
+    ("NOT NOT apple", Not(Not(Term("apple")))),
+    ("a OR (b OR c)", Or((Term("a"), Term("b"), Term("c")))),
+    ("e-mail", And((Term("e"), Term("mail")))),
+    ("aple~", Fuzzy("aple", 1)),
+    ("aple~2", Fuzzy("aple", 2)),
+    ("app*", Wildcard("app*")),
+    ("a**e", Wildcard("a*e")),
+    ('"W York"', Substring("w york")),
+    ("apple and pie", And((Term("apple"), Term("and"), Term("pie")))),
+])
+def test_parse_query(query, tree):
+    assert parse_query(query) == tree
+
+
+@pytest.mark.parametrize("query", ["", "   ", "!!!", '""', "*", "NOT !!!"])
+def test_queries_without_terms_parse_to_none(query):
+    assert parse_query(query) is None
+
+
+@pytest.mark.parametrize("query", ["apple AND", "OR apple", "(apple", "apple)", "apple AND OR pie", "NOT", "()"])
+def test_malformed_queries_raise(query):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
+
+
+@pytest.mark.parametrize("query, predicate", [
+    ("apple", lambda w: "apple" in w),
+    ("apple pie", lambda w: {"apple", "pie"} <= w),
+    ("apple AND tart", lambda w: {"apple", "tart"} <= w),
+    ("pie OR tart", lambda w: "pie" in w or "tart" in w),
+    ("apple NOT pie", lambda w: "apple" in w and "pie" not in w),
+    ("NOT apple", lambda w: "apple" not in w),
+    ("NOT (apple OR cherry)", lambda w: not w & {"apple", "cherry"}),
+    ("apple NOT (pie OR tart)", lambda w: "apple" in w and not w & {"pie", "tart"}),
+    ("(apple OR cherry) AND (pie OR tart) NOT banana", lambda w: w & {"apple", "cherry"} and w & {"pie", "tart"}),
+    ("apple pie OR cherry tart", lambda w: {"apple", "pie"} <= w or {"cherry", "tart"} <= w),
+    ("apple missing", lambda w: False),
+    ("missing OR banana", lambda w: "banana" in w),
+    ("NOT missing", lambda w: True),
+])
+def test_boolean_semantics_match_brute_force(index, query, predicate):
+    assert match(index, query).tolist() == brute_force(predicate)
+
+
+def test_blank_query_matches_every_record(index):
+    assert match(index, "").tolist() == sorted(DOCS)
+    assert match(index, "  \t").tolist() == sorted(DOCS)
+    assert scoring_query("") == ""
+
+
+def test_match_batch_equals_match(index):
+    queries = ["apple", "apple NOT pie", "pie OR tart", "", "cherry (pie OR tart)", "apple"]
+    assert [ids.tolist() for ids in match_batch(index, queries)] == [match(index, q).tolist() for q in queries]
+
+
+def test_scoring_query_skips_negated_terms(index):
+    assert scoring_query("apple NOT pie") == "apple"
+    assert scoring_query("(apple OR cherry) NOT (pie OR tart)") == "apple cherry"
+    assert scoring_query("NOT NOT apple") == "apple"
+
+
+def test_planner_estimates():
+    index = InvertedIndex()
+    index.add_many(DOCS.items())
+    planner = QueryPlanner(index)
+    assert planner.estimate(Term("apple")) == 4
+    assert planner.estimate(parse_query("apple cherry")) == 2
+    assert planner.estimate(parse_query("pie OR tart")) == 4
+    assert planner.estimate(parse_query("apple OR cherry OR banana")) == len(DOCS)
+    assert planner.estimate(parse_query("NOT apple")) == 2
+
+
+def test_and_seeds_with_the_rarest_child_and_filters_the_rest(index, monkeypatch):
+    planner = QueryPlanner(index)
+    read = []
+    original = index.posting
+    monkeypatch.setattr(index, "posting", lambda term: read.append(term) or original(term))
+    assert planner.execute(parse_query("apple banana smoothie")).tolist() == [5]
+    # Only the rarest term's posting list is read in full
+    assert read == ["smoothie"]
+
+
+def test_empty_intermediate_results_short_circuit(index, monkeypatch):
+    planner = QueryPlanner(index)
+    monkeypatch.setattr(index, "filter_term", lambda *args, **kwargs: pytest.fail("filtered an empty set"))
+    assert planner.execute(parse_query("missing apple NOT pie")).size == 0
+
+
+def test_or_returns_the_candidates_when_one_branch_covers_them(index):
+    planner = QueryPlanner(index)
+    within = np.array([1, 2], dtype=np.int64)
+    assert planner.execute(parse_query("apple OR cherry"), within) is within
+
+
+PLACES = {
+    1: "new york city",
+    2: "west yorkshire moors",
+    3: "newyork deli",
+    4: "york new",
+    5: "a new yorker",
+    6: "apple maple staple",
+    7: "ample apples",
+}
+
+
+@pytest.fixture(scope="module")
+def places():
+    index = InvertedIndex()
+    index.add_many(PLACES.items())
+    return index
+
+
+def contains(candidates, text):
+    return np.array([i for i in candidates.tolist() if text in PLACES[i]], dtype=np.int64)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("aple~", [6, 7]),
+    ("aple~0", []),
+    ("yrok~1", []),
+    ("yrok~2", [1, 4]),
+    ("*ple", [6, 7]),
+    ("a*e", [6, 7]),
+    ("york*", [1, 2, 4, 5]),
+    ("york* NOT new", [2]),
+    ('"ork"', [1, 2, 3, 4, 5]),
+])
+def test_expansion_leaves(places, query, expected):
+    assert match(places, query, contains).tolist() == expected
+
+
+@pytest.mark.parametrize("phrase, expected", [
+    ('"w york"', [1, 5]),
+    ('"new york"', [1, 5]),
+    ('"york new"', [4]),
+    ('"ew yorks"', []),
+    ('"st yorkshire m"', [2]),
+])
+def test_quoted_phrases_cross_word_boundaries(places, phrase, expected):
+    assert match(places, phrase, contains).tolist() == expected
+    assert expected == [i for i, text in PLACES.items() if phrase.strip('"') in text]
+
+
+def test_phrase_candidates_without_a_verifier_are_the_term_matches(places):
+    # "w" must end a word and "york" start one; only the verifier checks they are adjacent
+    assert match(places, '"w york"').tolist() == [1, 4, 5]
+
+
+def test_fuzzy_expansion_is_capped_at_the_closest_terms():
+    terms = [f"term{i:03d}" for i in range(200)]
+    index = InvertedIndex()
+    index.add_many(enumerate(terms, 1))
+    planner = QueryPlanner(index)
+    [group] = planner.expand(Fuzzy("term000", 2))
+    assert len(group) == MAX_FUZZY_EXPANSIONS
+    assert group[0] == "term000"
+    # Distance 1 terms come before distance 2 ones
+    assert set(group[:19]) == {f"term00{i}" for i in range(1, 10)} | {f"term0{i}0" for i in range(1, 10)} | {"term000"}
+    assert match(index, "term000~2").size == MAX_FUZZY_EXPANSIONS
+
+
+
+def test_scoring_words_reuse_the_matchs_expansions(places, monkeypatch):
+    vocabulary = places.vocabulary()
+    lookups = []
+    for name in ("fuzzy", "match_pattern"):
+        original = getattr(vocabulary, name)
+        monkeypatch.setattr(vocabulary, name, lambda *args, original=original: lookups.append(args) or original(*args))
+    query = "york* OR aple~"
+    ids, terms = match_for_scoring(places, query, contains)
+    # Each leaf is expanded once, though both the match and the ranking use it
+    assert len(lookups) == 2
+    assert ids.tolist() == match(places, query, contains).tolist() == [1, 2, 4, 5, 6, 7]
+    assert terms == scoring_query(query, places)
+    queries = ["york*", "apple NOT york"]
+    id_sets, terms = match_batch_for_scoring(places, queries, contains)
+    assert [ids.tolist() for ids in id_sets] == [ids.tolist() for ids in match_batch(places, queries, contains)]
+    assert terms == [scoring_query("york*", places), "apple"]
@@ -0,0 +1,238 @@
+import json
+import sqlite3
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlmodel import Session
+
+from record_fields import (
+    JSON,
+    TEXT,
+    CellType,
+    FieldFilter,
+    FieldSchema,
+    FilterError,
+    filter_clause,
+    from_cell,
+    parse_filters,
+    text_cell,
+    to_cell,
+)
+
+
+@pytest.mark.parametrize("value, cell", [
+    ("10", 10),
+    ("-2", -2),
+    ("10.0", 10.0),
+    ("9.5", 9.5),
+    ("3.50", "3.50"),
+    ("010", "010"),
+    ("-0", "-0"),
+    ("1e3", "1e3"),
+    ("+5", "+5"),
+    (" 7", " 7"),
+    ("", ""),
+    ("9223372036854775807", 2 ** 63 - 1),
+    ("9223372036854775808", "9223372036854775808"),
+    ("nan", "nan"),
+    ("abc", "abc"),
+])
+def test_text_cells_keep_numbers_that_print_back_identically(value, cell):
+    assert text_cell(value) == cell and type(text_cell(value)) is type(cell)
+    assert from_cell(to_cell(value), TEXT) == value
+
+
+@pytest.mark.parametrize("value", [
+    None, True, False, 0, -7, 2 ** 63 - 1, 2 ** 70, 1.0, -2.5, float("inf"),
+    [1, "two", None], {"a": {"b": [True]}}, [], {},
+])
+def test_json_values_read_back_exactly(value):
+    back = from_cell(to_cell(value), JSON)
+    assert back == value and type(back) is type(value)
+
+
+def test_booleans_and_big_numbers_are_stored_as_json_blobs():
+    assert to_cell(True) == b"true"
+    assert to_cell(2 ** 70) == str(2 ** 70).encode()
+    assert to_cell(float("nan")) == b"NaN"
+    assert to_cell(3) == 3 and to_cell(3.0) == 3.0
+
+
+def test_schema_encodes_and_decodes_records():
+    schema = FieldSchema(1, new_ids=iter(range(10, 20)))
+    records = {5: {"name": "ada", "age": "36", "tags": ["x"]}, 6: {"age": 41, "name": "bob", 7: "seven"}}
+    cells = []
+    for record_id, fields in records.items():
+        record_cells, ordered = schema.encode(record_id, fields)
+        cells.extend(record_cells)
+    assert ordered is False  # "age" as a number is a new field after "tags"
+    assert [f[1:] for f in schema.take_new()] == [("name", TEXT), ("age", TEXT), ("tags", JSON), ("age", JSON), ("7", TEXT)]
+    decoded = schema.decode(sorted(cells))
+    assert decoded == {5: records[5], 6: {"age": 41, "name": "bob", "7": "seven"}}
+    assert type(decoded[5]["age"]) is str
+
+
+# (row id, text field value, json field value), stored through real SQLite storage classes
+ROWS = [
+    (1, "10", True),
+    (2, "10.0", False),
+    (3, "9.5", None),
+    (4, "abc", [1, 2]),
+    (5, "3.50", {"a": 1}),
+    (6, "1e3", 10),
+    (7, "-2", 10.0),
+    (8, "", 2 ** 70),
+    (9, "true", 1),
+]
+
+
+@pytest.fixture(scope="module")
+def cells():
+    engine = create_engine("sqlite://")
+    metadata = MetaData()
+    table = Table(
+        "cells", metadata,
+        Column("id", Integer, primary_key=True), Column("kind", String), Column("value", CellType()),
+    )
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for row_id, text_value, json_value in ROWS:
+            conn.execute(table.insert(), [
+                {"id": row_id, "kind": TEXT, "value": to_cell(text_value)},
+                {"id": 100 + row_id, "kind": JSON, "value": to_cell(json_value)},
+            ])
+
+    def matching(kind, filters):
+        clauses = [filter_clause(table.c.value, kind, condition) for condition in parse_filters(filters)]
+        if any(clause is None for clause in clauses):
+            return None
+        with engine.connect() as conn:
+            ids = conn.execute(select(table.c.id).where(table.c.kind == kind, *clauses).order_by(table.c.id)).scalars()
+            return [row_id % 100 for row_id in ids]
+
+    return matching
+
+
+@pytest.mark.parametrize("filters, expected", [
+    # "10" is stored as 10 and "10.0" as 10.0, but equality on a string is exact
+    ({"f": "10"}, [1]),
+    ({"f": "10.0"}, [2]),
+    ({"f": "3.50"}, [5]),
+    ({"f": ""}, [8]),
+    # A number compares numerically, also with text spelling a number
+    ({"f": 10}, [1, 2]),
+    ({"f": 1000}, [6]),
+    ({"f": {"gt": 5}}, [1, 2, 3, 6]),
+    ({"f": {"lt": "5"}}, [5, 7]),
+    ({"f": {"gte": 9.5, "lte": 10}}, [1, 2, 3]),
+    # A non-numeric string compares as text, with text only
+    ({"f": {"gt": "a"}}, [4, 9]),
+    ({"f": {"in": ["10", 9.5, "abc", True]}}, [1, 3, 4]),
+    ({"f": {"in": [-2, "nothing"]}}, [7]),
+    ({"f": True}, None),
+    ({"f": None}, None),
+    ({"f": {"in": [True, None]}}, None),
+])
+def test_filters_on_text_fields(cells, filters, expected):
+    assert cells(TEXT, filters) == expected
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"f": True}, [1]),
+    ({"f": False}, [2]),
+    ({"f": None}, [3]),
+    ({"f": [1, 2]}, [4]),
+    # An object operand needs an explicit eq, a plain object holds operators
+    ({"f": {"eq": {"a": 1}}}, [5]),
+    ({"f": 10}, [6, 7]),
+    ({"f": 1}, [9]),
+    ({"f": 2 ** 70}, [8]),
+    ({"f": {"gt": 5}}, [6, 7]),
+    ({"f": {"in": [True, 10, None, "10"]}}, [1, 3, 6, 7]),
+    ({"f": "10"}, None),
+    ({"f": {"lt": "5"}}, None),
+    ({"f": {"gt": 2 ** 70}}, None),
+])
+def test_filters_on_json_fields(cells, filters, expected):
+    assert cells(JSON, filters) == expected
+
+
+@pytest.mark.parametrize("filters", [
+    {"f": {"like": "a"}},
+    {"f": {"in": "abc"}},
+    {"f": {"gt": True}},
+    {"f": {"lt": [1]}},
+    {"f": {"gte": None}},
+])
+def test_malformed_filters_raise(filters):
+    with pytest.raises(FilterError):
+        parse_filters(filters)
+
+
+def test_plain_values_mean_equality():
+    assert parse_filters({"a": 1, "b": {"gt": 2, "lt": 5}}) == [
+        FieldFilter("a", "eq", 1), FieldFilter("b", "gt", 2), FieldFilter("b", "lt", 5),
+    ]
+
+
+BASELINE_SCHEMA = """
+CREATE TABLE userdataset (
+    id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, description VARCHAR, data_type VARCHAR NOT NULL,
+    total_records INTEGER NOT NULL, created_at DATETIME NOT NULL, file_size INTEGER
+);
+CREATE TABLE datasetrecord (
+    id INTEGER NOT NULL PRIMARY KEY, dataset_id INTEGER NOT NULL REFERENCES userdataset (id),
+    content VARCHAR NOT NULL, metadata VARCHAR, search_vector VARCHAR, created_at DATETIME NOT NULL
+);
+"""
+
+
+def test_migrate_record_storage_on_a_baseline_database(service, tmp_path):
+    main = service.main
+    path = tmp_path / "baseline.db"
+    records = {
+        1: (1, {"name": "ada", "age": "36", "city": "paris"}, None),
+        2: (1, {"name": "bob", "age": "41", "city": "london"}, None),
+        3: (2, {"title": "note", "score": 4.5, "tags": ["a", "b"], "done": False}, None),
+        4: (2, {"title": "kept", "score": 1}, "explicit content that is not the fields"),
+        5: (2, None, "plain text paragraph"),
+    }
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO userdataset VALUES (?, ?, NULL, 'structured', 0, '2024-01-01', NULL)", [(1, "a"), (2, "b")]
+        )
+        conn.executemany(
+            "INSERT INTO datasetrecord VALUES (?, ?, ?, ?, ?, '2024-01-01 00:00:00')",
+            [
+                (record_id, dataset_id, content or str(fields), json.dumps(fields) if fields else None, "vector")
+                for record_id, (dataset_id, fields, content) in records.items()
+            ],
+        )
+
+    engine = main.create_sqlite_engine(f"sqlite:///{path}")
+    try:
+        main.SQLModel.metadata.create_all(engine, tables=main.RECORD_TABLES)
+        main.migrate_record_storage(main.Shard(0, engine))
+        # A second run finds nothing to migrate
+        main.migrate_record_storage(main.Shard(0, engine))
+
+        with engine.connect() as conn:
+            columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(datasetrecord)")}
+            tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            stored = dict(conn.exec_driver_sql("SELECT id, content FROM datasetrecord").all())
+        assert "metadata" not in columns and "search_vector" not in columns
+        assert "datasetrecord_old" not in tables
+        # Content that was just the text of the fields is rebuilt from them instead of stored
+        assert stored == {1: None, 2: None, 3: None, 4: "explicit content that is not the fields", 5: "plain text paragraph"}
+
+        with Session(engine) as session:
+            for dataset_id in (1, 2):
+                schema = main.load_schema(session, dataset_id)
+                ids = [record_id for record_id, (d, fields, _) in records.items() if d == dataset_id and fields]
+                fields = main.record_fields(session, schema, ids)
+                assert fields == {record_id: records[record_id][1] for record_id in ids}
+            texts = dict(main.fill_content(session, main.load_schema(session, 1), [(1, None), (2, None)]))
+            assert texts == {1: str(records[1][1]), 2: str(records[2][1])}
+    finally:
+        engine.dispose()
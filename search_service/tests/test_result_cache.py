@@ -0,0 +1,121 @@
+import pytest
+
+import result_cache
+from result_cache import QueryResultCache, normalize_query
+
+
+def key(query, dataset_id=1, top_k=10, filters=None, mode="lexical"):
+    return QueryResultCache.make_key(query, dataset_id, top_k, filters, mode)
+
+
+def test_keys_normalize_case_and_spacing_but_keep_operators_and_options_apart():
+    assert normalize_query("  Apple   PIE ") == "apple pie"
+    assert normalize_query('"New  York" AND Pie') == '"new  york" AND pie'
+    assert key("Apple  pie") == key("apple pie")
+    assert key("apple and pie") != key("apple AND pie")
+    assert key("apple", dataset_id=0) == key("apple", dataset_id=None)
+    assert key("apple", filters={"a": 1, "b": 2}) == key("apple", filters={"b": 2, "a": 1})
+    assert len({key("apple"), key("apple", top_k=5), key("apple", mode="vector"), key("apple", filters={"a": 1})}) == 4
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = QueryResultCache(max_entries=2)
+    cache.put(key("a"), "A")
+    cache.put(key("b"), "B")
+    assert cache.get(key("a")) == "A"  # "b" is now the least recently used
+    cache.put(key("c"), "C")
+    assert cache.get(key("b")) is None
+    assert (cache.get(key("a")), cache.get(key("c"))) == ("A", "C")
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"], stats["hits"], stats["misses"]) == (2, 1, 3, 1)
+    assert stats["hit_rate"] == pytest.approx(0.75)
+    # Re-putting a key refreshes it rather than adding an entry
+    cache.put(key("a"), "A2")
+    cache.put(key("d"), "D")
+    assert (cache.get(key("a")), cache.get(key("c"))) == ("A2", None)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    cache = QueryResultCache(max_entries=4, ttl_seconds=30)
+    cache.put(key("a"), "A")
+    now[0] += 30
+    assert cache.get(key("a")) == "A"
+    now[0] += 0.5
+    assert cache.get(key("a")) is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_a_size_of_zero_disables_caching():
+    cache = QueryResultCache(max_entries=0)
+    cache.put(key("a"), "A")
+    assert cache.get(key("a")) is None
+
+
+def test_invalidation_drops_one_datasets_entries_and_bumps_its_generation():
+    cache = QueryResultCache()
+    cache.put(key("a", 1), "A1")
+    cache.put(key("b", 1), "B1")
+    cache.put(key("a", 2), "A2")
+    cache.put(key("a", None), "DOCS")
+    assert cache.generation(1) == 0
+    assert cache.invalidate_dataset(1) == 2
+    assert cache.generation(1) == 1 and cache.generation(2) == 0
+    assert cache.get(key("a", 1)) is None and cache.get(key("a", 2)) == "A2"
+    assert cache.invalidate_dataset(0) == 1 and cache.generation(None) == 1
+    assert cache.stats()["invalidations"] == 3
+
+
+def test_results_computed_before_a_write_are_not_stored():
+    cache = QueryResultCache()
+    generation = cache.generation(1)
+    cache.invalidate_dataset(1)
+    cache.put(key("a", 1), "stale", generation)
+    assert cache.get(key("a", 1)) is None
+    cache.put(key("a", 1), "fresh", cache.generation(1))
+    assert cache.get(key("a", 1)) == "fresh"
+
+
+@pytest.fixture
+def cached(service, monkeypatch):
+    """The app with its result cache enabled"""
+    cache = QueryResultCache(max_entries=64)
+    monkeypatch.setattr(service.main, "result_cache", cache)
+    return cache
+
+
+def search(service, dataset_id, query="apple"):
+    response = service.client.post("/search", json={"query": query, "dataset_id": dataset_id})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_writes_to_a_dataset_invalidate_its_cached_results(service, upload, cached):
+    client = service.client
+    dataset_id = upload("name\napple pie\ncherry pie\n", "cached")
+    other = upload("name\napple tart\n", "untouched")
+    assert cached.generation(dataset_id) == 1  # the upload bumped it
+
+    first = search(service, dataset_id)
+    search(service, other)
+    assert search(service, dataset_id) == first
+    assert (cached.stats()["hits"], cached.stats()["entries"]) == (1, 2)
+
+    assert client.post(f"/datasets/{dataset_id}/append", data={"text_data": "name\napple crumble\n"}).status_code == 200
+    assert cached.generation(dataset_id) == 2
+    appended = search(service, dataset_id)
+    assert appended["total_found"] == 2 and set(first["results"]) < set(appended["results"])
+    # The other dataset's entry survived the write
+    assert cached.get(cached.make_key("apple", other, 10)) is not None
+
+    deleted_id = first["results"][0]
+    assert client.post(f"/datasets/{dataset_id}/records/delete", json={"ids": [deleted_id]}).json()["deleted"] == 1
+    assert cached.generation(dataset_id) == 3
+    after_delete = search(service, dataset_id)
+    assert deleted_id not in after_delete["results"] and after_delete["total_found"] == 1
+
+    assert client.delete(f"/datasets/{dataset_id}").status_code == 204
+    assert cached.generation(dataset_id) == 4
+    assert search(service, dataset_id)["total_found"] == 0
+    assert client.get("/cache/stats").json()["invalidations"] >= 3
@@ -0,0 +1,106 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import scoring
+from scoring import CpuScorer, top_k_indices
+
+
+def reference_top_k(scores, k):
+    """Full stable argsort: best first, ties to the lower index, NaN last"""
+    keys = np.where(np.isnan(scores), -np.inf, scores)
+    return np.argsort(-keys, kind="stable")[:max(k, 0)]
+
+
+SCORE_SETS = {
+    "distinct": np.array([0.5, 2.0, 1.5, -1.0, 3.0], dtype=np.float32),
+    "ties": np.array([1.0, 2.0, 1.0, 2.0, 1.0, 0.0, 2.0, 1.0], dtype=np.float32),
+    "all equal": np.ones(6, dtype=np.float32),
+    "zeros": np.array([0.0, 0.0, 1.0, 0.0, -0.0], dtype=np.float32),
+    "nan": np.array([1.0, np.nan, 2.0, np.nan, 0.0, 2.0], dtype=np.float32),
+    "all nan": np.full(3, np.nan, dtype=np.float32),
+    "infinities": np.array([-np.inf, 1.0, np.inf, np.nan, -np.inf], dtype=np.float32),
+    "empty": np.empty(0, dtype=np.float32),
+    "single": np.array([7.0], dtype=np.float32),
+}
+
+
+@pytest.mark.parametrize("name", SCORE_SETS)
+@pytest.mark.parametrize("k", [0, 1, 2, 3, 5, 6, 100, -1])
+def test_top_k_matches_a_full_sort(name, k):
+    scores = SCORE_SETS[name]
+    assert top_k_indices(scores, k).tolist() == reference_top_k(scores, k).tolist()
+
+
+def test_random_scores_with_many_ties():
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        scores = rng.integers(0, 5, size=rng.integers(1, 60)).astype(np.float32)
+        scores[rng.random(scores.size) < 0.1] = np.nan
+        k = int(rng.integers(0, scores.size + 3))
+        assert top_k_indices(scores, k).tolist() == reference_top_k(scores, k).tolist()
+
+
+def test_inputs_are_read_as_float32():
+    indices = top_k_indices([1, 3, 2], 2)
+    assert indices.dtype == np.int64 and indices.tolist() == [1, 2]
+    indices, values = CpuScorer().top_k(np.array([0.1, 0.3, 0.2]), 5)
+    assert indices.tolist() == [1, 2, 0] and values.dtype == np.float32
+
+
+def batch_reference(score_sets, ks):
+    return [(reference_top_k(scores, k).tolist(), scores[reference_top_k(scores, k)]) for scores, k in zip(score_sets, ks)]
+
+
+def assert_batch_equal(results, expected):
+    assert len(results) == len(expected)
+    for (indices, values), (ref_indices, ref_values) in zip(results, expected):
+        assert indices.dtype == np.int64
+        assert indices.tolist() == ref_indices
+        np.testing.assert_array_equal(values, ref_values)
+
+
+@pytest.mark.parametrize("k", [0, 1, 3, 4, 100])
+def test_batch_matches_one_set_at_a_time(k):
+    score_sets = [SCORE_SETS[name] for name in ("ties", "nan", "zeros", "all equal", "single", "empty")]
+    assert_batch_equal(CpuScorer().top_k_batch(score_sets, k), batch_reference(score_sets, [k] * len(score_sets)))
+
+
+def test_batch_takes_a_k_per_set():
+    score_sets = [SCORE_SETS["ties"], SCORE_SETS["nan"], SCORE_SETS["distinct"]]
+    ks = [2, 5, 0]
+    assert_batch_equal(CpuScorer().top_k_batch(score_sets, ks), batch_reference(score_sets, ks))
+
+
+def test_padded_and_ragged_batches_agree(monkeypatch):
+    score_sets = [np.arange(50, dtype=np.float32) % 7, SCORE_SETS["single"], SCORE_SETS["nan"]]
+    calls = []
+    original = CpuScorer.top_k
+    monkeypatch.setattr(CpuScorer, "top_k", lambda self, scores, k: calls.append(k) or original(self, scores, k))
+    monkeypatch.setattr(scoring, "MAX_BATCH_PADDING", 100.0)
+    padded = CpuScorer().top_k_batch(score_sets, 4)
+    assert calls == []
+    # Too ragged to pad: ranked one set at a time
+    monkeypatch.setattr(scoring, "MAX_BATCH_PADDING", 1.0)
+    ragged = CpuScorer().top_k_batch(score_sets, 4)
+    assert calls == [4, 4, 4]
+    assert_batch_equal(ragged, batch_reference(score_sets, [4, 4, 4]))
+    assert_batch_equal(padded, batch_reference(score_sets, [4, 4, 4]))
+
+
+def test_random_batches():
+    rng = np.random.default_rng(11)
+    scorer = CpuScorer()
+    for _ in range(50):
+        score_sets = [
+            rng.integers(0, 4, size=rng.integers(0, 20)).astype(np.float32) for _ in range(rng.integers(1, 6))
+        ]
+        ks = [int(rng.integers(0, 25)) for _ in score_sets]
+        assert_batch_equal(scorer.top_k_batch(score_sets, ks), batch_reference(score_sets, ks))
+    assert scorer.top_k_batch([], 3) == []
+
+
+def test_softmax_top_k_ranks_raw_scores():
+    scorer = asyncio.run(CpuScorer.new())
+    assert scorer.compute_softmax_and_top_k([0.1, 5.0, 5.0, -2.0], 3) == [1, 2, 0]
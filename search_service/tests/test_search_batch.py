@@ -0,0 +1,60 @@
+import pytest
+
+PRODUCTS = """name,category,price
+apple pie,dessert,4
+apple tart,dessert,6
+cherry pie,dessert,5
+apple juice,drink,2
+green apple,fruit,1
+banana bread,dessert,3
+"""
+
+
+@pytest.fixture(scope="module")
+def datasets(service):
+    ids = []
+    for name, text in (("products", PRODUCTS), ("notes", "text\napple crumble recipe\nbanana split\napple apple\n")):
+        response = service.client.post("/upload", data={"dataset_name": name, "text_data": text})
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["dataset_id"])
+    return ids
+
+
+def queries(products, notes):
+    return [
+        {"query": "apple"},
+        {"query": "apple", "dataset_id": products},
+        {"query": "apple", "dataset_id": products, "top_k": 2},
+        {"query": "pie OR tart", "dataset_id": products, "filters": {"price": {"lt": 6}}},
+        {"query": "apple NOT juice", "dataset_id": products, "filters": {"category": "dessert"}},
+        {"query": "apple", "dataset_ids": [products, notes]},
+        {"query": "banana", "dataset_ids": [notes, products], "top_k": 1},
+        {"query": "apple pie", "dataset_id": products, "mode": "hybrid", "vector_weight": 0.3},
+        {"query": "apple crumble", "dataset_id": notes, "mode": "vector"},
+        {"query": "nothing matches this", "dataset_id": products},
+        {"query": "apple", "dataset_id": products, "include_documents": True, "fields": ["name", "price"]},
+    ]
+
+
+def test_batch_results_equal_single_searches(service, datasets):
+    items = queries(*datasets)
+    # Repeat a query to exercise in-batch de-duplication
+    items.append(items[1])
+    batch = service.client.post("/search/batch", json={"queries": items})
+    assert batch.status_code == 200, batch.text
+    results = batch.json()["results"]
+    assert len(results) == len(items)
+    for item, result in zip(items, results):
+        single = service.client.post("/search", json=item)
+        assert single.status_code == 200, single.text
+        expected = single.json()
+        assert result["results"] == expected["results"], item
+        assert result["scores"] == pytest.approx(expected["scores"]), item
+        assert result["total_found"] == expected["total_found"], item
+        assert result.get("documents") == expected.get("documents"), item
+
+
+def test_batch_rejects_too_many_queries(service):
+    limit = service.main.SEARCH_BATCH_MAX_QUERIES
+    response = service.client.post("/search/batch", json={"queries": [{"query": "apple"}] * (limit + 1)})
+    assert response.status_code == 400
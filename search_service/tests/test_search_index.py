@@ -0,0 +1,41 @@
+import numpy as np
+
+from search_index import InvertedIndex, tokenize
+
+
+def build(docs):
+    index = InvertedIndex()
+    index.add_many(docs.items())
+    return index
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Apple-Pie, apple PIE!") == ["apple", "pie", "apple", "pie"]
+
+
+def test_postings_hold_each_record_once_in_id_order():
+    index = build({3: "apple pie", 1: "apple apple tart", 2: "banana"})
+    assert index.posting("apple").tolist() == [1, 3]
+    assert index.posting("missing").tolist() == []
+    assert index.doc_freq("apple") == 2
+    assert index.doc_count == 3
+    assert index.total_len == 6
+    assert index.contains(2) and not index.contains(4)
+
+
+def test_bm25_prefers_higher_term_frequency_and_rarer_terms():
+    index = build({1: "apple pie", 2: "apple apple apple pie", 3: "cherry pie", 4: "banana"})
+    scores = index.score("apple", np.array([1, 2]))
+    assert scores[1] > scores[0] > 0
+    assert index.idf("cherry") > index.idf("pie")
+    # Candidates without the term score zero
+    assert index.score("cherry", np.array([1, 3])).tolist()[0] == 0
+
+
+def test_score_batch_matches_single_queries():
+    index = build({1: "apple pie", 2: "apple tart", 3: "cherry pie", 4: "pie pie"})
+    queries = ["apple", "pie", "apple pie"]
+    candidates = [np.array([1, 2]), np.array([1, 3, 4]), np.array([1, 2, 3, 4])]
+    batch = index.score_batch(queries, candidates)
+    for query, ids, scores in zip(queries, candidates, batch):
+        np.testing.assert_allclose(scores, index.score(query, ids))
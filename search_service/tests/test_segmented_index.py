@@ -0,0 +1,135 @@
+import random
+
+import numpy as np
+import pytest
+
+import search_index
+from search_index import MAX_SEGMENTS, InvertedIndex, SegmentedIndex
+
+WORDS = ["apple", "pie", "tart", "cherry", "banana", "bread", "crumble", "jam", "plum", "pear"]
+
+
+def build(docs):
+    index = InvertedIndex()
+    index.add_many(docs)
+    return index
+
+
+def assert_matches_rebuild(index, live):
+    """index must look exactly like an index built from scratch over the live records"""
+    rebuilt = build(sorted(live.items()))
+    assert index._live == index.doc_count == rebuilt.doc_count
+    assert index.total_len == rebuilt.total_len
+    assert index.all_ids().tolist() == sorted(live)
+    for term in WORDS + ["missing"]:
+        assert index.doc_freq(term) == rebuilt.doc_freq(term), term
+        assert index.posting(term).tolist() == rebuilt.posting(term).tolist(), term
+    ids = np.array(sorted(live), dtype=np.int64)
+    np.testing.assert_allclose(index.score("apple pie jam", ids), rebuilt.score("apple pie jam", ids), rtol=1e-6)
+    assert sorted(index.vocabulary().match("ap")) == sorted(rebuilt.vocabulary().match("ap"))
+
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+
+
+def test_append_delete_merge_matches_a_rebuild():
+    rng = random.Random(7)
+    live = {i: random_text(rng) for i in range(1, 201)}
+    index = SegmentedIndex(build(live.items()))
+    next_id = 201
+    for step in range(120):
+        if rng.random() < 0.55:
+            docs = {next_id + i: random_text(rng) for i in range(rng.randint(1, 30))}
+            next_id += len(docs) + rng.randint(0, 3)
+            assert index.add_segment(build(docs.items()))
+            live.update(docs)
+        else:
+            # Deleted ids include already-deleted and never-indexed ones
+            targets = rng.sample(range(1, next_id + 5), rng.randint(1, 25))
+            removed = index.delete(targets)
+            assert removed == len(set(targets) & set(live))
+            for doc_id in targets:
+                live.pop(doc_id, None)
+        assert index.segment_count <= MAX_SEGMENTS
+        assert_matches_rebuild(index, live)
+
+
+def test_delete_past_the_purge_ratio_rewrites_the_segment(monkeypatch):
+    monkeypatch.setattr(search_index, "TOMBSTONE_PURGE_RATIO", 0.2)
+    live = {i: f"apple {WORDS[i % len(WORDS)]}" for i in range(1, 101)}
+    index = SegmentedIndex(build(live.items()))
+    index.delete(range(1, 21))
+    # 20 of 100 is not past the ratio: the records are only tombstoned
+    assert index._tombstones[0].size == 20
+    assert index._segments[0].doc_count == 100
+    index.delete([21])
+    assert index._tombstones[0].size == 0
+    assert index._segments[0].doc_count == 79
+    for doc_id in range(1, 22):
+        live.pop(doc_id)
+    assert_matches_rebuild(index, live)
+
+
+def test_small_segments_merge_into_their_predecessor():
+    index = SegmentedIndex(build((i, "apple") for i in range(1, 101)))
+    assert index.add_segment(build([(101, "pie")]))
+    assert index.segment_count == 2
+    # A segment reaching half its predecessor's size is merged into it
+    assert index.add_segment(build((i, "tart") for i in range(102, 152)))
+    assert index.segment_count == 1
+    assert index.posting("apple").size == 100 and index.posting("tart").size == 50
+
+
+def test_deleting_every_record_empties_the_index():
+    live = {1: "apple pie", 2: "cherry tart"}
+    index = SegmentedIndex(build(live.items()))
+    index.add_segment(build([(3, "apple")]))
+    assert index.delete([1, 2, 3]) == 3
+    assert_matches_rebuild(index, {})
+    assert index.add_segment(build([(4, "plum")]))
+    assert_matches_rebuild(index, {4: "plum"})
+
+
+def test_already_indexed_segments_are_ignored():
+    index = SegmentedIndex(build([(1, "apple"), (2, "pie")]))
+    assert not index.add_segment(build([(2, "pie")]))
+    assert index.doc_count == 2 and index.doc_freq("pie") == 1
+
+
+def test_doc_freq_is_cached_per_segment_until_it_changes(monkeypatch):
+    index = SegmentedIndex(build((i, "apple pie") for i in range(1, 101)))
+    index.add_segment(build((i, "apple") for i in range(101, 111)))
+    assert index.segment_count == 2
+    lookups = []
+    for segment in index._segments:
+        original = segment._term_arrays
+        monkeypatch.setattr(segment, "_term_arrays", lambda term, original=original: lookups.append(term) or original(term))
+    assert index.doc_freq("apple") == 110 and lookups == ["apple", "apple"]
+    assert index.doc_freq("apple") == 110 and len(lookups) == 2
+    # A delete only drops the cached counts of the segment it tombstones
+    index.delete([105])
+    assert index.doc_freq("apple") == 109 and len(lookups) == 3
+    assert index.idf("apple") == pytest.approx(build((i, "apple") for i in range(1, 110)).idf("apple"))
+
+
+@pytest.mark.parametrize("delete_last", [True, False])
+def test_record_ids_are_not_reused_after_deletes(service, upload, delete_last):
+    client = service.client
+    dataset_id = upload("name\napple pie\ncherry tart\nplum jam\n")
+    ids = sorted(record["id"] for record in client.get(f"/datasets/{dataset_id}/records").json())
+    # Load the index, so the delete and the append are applied to it in place
+    assert client.post("/search", json={"query": "pie", "dataset_id": dataset_id}).json()["total_found"] == 1
+    deleted = ids[-1] if delete_last else ids[0]
+    response = client.post(f"/datasets/{dataset_id}/records/delete", json={"ids": [deleted]})
+    assert response.json()["deleted"] == 1
+
+    response = client.post(f"/datasets/{dataset_id}/append", data={"text_data": "name\nbanana bread\n"})
+    assert response.status_code == 200, response.text
+    records = client.get(f"/datasets/{dataset_id}/records").json()
+    new_id = max(record["id"] for record in records)
+    assert new_id > ids[-1]
+    assert deleted not in {record["id"] for record in records}
+    assert client.post("/search", json={"query": "banana", "dataset_id": dataset_id}).json()["results"] == [new_id]
+    vector = client.post("/search", json={"query": "banana bread", "dataset_id": dataset_id, "mode": "vector"}).json()
+    assert new_id in vector["results"]
@@ -0,0 +1,107 @@
+import sqlite3
+
+import pytest
+
+from shards import ShardSet
+
+
+def test_record_ids_are_strided_per_shard():
+    shards = ShardSet([None, None, None])
+    first, second, third = shards
+    assert list(shards.record_ids(first, None, 3)) == [3, 6, 9]
+    assert list(shards.record_ids(second, None, 3)) == [1, 4, 7]
+    assert list(shards.record_ids(third, 7, 2)) == [8, 11]
+    # Allocation continues past max_id on the shard's residue class
+    assert list(shards.record_ids(second, 7, 2)) == [10, 13]
+    assert list(shards.record_ids(second, 9, 1)) == [10]
+
+
+def test_records_and_datasets_route_by_modulo():
+    shards = ShardSet([None, None])
+    assert [shards.for_dataset(d).number for d in range(1, 5)] == [1, 0, 1, 0]
+    for shard in shards:
+        for record_id in shards.record_ids(shard, 40, 5):
+            assert shards.for_record(record_id) is shard
+    groups = shards.group_records([5, 2, 3, 8, 1])
+    assert {shard.number: ids for shard, ids in groups.items()} == {1: [5, 3, 1], 0: [2, 8]}
+
+
+@pytest.fixture(scope="module")
+def two_datasets(service):
+    """Two datasets uploaded back to back, so they land on different shards"""
+    ids = []
+    for name, text in (
+        ("fruit", "name,colour\napple pie,red\ngreen apple,green\nbanana,yellow\n"),
+        ("desserts", "name,colour\napple tart,gold\napple apple crumble,brown\ncherry pie,red\n"),
+    ):
+        response = service.client.post("/upload", data={"dataset_name": name, "text_data": text})
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["dataset_id"])
+    return ids
+
+
+def shard_record_ids(service, number, dataset_id):
+    path = service.workdir / f"documents.shard{number}.db"
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT id FROM datasetrecord WHERE dataset_id = ? ORDER BY id", (dataset_id,))]
+
+
+def test_datasets_live_in_their_shard_file(service, two_datasets):
+    assert service.main.SHARD_COUNT == 2
+    assert {dataset_id % 2 for dataset_id in two_datasets} == {0, 1}
+    for dataset_id in two_datasets:
+        records = service.client.get(f"/datasets/{dataset_id}/records").json()
+        ids = [record["id"] for record in records]
+        assert len(ids) == 3
+        assert all(record_id % 2 == dataset_id % 2 for record_id in ids)
+        assert shard_record_ids(service, dataset_id % 2, dataset_id) == ids
+        assert shard_record_ids(service, 1 - dataset_id % 2, dataset_id) == []
+    # The catalog stays in the main database, without records
+    with sqlite3.connect(service.workdir / "documents.db") as conn:
+        assert conn.execute("SELECT count(*) FROM userdataset WHERE id IN (?, ?)", two_datasets).fetchone() == (2,)
+        assert conn.execute("SELECT count(*) FROM datasetrecord").fetchone() == (0,)
+
+
+def test_fetch_records_of_both_shards_by_id(service, two_datasets):
+    ids = [
+        record["id"]
+        for dataset_id in two_datasets
+        for record in service.client.get(f"/datasets/{dataset_id}/records").json()
+    ]
+    body = service.client.post("/documents/batch", json={"ids": ids + [10 ** 9], "fields": ["name"]}).json()
+    assert [doc["id"] for doc in body["documents"]] == ids
+    assert body["missing"] == [10 ** 9]
+    for dataset_id in two_datasets:
+        own = service.client.post("/documents/batch", json={"ids": ids, "dataset_id": dataset_id}).json()
+        assert {doc["id"] % 2 for doc in own["documents"]} == {dataset_id % 2}
+        assert len(own["documents"]) == 3
+
+
+def test_search_across_shards_merges_by_score(service, two_datasets):
+    client = service.client
+    parts = [client.post("/search", json={"query": "apple", "dataset_id": d}).json() for d in two_datasets]
+    merged = client.post("/search", json={"query": "apple", "dataset_ids": two_datasets, "top_k": 3}).json()
+    expected = sorted(
+        ((score, doc_id) for part in parts for doc_id, score in zip(part["results"], part["scores"])),
+        key=lambda pair: -pair[0],
+    )[:3]
+    assert merged["scores"] == pytest.approx([score for score, _ in expected])
+    assert merged["scores"] == sorted(merged["scores"], reverse=True)
+    assert set(merged["results"]) <= {doc_id for part in parts for doc_id in part["results"]}
+    assert {doc_id % 2 for doc_id in merged["results"]} == {0, 1}
+    everything = client.post("/search", json={"query": "apple", "dataset_ids": two_datasets}).json()
+    assert everything["total_found"] == sum(part["total_found"] for part in parts) == 4
+
+
+def test_merged_bm25_scores_keep_per_dataset_statistics(service, upload):
+    client = service.client
+    # The same record text in a dataset where "apple" is rare and one where it is everywhere
+    rare = upload("name\napple\npear\nplum\nfig\n", "apple rare")
+    common = upload("name\napple\napple\napple\napple\n", "apple common")
+    parts = {d: client.post("/search", json={"query": "apple", "dataset_id": d}).json() for d in (rare, common)}
+    merged = client.post("/search", json={"query": "apple", "dataset_ids": [common, rare]}).json()
+    # Merged scores are the per-dataset ones, not rescored with statistics of both datasets
+    scores = {doc_id: score for part in parts.values() for doc_id, score in zip(part["results"], part["scores"])}
+    assert merged["scores"] == pytest.approx([scores[doc_id] for doc_id in merged["results"]])
+    assert merged["results"][0] == parts[rare]["results"][0]
+    assert parts[rare]["scores"][0] > max(parts[common]["scores"])
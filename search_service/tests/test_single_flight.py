@@ -0,0 +1,155 @@
+import asyncio
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Work:
+    """An awaitable computation that runs until released, counting its executions"""
+
+    def __init__(self, result="done", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight()
+        work = Work()
+        callers = [asyncio.ensure_future(flights.run("key", work)) for _ in range(3)]
+        await settle()
+        assert flights.stats()["in_flight"] == 1
+        work.release.set()
+        assert await asyncio.gather(*callers) == ["done"] * 3
+        assert work.calls == 1
+        stats = flights.stats()
+        assert (stats["executions"], stats["coalesced"], stats["in_flight"]) == (1, 2, 0)
+        assert stats["coalesced_rate"] == pytest.approx(2 / 3)
+
+        # Nothing is kept once the flight lands: the next call computes again
+        assert await flights.run("key", work) == "done"
+        assert work.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_different_keys_do_not_coalesce():
+    async def scenario():
+        flights = SingleFlight()
+        first, second = Work("a"), Work("b")
+        callers = [asyncio.ensure_future(flights.run(1, first)), asyncio.ensure_future(flights.run(2, second))]
+        await settle()
+        first.release.set()
+        second.release.set()
+        assert await asyncio.gather(*callers) == ["a", "b"]
+        assert flights.stats()["executions"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_every_caller_gets_the_exception():
+    async def scenario():
+        flights = SingleFlight()
+        work = Work(error=ValueError("boom"))
+        callers = [asyncio.ensure_future(flights.run("key", work)) for _ in range(2)]
+        await settle()
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        assert work.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_flight():
+    async def scenario():
+        flights = SingleFlight()
+        work = Work()
+        starter = asyncio.ensure_future(flights.run("key", work))
+        joiner = asyncio.ensure_future(flights.run("key", work))
+        await settle()
+        # The caller that started the computation goes away
+        starter.cancel()
+        await settle()
+        assert starter.cancelled()
+        work.release.set()
+        assert await joiner == "done"
+        assert work.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_a_flight_whose_callers_all_left_still_finishes(caplog):
+    async def scenario():
+        flights = SingleFlight()
+        work = Work(error=RuntimeError("nobody is listening"))
+        caller = asyncio.ensure_future(flights.run("key", work))
+        await settle()
+        caller.cancel()
+        await settle()
+        work.release.set()
+        await settle()
+        assert flights.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+    gc.collect()
+    # Its exception was retrieved, so asyncio does not report it as lost
+    assert "never retrieved" not in caplog.text
+
+
+def test_disabled_flights_run_every_call():
+    async def scenario():
+        flights = SingleFlight(enabled=False)
+        work = Work()
+        work.release.set()
+        assert await asyncio.gather(flights.run("key", work), flights.run("key", work)) == ["done", "done"]
+        assert work.calls == 2
+        assert flights.stats()["coalesced"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_identical_searches_execute_once(service, upload, monkeypatch):
+    main = service.main
+    dataset_id = upload("name\napple pie\napple tart\ncherry pie\n")
+    release = threading.Event()
+    original = main.search_documents_in_db
+
+    def slow_search(*args, **kwargs):
+        release.wait(10)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(main, "search_documents_in_db", slow_search)
+    before = main.search_flights.stats()
+    request = {"query": "apple", "dataset_id": dataset_id}
+    with ThreadPoolExecutor(2) as pool:
+        responses = [pool.submit(service.client.post, "/search", json=request) for _ in range(2)]
+        deadline = time.monotonic() + 10
+        while main.search_flights.stats()["coalesced"] == before["coalesced"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        bodies = [response.result().json() for response in responses]
+    after = main.search_flights.stats()
+    assert after["executions"] - before["executions"] == 1
+    assert after["coalesced"] - before["coalesced"] == 1
+    assert bodies[0] == bodies[1]
+    assert bodies[0]["total_found"] == 2
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import snapshot
+from search_index import InvertedIndex, SegmentedIndex
+from snapshot import MappedIndex, SnapshotError, load_snapshot, save_snapshot
+
+
+def build(docs):
+    index = InvertedIndex()
+    index.add_many(docs.items())
+    return index
+
+
+def assert_same_index(mapped, index):
+    assert sorted(mapped.terms()) == sorted(index.terms())
+    assert mapped.doc_count == index.doc_count
+    assert mapped.total_len == index.total_len
+    for term in index.terms():
+        assert mapped.posting(term).tolist() == index.posting(term).tolist()
+    ids = index.all_ids()
+    np.testing.assert_allclose(mapped.score("apple pie", ids), index.score("apple pie", ids))
+
+
+@pytest.mark.parametrize("mapped", [True, False])
+def test_save_and_load_round_trip(tmp_path, monkeypatch, mapped):
+    monkeypatch.setattr(snapshot, "MAP_SNAPSHOTS", mapped)
+    documents = build({1: "apple pie", 2: "cherry pie", 5: "apple apple tart", 9: "crème brûlée"})
+    dataset = SegmentedIndex(build({10: "apple", 12: "pie crust"}))
+    dataset.add_segment(build({14: "apple pie"}))
+    dataset.delete([12])
+    path = str(tmp_path / "index.bin")
+
+    save_snapshot(path, [(None, documents, [4, 9]), (3, dataset, [2, 14, 1])])
+    sections = load_snapshot(path)
+
+    assert set(sections) == {None, 3}
+    assert isinstance(sections[None][0], MappedIndex)
+    assert sections[None][1] == [4, 9]
+    assert sections[3][1] == [2, 14, 1]
+    assert_same_index(sections[None][0], documents)
+    assert_same_index(sections[3][0], dataset)
+    assert sections[3][0].posting("pie").tolist() == [14]
+
+    # A new snapshot replaces the file while the old sections are still being read
+    save_snapshot(path, [(None, build({1: "banana"}), [1, 1])])
+    assert sections[None][0].posting("apple").tolist() == [1, 5]
+    assert load_snapshot(path)[None][0].posting("banana").tolist() == [1]
+
+
+def test_corrupt_snapshots_are_rejected(tmp_path):
+    path = tmp_path / "index.bin"
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(path))
+    save_snapshot(str(path), [(None, build({1: "apple"}), [1, 1])])
+    path.write_bytes(path.read_bytes()[:-4])
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(path))
+
+
+def test_stale_fingerprint_forces_a_rebuild(service, upload):
+    main = service.main
+    fresh = upload("name\napple pie\napple tart\n")
+    stale = upload("name\ncherry pie\n")
+    for dataset_id in (fresh, stale):
+        main.get_search_index(dataset_id)
+    main.save_index_snapshot()
+
+    # The stale dataset changes after the snapshot was taken
+    response = service.client.post(f"/datasets/{stale}/append", data={"text_data": "name\ncherry tart\n"})
+    assert response.status_code == 200, response.text
+    for dataset_id in (fresh, stale):
+        main.search_indexes.remove(dataset_id)
+    main.restore_index_snapshot()
+
+    assert isinstance(main.search_indexes.get(fresh), MappedIndex)
+    assert main.search_indexes.get(stale) is None
+    body = service.client.post("/search", json={"query": "cherry", "dataset_id": stale}).json()
+    assert body["total_found"] == 2
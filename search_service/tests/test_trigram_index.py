@@ -0,0 +1,93 @@
+import fnmatch
+import random
+
+import numpy as np
+import pytest
+
+from trigram_index import TrigramIndex, auto_distance, code_points, edit_distances
+
+VOCABULARY = [
+    "apple", "apples", "ample", "maple", "staple", "purple", "people", "apply", "ape", "applet",
+    "pineapple", "grape", "grapple", "ale", "axe", "a", "ab", "new", "york", "yorkshire", "newyork",
+    "crème", "brûlée", "naïve", "straße", "banana", "bandana", "cabana", "e",
+]
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+@pytest.fixture(scope="module")
+def vocabulary():
+    return TrigramIndex(VOCABULARY)
+
+
+def test_vectorized_edit_distances_match_the_reference():
+    rng = random.Random(3)
+    alphabet = "abcdeé"
+    for length in range(1, 7):
+        terms = ["".join(rng.choice(alphabet) for _ in range(length)) for _ in range(40)]
+        codes = code_points("".join(terms)).reshape(len(terms), length)
+        for word in ("", "a", "abc", "ébé", "abcdeab", "eeeeee"):
+            expected = [levenshtein(word, term) for term in terms]
+            assert edit_distances(codes, word).tolist() == expected, (word, length)
+
+
+@pytest.mark.parametrize("word", ["aple", "apple", "grape", "yrok", "banan", "creme", "strasse", "x", "ab", "peopel"])
+@pytest.mark.parametrize("distance", [0, 1, 2])
+def test_fuzzy_matches_brute_force(vocabulary, word, distance):
+    expected = sorted(
+        ((term, levenshtein(word, term)) for term in VOCABULARY if levenshtein(word, term) <= distance),
+        key=lambda m: (m[1], m[0]),
+    )
+    if distance == 0:
+        expected = [(word, 0)] if word in VOCABULARY else []
+    assert vocabulary.fuzzy(word, distance) == expected
+
+
+@pytest.mark.parametrize("pattern", ["*ple", "a*e", "app*", "*app*", "a*p*e", "gr*pe", "ap*le*", "*e", "b*n*a", "*ï*"])
+def test_match_pattern_matches_fnmatch(vocabulary, pattern):
+    expected = [term for term in VOCABULARY if fnmatch.fnmatchcase(term, pattern)]
+    assert sorted(vocabulary.match_pattern(pattern)) == sorted(expected)
+
+
+def test_wildcard_pieces_may_not_overlap():
+    # "aba" starts with "ab" and ends with "ba", but has no room for both
+    assert TrigramIndex(["aba", "abba"]).match_pattern("ab*ba") == ["abba"]
+
+
+@pytest.mark.parametrize("fragment", ["ple", "pp", "e", "ork", "york", "ana", "rû", "zzz"])
+@pytest.mark.parametrize("prefix, suffix", [(False, False), (True, False), (False, True), (True, True)])
+def test_match_matches_brute_force(vocabulary, fragment, prefix, suffix):
+    def keep(term):
+        return (
+            fragment in term
+            and (not prefix or term.startswith(fragment))
+            and (not suffix or term.endswith(fragment))
+            and (not (prefix and suffix) or term == fragment)
+        )
+
+    assert sorted(vocabulary.match(fragment, prefix, suffix)) == sorted(t for t in VOCABULARY if keep(t))
+
+
+def test_terms_added_later_are_found():
+    index = TrigramIndex(["apple"])
+    index.fuzzy("aple", 1)
+    index.add(["maple", "apple"])
+    assert len(index) == 2
+    assert index.fuzzy("aple", 1) == [("apple", 1), ("maple", 1)]
+    assert index.match_pattern("*ple") == ["apple", "maple"]
+
+
+def test_auto_distance_grows_with_length():
+    assert [auto_distance(t) for t in ("ab", "abc", "abcde", "abcdef")] == [0, 1, 1, 2]
+
+
+def test_edit_distances_of_an_empty_group():
+    assert edit_distances(np.zeros((0, 3), dtype=np.uint32), "abc").size == 0
@@ -0,0 +1,311 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import vector_store
+from search_index import tokenize
+from vector_store import HashedNgramEmbedder, VectorStore, make_embedder
+
+MASK = 0xFFFFFFFF
+
+
+def reference_embedding(text, dim, ngrams=(3, 4)):
+    """The embedder's hashing, one n-gram at a time in plain Python"""
+    padded = f" {' '.join(tokenize(text))} "
+    counts = np.zeros(dim)
+    for n in ngrams:
+        for start in range(len(padded) - n + 1):
+            h = 0
+            for char in padded[start:start + n]:
+                h = (h * 0x01000193 + ord(char)) & MASK if h else ord(char)
+            spread = ((h + n) * 0x9E3779B1) & MASK
+            bucket = ((spread >> 16) * dim & MASK) >> 16
+            counts[bucket] += -1 if (spread >> 15) & 1 else 1
+    vector = np.sign(counts) * np.log1p(np.abs(counts))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+TEXTS = ["apple pie", "Apple, PIE!", "", "ab", "crème brûlée", "a much longer text about apples and pears", "x y"]
+
+
+def test_embedder_matches_the_reference():
+    embedder = HashedNgramEmbedder(dim=64)
+    vectors = embedder(TEXTS)
+    assert vectors.shape == (len(TEXTS), 64) and vectors.dtype == np.float32
+    for text, vector in zip(TEXTS, vectors):
+        np.testing.assert_allclose(vector, reference_embedding(text, 64), atol=1e-6)
+
+
+def test_embedder_rows_are_unit_or_zero_and_independent_of_the_batch():
+    embedder = HashedNgramEmbedder()
+    vectors = embedder(TEXTS)
+    norms = np.linalg.norm(vectors, axis=1)
+    assert norms[2] == 0
+    np.testing.assert_allclose(np.delete(norms, 2), 1, rtol=1e-5)
+    # N-grams never run from one text into the next
+    for text, vector in zip(TEXTS, vectors):
+        np.testing.assert_allclose(embedder([text])[0], vector, atol=1e-6)
+    np.testing.assert_array_equal(vectors[0], vectors[1])
+    assert embedder([]).shape == (0, embedder.dim)
+
+
+def test_near_spellings_embed_closer_than_other_words():
+    embedder = HashedNgramEmbedder()
+    apple, typo, other = embedder(["apple crumble", "aple crumbles", "banana bread"])
+    assert apple @ typo > 0.5 > apple @ other
+
+
+def test_unknown_embedders_and_bad_dimensions_are_refused():
+    with pytest.raises(ValueError):
+        make_embedder("word2vec", 64)
+    with pytest.raises(ValueError):
+        HashedNgramEmbedder(dim=0)
+
+
+WORDS = ["apple pie", "apple tart", "cherry pie", "banana bread", "green apple", "plum jam", "pear cake", "fig roll"]
+
+
+def pages(ids, size=3):
+    rows = [(doc_id, WORDS[doc_id % len(WORDS)]) for doc_id in ids]
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+
+@pytest.fixture(params=[True, False], ids=["mapped", "in-memory"])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "MAP_VECTORS", request.param)
+    return VectorStore(str(tmp_path / "vectors"), HashedNgramEmbedder(dim=32))
+
+
+def expected_vectors(store, ids):
+    return store.embed([WORDS[doc_id % len(WORDS)] for doc_id in ids])
+
+
+def test_build_search_and_reopen(store):
+    ids = list(range(1, 9))
+    matrix = store.build(3, pages(ids), "v1")
+    assert matrix.rows == matrix.live_count == 8
+    assert isinstance(matrix.vectors, np.memmap) == vector_store.MAP_VECTORS
+    np.testing.assert_allclose(matrix.vectors, expected_vectors(store, ids), atol=1e-6)
+
+    query = store.embed_query("apple pie")
+    found, scores = matrix.search(query, 3)
+    assert found[0] == 8 and scores[0] == pytest.approx(1)  # 8 % 8 == 0: "apple pie"
+    assert list(scores) == sorted(scores, reverse=True)
+    found, _ = matrix.search(query, 8, np.array([2, 3, 40], dtype=np.int64))
+    assert sorted(found) == [2, 3]
+    np.testing.assert_allclose(matrix.similarities(query, np.array([8, 40])), [1, 0], atol=1e-6)
+
+    reopened = VectorStore(store.directory, HashedNgramEmbedder(dim=32)).open(3, "v1")
+    np.testing.assert_array_equal(reopened.ids, ids)
+    np.testing.assert_array_equal(reopened.vectors, matrix.vectors)
+
+
+def test_files_of_another_fingerprint_or_embedder_are_discarded(store):
+    store.build(None, pages([1, 2]), "v1")
+    assert VectorStore(store.directory, HashedNgramEmbedder(dim=16)).open(None, "v1") is None
+    assert not os.path.exists(store.path(None) + ".f32")
+    store.build(None, pages([1, 2]), "v1")
+    assert store.open(None, "v2") is None
+    assert store.get(None) is None
+
+
+def test_appends_extend_the_matrix(store):
+    base = store.build(1, pages([1, 2, 3]), "v1")
+    writer = store.writer(1, base)
+    writer.add([5, 7], ["plum jam", "fig roll"])
+    matrix = writer.commit("v2")
+    np.testing.assert_array_equal(matrix.ids, [1, 2, 3, 5, 7])
+    np.testing.assert_allclose(matrix.vectors, expected_vectors(store, [1, 2, 3, 5, 7]), atol=1e-6)
+    # The matrix published before the append still reads its own rows
+    np.testing.assert_allclose(base.vectors, expected_vectors(store, [1, 2, 3]), atol=1e-6)
+
+
+def test_an_aborted_append_leaves_bytes_the_next_append_drops(store):
+    base = store.build(1, pages([1, 2]), "v1")
+    writer = store.writer(1, base)
+    writer.add([3, 4], ["cherry pie", "banana bread"])
+    writer.abort()
+    assert os.path.getsize(store.path(1) + ".ids") == 4 * 8
+    assert store.open(1, "v1").rows == 2
+    writer = store.writer(1, store.open(1, "v1"))
+    writer.add([9], ["green apple"])
+    matrix = writer.commit("v2")
+    np.testing.assert_array_equal(matrix.ids, [1, 2, 9])
+    assert os.path.getsize(store.path(1) + ".ids") == 3 * 8
+
+
+def test_ids_out_of_order_make_the_collection_rebuild(store):
+    base = store.build(1, pages([1, 4]), "v1")
+    writer = store.writer(1, base)
+    writer.add([3], ["cherry pie"])
+    assert writer.commit("v2") is None
+    assert store.get(1) is None and not os.path.exists(store.path(1) + ".json")
+
+
+def test_deletes_are_tombstoned_then_compacted(store):
+    ids = list(range(1, 11))
+    store.build(2, pages(ids), "v1")
+    store.delete(2, [2, 4, 99], "v2")
+    matrix = store.get(2)
+    assert (matrix.rows, matrix.live_count) == (10, 8)
+    assert os.path.getsize(store.path(2) + ".deleted") == 2 * 8
+    assert 4 not in matrix.live_ids() and 4 not in matrix.search(store.embed_query(WORDS[4]), 10)[0]
+    # Tombstones survive a reopen
+    reopened = VectorStore(store.directory, HashedNgramEmbedder(dim=32)).open(2, "v2")
+    np.testing.assert_array_equal(reopened.live_ids(), [1, 3, 5, 6, 7, 8, 9, 10])
+    # Deleting ids that are already gone only moves the fingerprint along
+    store.delete(2, [2, 4], "v3")
+    assert store.open(2, "v3").live_count == 8
+
+    before = store.get(2)
+    store.delete(2, [1, 3, 5, 6], "v4")
+    compacted = store.get(2)
+    live = [7, 8, 9, 10]
+    assert compacted.rows == compacted.live_count == 4
+    assert not os.path.exists(store.path(2) + ".deleted")
+    assert os.path.getsize(store.path(2) + ".ids") == 4 * 8
+    np.testing.assert_array_equal(compacted.ids, live)
+    np.testing.assert_allclose(compacted.vectors, expected_vectors(store, live), atol=1e-6)
+    # A reader still holding the matrix from before the compaction sees its rows unchanged
+    np.testing.assert_allclose(before.vectors, expected_vectors(store, ids), atol=1e-6)
+
+    store.delete(2, live, "v5")
+    assert store.get(2).rows == 0 and store.get(2).search(store.embed_query("apple"), 3)[0].size == 0
+
+
+def test_compaction_chunks_match_a_single_pass(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "COMPACT_CHUNK_ROWS", 3)
+    ids = list(range(1, 12))
+    store.build(1, pages(ids, size=4), "v1")
+    store.delete(1, ids[::2], "v2")
+    np.testing.assert_array_equal(store.get(1).ids, ids[1::2])
+    np.testing.assert_allclose(store.get(1).vectors, expected_vectors(store, ids[1::2]), atol=1e-6)
+
+
+def test_a_staged_build_leaves_the_collection_alone_until_commit(store):
+    old = store.build(1, pages([1, 2]), "v1")
+    writer = store.stage(1, pages([1, 2, 3]))
+    reader = VectorStore(store.directory, HashedNgramEmbedder(dim=32))
+    np.testing.assert_array_equal(reader.open(1, "v1").ids, [1, 2])
+    # A writer finding the files stale removes them meanwhile; the staged rows are not touched
+    store.remove(1)
+    matrix = writer.commit("v2")
+    np.testing.assert_array_equal(matrix.ids, [1, 2, 3])
+    np.testing.assert_allclose(old.vectors, expected_vectors(store, [1, 2]), atol=1e-6)
+    store.stage(1, pages([4, 5])).abort()
+    np.testing.assert_array_equal(store.open(1, "v2").ids, [1, 2, 3])
+    assert not [name for name in os.listdir(store.directory) if name.endswith(vector_store.STAGED)]
+
+
+def test_remove_forgets_the_collection(store):
+    store.build(4, pages([1, 2]), "v1")
+    store.remove(4)
+    assert store.get(4) is None
+    assert not any(name.startswith("dataset4.") for name in os.listdir(store.directory))
+
+
+FOODS = "name\napple pie\napple crumble\ncherry pie\nbanana bread\nzzz qqq\nplum jam with apples\n"
+
+
+@pytest.fixture
+def foods(service, upload):
+    return upload(FOODS, "foods")
+
+
+def search(service, dataset_id, query, **options):
+    body = {"query": query, "dataset_id": dataset_id, "top_k": 50, **options}
+    response = service.client.post("/search", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def record_similarities(main, dataset_id, query):
+    matrix = main.get_vectors(dataset_id)
+    ids = matrix.live_ids()
+    return dict(zip(ids.tolist(), matrix.similarities(main.vector_store.embed_query(query), ids).tolist()))
+
+
+def test_datasets_are_embedded_on_their_first_vector_search(service, foods):
+    assert service.main.EMBED_ON_INGEST is False
+    meta = service.workdir / "vectors" / f"dataset{foods}.json"
+    assert not meta.exists()
+    search(service, foods, "apple", mode="vector")
+    assert meta.exists()
+
+
+def test_vector_results_are_the_positive_similarities(service, foods):
+    similarities = record_similarities(service.main, foods, "apple pie")
+    body = search(service, foods, "apple pie", mode="vector")
+    expected = sorted(((score, doc_id) for doc_id, score in similarities.items() if score > 0), reverse=True)
+    assert body["results"] == [doc_id for _, doc_id in expected]
+    assert body["scores"] == pytest.approx([score for score, _ in expected])
+    assert all(score > 0 for score in body["scores"])
+    assert len(body["results"]) < len(similarities)
+
+
+@pytest.mark.parametrize("weight", [0.0, 0.3, 1.0])
+def test_hybrid_scores_fuse_scaled_bm25_and_cosine(service, foods, weight):
+    main = service.main
+    query = "apple pie"
+    lexical_ids, terms = main.search_documents_in_db(query, foods, [])
+    index = main.get_search_index(foods)
+    bm25 = dict(zip(lexical_ids, index.score(terms, np.asarray(lexical_ids)).tolist()))
+    top = max(bm25.values())
+    similarities = record_similarities(main, foods, query)
+    candidates = set(lexical_ids) | {doc_id for doc_id, score in similarities.items() if score > 0}
+    fused = {
+        doc_id: (1 - weight) * bm25.get(doc_id, 0) / top + weight * max(similarities[doc_id], 0)
+        for doc_id in candidates
+    }
+    body = search(service, foods, query, mode="hybrid", vector_weight=weight)
+    assert sorted(body["results"]) == sorted(candidates)
+    assert body["scores"] == pytest.approx([fused[doc_id] for doc_id in body["results"]], abs=1e-6)
+    assert body["scores"] == sorted(body["scores"], reverse=True)
+
+
+def test_writes_go_on_while_a_dataset_is_embedded(service, upload, monkeypatch):
+    main = service.main
+    dataset_id = upload("name\napple pie\ncherry pie\n", "cold")
+    original = main.record_text_pages
+    builds = []
+
+    def append_while_embedding(key):
+        builds.append(key)
+        if len(builds) == 1:
+            # Would wait forever if the build held the dataset's write lock
+            writer = threading.Thread(target=main.append_to_dataset, args=(dataset_id, "name\napple crumble\n"))
+            writer.start()
+            writer.join(10)
+            assert not writer.is_alive()
+        return original(key)
+
+    monkeypatch.setattr(main, "record_text_pages", append_while_embedding)
+    matrix = main.get_vectors(dataset_id)
+    # The first build raced the append, so it was thrown away and redone
+    assert builds == [dataset_id, dataset_id]
+    assert matrix.live_count == 3
+    assert matrix.fingerprint == main.dataset_fingerprint(dataset_id)
+    assert main.get_vectors(dataset_id) is matrix
+
+
+def test_builds_racing_writes_finally_hold_them_off(service, upload, monkeypatch):
+    main = service.main
+    dataset_id = upload("name\napple pie\n", "busy")
+    original = main.record_text_pages
+    builds = []
+
+    def append_every_time(key):
+        builds.append(key)
+        if len(builds) <= main.VECTOR_BUILD_ATTEMPTS:
+            writer = threading.Thread(target=main.append_to_dataset, args=(dataset_id, f"name\nextra {len(builds)}\n"))
+            writer.start()
+            writer.join(10)
+        return original(key)
+
+    monkeypatch.setattr(main, "record_text_pages", append_every_time)
+    matrix = main.get_vectors(dataset_id)
+    assert len(builds) == main.VECTOR_BUILD_ATTEMPTS + 1
+    assert matrix.live_count == 1 + main.VECTOR_BUILD_ATTEMPTS
@@ -0,0 +1,189 @@
+"""
+Character-trigram index over a search index's vocabulary.
+
+Every indexed term is padded with boundary markers and split into trigrams
+(``york`` -> ``^yo``, ``yor``, ``ork``, ``rk$``), each mapping to a sorted
+array of term ids. Substring, prefix and suffix patterns intersect the
+postings of the pattern's trigrams; fuzzy lookups use the q-gram lemma (a term
+within edit distance k of a word shares all but at most 3k of its trigrams) to
+count-filter candidates. Only the few surviving terms are verified, so both
+cost the size of the matching vocabulary rather than a scan of every term,
+let alone every record. The matching terms are then looked up in the
+inverted index as usual.
+"""
+
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+START, END = "\x02", "\x03"
+# Levenshtein distance used by ``term~`` without an explicit distance, by term length
+AUTO_DISTANCES = ((2, 0), (5, 1))
+MAX_DISTANCE = 2
+
+
+def trigrams(text: str) -> List[str]:
+    return [text[i:i + 3] for i in range(len(text) - 2)]
+
+
+def auto_distance(term: str) -> int:
+    """Lucene-style AUTO fuzziness: exact for short terms, up to 2 edits for long ones"""
+    for max_len, distance in AUTO_DISTANCES:
+        if len(term) <= max_len:
+            return distance
+    return MAX_DISTANCE
+
+
+def code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def edit_distances(codes: np.ndarray, word: str) -> np.ndarray:
+    """Levenshtein distance from word to each row of an (n, length) code point matrix
+
+    One DP row is computed for all terms at once; the insertion recurrence
+    cur[j] = min(cur[j - 1] + 1, ...) is a running minimum of cur[j] - j.
+    """
+    count, length = codes.shape
+    steps = np.arange(length + 1)
+    previous = np.broadcast_to(steps, (count, length + 1))
+    for i, char in enumerate(code_points(word), 1):
+        best = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + (codes != char))
+        row = np.concatenate([np.full((count, 1), i), best], axis=1)
+        previous = np.minimum.accumulate(row - steps, axis=1) + steps
+    return previous[:, length]
+
+
+class TrigramIndex:
+    """Trigram -> term ids over a growing vocabulary"""
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self.terms: List[str] = []
+        self._term_ids: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._arrays: Dict[str, np.ndarray] = {}
+        # Term length -> (term ids, code point matrix), for vectorized edit distances
+        self._by_length: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None
+        self._lock = threading.Lock()
+        self.add(terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def add(self, terms: Iterable[str]) -> None:
+        """Index terms not seen before; ids only grow, so postings stay sorted"""
+        with self._lock:
+            for term in terms:
+                if term in self._term_ids:
+                    continue
+                term_id = self._term_ids[term] = len(self.terms)
+                self.terms.append(term)
+                self._by_length = None
+                for gram in set(trigrams(START + term + END)):
+                    self._postings.setdefault(gram, []).append(term_id)
+                    self._arrays.pop(gram, None)
+
+    def _posting(self, gram: str) -> np.ndarray:
+        posting = self._arrays.get(gram)
+        if posting is None:
+            posting = self._arrays[gram] = np.array(self._postings.get(gram, ()), dtype=np.int64)
+        return posting
+
+    def _length_groups(self) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        if self._by_length is None:
+            ids_by_length: Dict[int, List[int]] = {}
+            for term_id, term in enumerate(self.terms):
+                ids_by_length.setdefault(len(term), []).append(term_id)
+            self._by_length = {
+                length: (
+                    np.array(ids, dtype=np.int64),
+                    code_points("".join(self.terms[i] for i in ids)).reshape(len(ids), length),
+                )
+                for length, ids in ids_by_length.items()
+            }
+        return self._by_length
+
+    def _candidates(self, grams: List[str]) -> Optional[np.ndarray]:
+        """Term ids holding every trigram, rarest first; None when there are no trigrams to filter on"""
+        if not grams:
+            return None
+        postings = sorted((self._posting(gram) for gram in set(grams)), key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if result.size == 0:
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        return result
+
+    def match(self, fragment: str, prefix: bool = False, suffix: bool = False) -> List[str]:
+        """Terms containing fragment; anchored at the start (prefix) and/or end (suffix) of the term"""
+        if prefix and suffix:
+            return [fragment] if fragment in self._term_ids else []
+        padded = (START if prefix else "") + fragment + (END if suffix else "")
+        with self._lock:
+            ids = self._candidates(trigrams(padded))
+            # Fragments too short for a trigram fall back to scanning the vocabulary
+            terms = self.terms if ids is None else [self.terms[i] for i in ids.tolist()]
+        if prefix:
+            return [t for t in terms if t.startswith(fragment)]
+        if suffix:
+            return [t for t in terms if t.endswith(fragment)]
+        return [t for t in terms if fragment in t]
+
+    def match_pattern(self, pattern: str) -> List[str]:
+        """Terms matching a pattern where ``*`` stands for any run of characters"""
+        pieces = pattern.split("*")
+        grams = []
+        for i, piece in enumerate(pieces):
+            grams.extend(trigrams((START if i == 0 else "") + piece + (END if i == len(pieces) - 1 else "")))
+        with self._lock:
+            ids = self._candidates(grams)
+            terms = self.terms if ids is None else [self.terms[i] for i in ids.tolist()]
+        return [t for t in terms if _glob_match(t, pieces)]
+
+    def fuzzy(self, word: str, distance: int) -> List[Tuple[str, int]]:
+        """(term, edit distance) for every term within distance of word, closest first"""
+        if distance <= 0:
+            return [(word, 0)] if word in self._term_ids else []
+        grams = list(set(trigrams(START + word + END)))
+        # q-gram lemma: each edit destroys at most 3 of the word's trigrams. Short
+        # words have too few trigrams to filter on, and only the length filter applies
+        needed = len(grams) - 3 * distance
+        matches = []
+        with self._lock:
+            candidates = None
+            if needed > 0:
+                ids, counts = np.unique(np.concatenate([self._posting(gram) for gram in grams]), return_counts=True)
+                candidates = ids[counts >= needed]
+            groups = self._length_groups()
+            for length in range(max(len(word) - distance, 1), len(word) + distance + 1):
+                if length not in groups:
+                    continue
+                ids, codes = groups[length]
+                if candidates is not None:
+                    keep = np.isin(ids, candidates, assume_unique=True)
+                    ids, codes = ids[keep], codes[keep]
+                if ids.size == 0:
+                    continue
+                distances = edit_distances(codes, word)
+                close = distances <= distance
+                matches.extend(zip((self.terms[i] for i in ids[close].tolist()), distances[close].tolist()))
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches
+
+
+def _glob_match(term: str, pieces: List[str]) -> bool:
+    """Whether term matches pieces joined by ``*`` wildcards"""
+    if len(pieces) == 1:
+        return term == pieces[0]
+    first, last = pieces[0], pieces[-1]
+    if not term.startswith(first) or not term.endswith(last) or len(term) < len(first) + len(last):
+        return False
+    pos, end = len(first), len(term) - len(last)
+    for piece in pieces[1:-1]:
+        found = term.find(piece, pos, end)
+        if found < 0:
+            return False
+        pos = found + len(piece)
+    return True
@@ -0,0 +1,439 @@
+"""
+Dense-vector retrieval over memory-mapped float32 embedding matrices.
+
+The records of a searchable collection (the built-in documents, or one user
+dataset) are embedded once, when they are written, by a local embedding
+function, and appended to a float32 matrix file that is memory-mapped for
+search. Rows are unit length, so scoring a query is one embedding, one
+matrix-vector product (cosine similarity against every row) and an
+argpartition top-k.
+
+Files per collection, in the store directory::
+
+    <name>.f32      embeddings, rows x dim float32, row-major
+    <name>.ids      record id of each row, int64, ascending
+    <name>.deleted  ids of rows deleted since they were written, int64
+    <name>.json     embedder, dim, row and deletion counts, and the DB
+                    fingerprint the files reflect
+
+Data files are only appended to (until a compaction rewrites them) and the
+JSON is replaced after the data is written, so an interrupted write leaves at
+most trailing bytes that the counts exclude. A collection embedded afresh is
+written to ``.staged`` files first and renamed into place when it is published. Files whose fingerprint or
+embedder does not match are discarded, and the collection is embedded again
+from the database.
+
+Windows cannot truncate, replace or delete a file while it is mapped, so
+there (see MAP_VECTORS) the rows are read into memory instead; elsewhere
+readers that still map replaced files keep their pages.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from scoring import top_k_indices
+from search_index import tokenize
+
+# A collection: a dataset id, or None for the built-in documents
+Key = Optional[int]
+# Texts -> (len(texts), dim) float32 matrix of unit (or zero) rows
+Embedder = Callable[[Sequence[str]], np.ndarray]
+
+# Rows copied at a time when a compaction rewrites the live rows
+COMPACT_CHUNK_ROWS = 65536
+
+# Windows cannot resize, replace or delete a mapped file (see the module docstring)
+MAP_VECTORS = os.name != "nt"
+
+# Suffix of the files a collection embedded afresh is written to before it is published
+STAGED = ".staged"
+
+# 32-bit FNV prime for the n-gram polynomial, golden-ratio multiplier to spread it
+_PRIME = np.uint32(0x01000193)
+_SPREAD = np.uint32(0x9E3779B1)
+_HALF, _SIGN_BIT, _ONE = np.uint32(16), np.uint32(15), np.uint32(1)
+
+
+class HashedNgramEmbedder:
+    """Signed feature hashing of the character n-grams of a text's tokens
+
+    Texts are tokenized as the inverted index does, rejoined with single
+    spaces, and every n-gram (spaces included, so word boundaries count) is
+    hashed to one of ``dim`` buckets with a +/-1 sign. Counts are dampened
+    with log1p and rows scaled to unit length. Needs no model or network,
+    and texts that share words or word pieces (inflections, typos) get
+    similar vectors. A whole batch is hashed with a few array operations.
+    """
+
+    name = "hashed-ngrams"
+
+    def __init__(self, dim: int = 256, ngrams: Sequence[int] = (3, 4)):
+        if not 0 < dim <= 1 << 16:
+            raise ValueError("dim must be between 1 and 65536")
+        self.dim = dim
+        self.ngrams = tuple(ngrams)
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        count, dim = len(texts), self.dim
+        if count == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+        padded = [f" {' '.join(tokenize(text))} " for text in texts]
+        codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32)
+        lengths = np.fromiter(map(len, padded), dtype=np.int64, count=count)
+        ends = np.cumsum(lengths)
+        # Features are counted per (row, bucket, sign) slot; one extra slot collects the discarded
+        row_slots = np.repeat(np.arange(count, dtype=np.int64) * (2 * dim), lengths)
+        discard = count * dim * 2
+        slots = [np.empty(0, dtype=np.int64)]
+        h = None
+        for n in range(1, max(self.ngrams) + 1):
+            positions = codes.size - n + 1
+            if positions <= 0:
+                break
+            # Polynomial hash of the n characters starting at each position, wrapping at 32 bits
+            h = codes.copy() if h is None else h[:positions] * _PRIME + codes[n - 1:]
+            if n not in self.ngrams:
+                continue
+            spread = (h + np.uint32(n)) * _SPREAD
+            # Bucket from the high 16 bits (multiply-shift range reduction), sign from the next bit
+            bucket = ((spread >> _HALF) * np.uint32(dim)) >> _HALF
+            slot = row_slots[:positions] + bucket.astype(np.int64) * 2 + ((spread >> _SIGN_BIT) & _ONE)
+            # N-grams starting in the last n - 1 characters of a text run into the next one
+            straddling = (ends[:, None] - np.arange(1, n)).ravel()
+            slot[straddling[(straddling >= 0) & (straddling < positions)]] = discard
+            slots.append(slot)
+        counts = np.bincount(np.concatenate(slots), minlength=discard + 1)[:discard].reshape(count, dim, 2)
+        vectors = (counts[:, :, 0] - counts[:, :, 1]).astype(np.float32)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+# Embedders selectable by name; any callable with the Embedder signature and a name and dim works
+EMBEDDERS: Dict[str, Callable[[int], Embedder]] = {
+    HashedNgramEmbedder.name: HashedNgramEmbedder,
+}
+
+
+def make_embedder(name: str, dim: int) -> Embedder:
+    if name not in EMBEDDERS:
+        raise ValueError(f"Unknown embedder '{name}' (available: {', '.join(EMBEDDERS)})")
+    return EMBEDDERS[name](dim)
+
+
+class VectorMatrix:
+    """One collection's embedding rows, mapped read-only; deleted rows are masked out"""
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray, deleted: np.ndarray, fingerprint: Any):
+        self.ids = ids
+        self.vectors = vectors
+        self.deleted = deleted
+        self.fingerprint = fingerprint
+        self.live = ~np.isin(ids, deleted) if deleted.size else None
+
+    @property
+    def rows(self) -> int:
+        return self.ids.size
+
+    @property
+    def live_count(self) -> int:
+        return self.rows if self.live is None else int(self.live.sum())
+
+    def live_ids(self) -> np.ndarray:
+        return self.ids if self.live is None else self.ids[self.live]
+
+    def _rows_of(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(row numbers, mask over ids) for the ids that have a live row"""
+        rows = np.searchsorted(self.ids, ids)
+        found = rows < self.ids.size
+        found[found] = self.ids[rows[found]] == ids[found]
+        if self.live is not None:
+            found[found] = self.live[rows[found]]
+        return rows[found], found
+
+    def similarities(self, query_vector: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query to each id; 0 for ids without a vector"""
+        rows, found = self._rows_of(ids)
+        scores = np.zeros(ids.size, dtype=np.float32)
+        scores[found] = self.vectors[rows] @ query_vector
+        return scores
+
+    def search(self, query_vector: np.ndarray, k: int, candidates: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (ids, cosine similarities) among all live rows, or among candidate ids"""
+        if candidates is None:
+            ids = self.ids
+            scores = self.vectors @ query_vector
+            if self.live is not None:
+                ids, scores = ids[self.live], scores[self.live]
+        else:
+            rows, found = self._rows_of(candidates)
+            ids = candidates[found]
+            scores = self.vectors[rows] @ query_vector
+        indices = top_k_indices(scores, k)
+        return ids[indices], scores[indices]
+
+
+class VectorWriter:
+    """Appends embedded rows to a collection's files; ``commit`` publishes them
+
+    A collection started afresh (no base) is written to staged files, which
+    ``commit`` moves into place: until then its old files, and whatever maps
+    them, are left alone, so the rows can be embedded without the collection's
+    write lock.
+    """
+
+    def __init__(self, store: "VectorStore", key: Key, base: Optional[VectorMatrix]):
+        self.store = store
+        self.key = key
+        self.base = base
+        self.rows = base.rows if base is not None else 0
+        self.last_id = int(base.ids[-1]) if base is not None and base.rows else None
+        # Set when ids stop ascending; record ids are never reused, so only callers
+        # passing rows out of id order trip it
+        self.stale = False
+        path = store.path(key)
+        self._files = []
+        for suffix, itemsize in ((".f32", 4 * store.dim), (".ids", 8)):
+            if base is None:
+                self._files.append(open(path + suffix + STAGED, "wb"))
+                continue
+            f = open(path + suffix, "ab")
+            # Drop trailing bytes of an interrupted write; the mapped rows stay as they are
+            _truncate(f, self.rows * itemsize)
+            self._files.append(f)
+
+    def add(self, ids: Sequence[int], texts: Sequence[str]) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.stale or not ids.size:
+            return
+        if (self.last_id is not None and ids[0] <= self.last_id) or np.any(ids[1:] <= ids[:-1]):
+            self.stale = True
+            return
+        vectors_file, ids_file = self._files
+        vectors_file.write(self.store.embed(texts).tobytes())
+        ids_file.write(ids.tobytes())
+        self.rows += ids.size
+        self.last_id = int(ids[-1])
+
+    def commit(self, fingerprint: Any) -> Optional[VectorMatrix]:
+        """Publish the rows; None if they could not be kept in id order, and the collection must be embedded again"""
+        for f in self._files:
+            f.close()
+        if self.stale:
+            self._discard_staged()
+            self.store.remove(self.key)
+            return None
+        if self.base is not None:
+            return self.store._publish(self.key, self.rows, self.base.deleted, fingerprint)
+        # New files rather than truncated ones: readers may still map the old
+        self.store.remove(self.key)
+        path = self.store.path(self.key)
+        for suffix in (".f32", ".ids"):
+            os.replace(path + suffix + STAGED, path + suffix)
+        return self.store._publish(self.key, self.rows, np.empty(0, dtype=np.int64), fingerprint)
+
+    def abort(self) -> None:
+        """Leave the collection as it was; appended bytes lie beyond the committed row count"""
+        for f in self._files:
+            f.close()
+        self._discard_staged()
+
+    def _discard_staged(self) -> None:
+        if self.base is None:
+            path = self.store.path(self.key)
+            for suffix in (".f32", ".ids"):
+                if os.path.exists(path + suffix + STAGED):
+                    os.remove(path + suffix + STAGED)
+
+
+class VectorStore:
+    """Embedding matrices of every collection, loaded on demand
+
+    Callers serialise writes to a collection, and the commits of its builds,
+    with the write lock of the storage holding its records; embedding a build
+    (``stage``) and reads need no locking.
+    """
+
+    def __init__(self, directory: str, embedder: Embedder):
+        self.directory = directory
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self._matrices: Dict[Key, VectorMatrix] = {}
+        self._lock = threading.Lock()
+
+    def path(self, key: Key) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, "documents" if key is None else f"dataset{key}")
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return np.ascontiguousarray(self.embedder(texts), dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    def empty(self) -> VectorMatrix:
+        """A matrix without rows, for collections that do not exist"""
+        return VectorMatrix(
+            np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64), None
+        )
+
+    def get(self, key: Key) -> Optional[VectorMatrix]:
+        """The loaded matrix of a collection, if any"""
+        return self._matrices.get(key)
+
+    def items(self) -> List[Tuple[Key, VectorMatrix]]:
+        with self._lock:
+            return list(self._matrices.items())
+
+    def open(self, key: Key, fingerprint: Any) -> Optional[VectorMatrix]:
+        """The collection's matrix if it reflects fingerprint, mapping it from disk if needed
+
+        Files that do not match are removed; None means the collection must be
+        embedded again.
+        """
+        matrix = self._matrices.get(key)
+        if matrix is not None and matrix.fingerprint == fingerprint:
+            return matrix
+        path = self.path(key)
+        try:
+            with open(path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if (
+            meta is None
+            or meta.get("embedder") != self.embedder.name
+            or meta.get("dim") != self.dim
+            or meta.get("fingerprint") != fingerprint
+        ):
+            self.remove(key)
+            return None
+        try:
+            matrix = VectorMatrix(
+                self._map(path + ".ids", np.int64, (meta["rows"],)),
+                self._map(path + ".f32", np.float32, (meta["rows"], self.dim)),
+                np.sort(self._map(path + ".deleted", np.int64, (meta["deleted"],))),
+                fingerprint,
+            )
+        except (OSError, ValueError):
+            # Files shorter than their metadata says
+            self.remove(key)
+            return None
+        return self._register(key, matrix)
+
+    def writer(self, key: Key, base: Optional[VectorMatrix] = None) -> VectorWriter:
+        """Writer appending to base (an opened matrix of the collection), or starting it afresh"""
+        return VectorWriter(self, key, base)
+
+    def stage(self, key: Key, pages: Iterable[Sequence[Tuple[int, str]]]) -> VectorWriter:
+        """Embed a collection from (id, text) pages in ascending id order; the writer's commit publishes it"""
+        writer = self.writer(key)
+        try:
+            for page in pages:
+                writer.add([doc_id for doc_id, _ in page], [text for _, text in page])
+        except BaseException:
+            writer.abort()
+            raise
+        return writer
+
+    def build(self, key: Key, pages: Iterable[Sequence[Tuple[int, str]]], fingerprint: Any) -> VectorMatrix:
+        """Embed a collection from (id, text) pages in ascending id order and publish it"""
+        return self.stage(key, pages).commit(fingerprint)
+
+    def delete(self, key: Key, ids: Sequence[int], fingerprint: Any) -> None:
+        """Mask deleted ids out of an opened matrix; compacts once half its rows are dead"""
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            return
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        rows, _ = matrix._rows_of(ids)
+        if rows.size == 0:
+            self._publish(key, matrix.rows, matrix.deleted, fingerprint)
+            return
+        path = self.path(key)
+        if 2 * (matrix.deleted.size + rows.size) > matrix.rows:
+            live = np.ones(matrix.rows, dtype=bool) if matrix.live is None else matrix.live.copy()
+            live[rows] = False
+            for suffix, array in ((".f32", matrix.vectors), (".ids", matrix.ids)):
+                with open(path + suffix + ".tmp", "wb") as f:
+                    for start in range(0, matrix.rows, COMPACT_CHUNK_ROWS):
+                        end = start + COMPACT_CHUNK_ROWS
+                        f.write(np.ascontiguousarray(array[start:end][live[start:end]]).tobytes())
+            # Metadata first: a crash in between leaves files that fail the row count check, not wrong rows
+            self._remove_meta(key)
+            os.replace(path + ".f32.tmp", path + ".f32")
+            os.replace(path + ".ids.tmp", path + ".ids")
+            if os.path.exists(path + ".deleted"):
+                os.remove(path + ".deleted")
+            self._publish(key, int(live.sum()), np.empty(0, dtype=np.int64), fingerprint)
+            return
+        newly_deleted = matrix.ids[rows]
+        with open(path + ".deleted", "ab") as f:
+            _truncate(f, matrix.deleted.size * 8)
+            f.write(newly_deleted.tobytes())
+        self._publish(key, matrix.rows, np.union1d(matrix.deleted, newly_deleted), fingerprint)
+
+    def remove(self, key: Key) -> None:
+        """Forget a collection and delete its files"""
+        with self._lock:
+            self._matrices.pop(key, None)
+        self._remove_meta(key)
+        path = self.path(key)
+        for suffix in (".f32", ".ids", ".deleted"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def _remove_meta(self, key: Key) -> None:
+        path = self.path(key) + ".json"
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _publish(self, key: Key, rows: int, deleted: np.ndarray, fingerprint: Any) -> VectorMatrix:
+        """Write the metadata for the files as they now are and map them"""
+        path = self.path(key)
+        meta = {
+            "embedder": self.embedder.name,
+            "dim": self.dim,
+            "rows": rows,
+            "deleted": int(deleted.size),
+            "fingerprint": fingerprint,
+        }
+        with open(path + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(path + ".json.tmp", path + ".json")
+        return self._register(key, VectorMatrix(
+            self._map(path + ".ids", np.int64, (rows,)),
+            self._map(path + ".f32", np.float32, (rows, self.dim)),
+            deleted,
+            fingerprint,
+        ))
+
+    def _register(self, key: Key, matrix: VectorMatrix) -> VectorMatrix:
+        with self._lock:
+            self._matrices[key] = matrix
+        return matrix
+
+    @staticmethod
+    def _map(path: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        if not shape[0]:
+            return np.empty(shape, dtype=dtype)
+        if not MAP_VECTORS:
+            # A mapping would make the next append's truncate or compaction's replace fail
+            count = int(np.prod(shape))
+            array = np.fromfile(path, dtype=dtype, count=count)
+            if array.size < count:
+                raise ValueError(f"{path} holds fewer rows than expected")
+            return array.reshape(shape)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def _truncate(f, size: int) -> None:
+    """Cut a file opened for appending back to size bytes, if it is longer"""
+    # Only after an interrupted write: the common case never resizes a file that may be mapped
+    if os.fstat(f.fileno()).st_size > size:
+        f.truncate(size)
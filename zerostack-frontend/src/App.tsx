@@ -70,11 +70,19 @@ function App() {
 
   const loadDatasets = async () => {
     try {
-      const response = await fetch(DATASETS_URL);
-      if (response.ok) {
-        const data = await response.json();
-        setDatasets(data);
+      // /datasets is paginated: follow X-Next-Cursor until the last page
+      const all: Dataset[] = [];
+      let url: string | null = DATASETS_URL;
+      while (url) {
+        const response: Response = await fetch(url);
+        if (!response.ok) {
+          return;
+        }
+        all.push(...(await response.json()));
+        const cursor = response.headers.get("X-Next-Cursor");
+        url = cursor ? `${DATASETS_URL}?after=${cursor}` : null;
       }
+      setDatasets(all);
     } catch (err) {
       console.error("Failed to load datasets:", err);
     }